@@ -1,131 +1,4596 @@
 import sqlite3
 import csv
+import collections
+import email.message
+import email.utils
+import hashlib
 import io
 import json
+import math
 import os
+import re
+import queue
+import select
+import signal
+import socket
+import threading
+import time
+import traceback
 import urllib.parse
+import zlib
+import argparse
+import array
+import base64
+import bisect
+import heapq
+import functools
+import inspect
+import itertools
+import asyncio
+import concurrent.futures
+import contextlib
+import gzip
+import shutil
+import sys
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import html
 
+class ConnectionPool:
+    """Hands out one long-lived SQLite connection per thread.
+
+    Connections are opened lazily the first time a thread asks for one and
+    are kept for the life of the pool, so request handlers never pay for
+    connect/close. Statements are cached per connection by the sqlite3
+    module, so repeated queries skip re-preparation.
+    """
+    def __init__(self, db_path, synchronous='NORMAL', cache_size=-16000,
+                 mmap_size=256 * 1024 * 1024, cached_statements=256, timeout=30.0):
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pid = os.getpid()
+    
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                               cached_statements=self.cached_statements)
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+    
+    def connection(self):
+        """Return the calling thread's connection, opening it if needed."""
+        if self._pid != os.getpid():
+            # Connections must never cross a fork; start over in the child.
+            self._reset_after_fork()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    def release(self):
+        """Close the calling thread's connection, e.g. when a worker exits."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+    
+    def _reset_after_fork(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pid = os.getpid()
+    
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Owned by another thread; it is released when that thread exits.
+                pass
+        self._local = threading.local()
+
+class Metrics:
+    """Process-wide counters and histograms rendered in Prometheus text format.
+
+    Observations take one lock and a bisect, cheap enough to leave on for
+    every request and every LinkManager call. Label values must come from a
+    small fixed set (route templates, method names), never raw URLs.
+    """
+    DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+    ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 10000, 100000)
+    # name -> (type, help, histogram buckets)
+    DEFINITIONS = {
+        'links_http_requests_total': ('counter', 'HTTP requests by route, method and status.', None),
+        'links_http_request_duration_seconds': ('histogram', 'Time to handle a request, by route.', DURATION_BUCKETS),
+        'links_http_response_size_bytes': ('histogram', 'Response body bytes sent, by route.', SIZE_BUCKETS),
+        'links_http_rejected_connections_total': ('counter', 'Connections refused with 503 because the queue was full.', None),
+        'links_sql_calls_total': ('counter', 'LinkManager calls, by method.', None),
+        'links_sql_duration_seconds': ('histogram', 'Time spent in the database per LinkManager call.', DURATION_BUCKETS),
+        'links_sql_rows': ('histogram', 'Rows returned or written per LinkManager call.', ROW_BUCKETS),
+        'links_health_checks_total': ('counter', 'Links checked by the link checker, by resulting state.', None),
+        'links_snapshots_total': ('counter', 'Database snapshots taken, by result.', None),
+    }
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self.in_flight = 0
+    
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        buckets = self.DEFINITIONS[name][2]
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def add_in_flight(self, amount):
+        with self._lock:
+            self.in_flight += amount
+    
+    @staticmethod
+    def format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+    
+    def render(self, samples=()):
+        """Prometheus exposition text; ``samples`` adds (name, type, help, value) values read at scrape time."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(buckets), total, count))
+                                for key, (buckets, total, count) in self._histograms.items())
+            in_flight = self.in_flight
+        lines = []
+        described = set()
+        
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, help_text, _ = self.DEFINITIONS[name]
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+        
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f'{name}{self.format_labels(labels)} {value}')
+        for (name, labels), (buckets, total, count) in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, hits in zip(self.DEFINITIONS[name][2] + ('+Inf',), buckets):
+                cumulative += hits
+                lines.append(f'{name}_bucket{self.format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{self.format_labels(labels)} {total}')
+            lines.append(f'{name}_count{self.format_labels(labels)} {count}')
+        samples = [('links_http_requests_in_flight', 'gauge', 'Requests being handled now.', in_flight)] + list(samples)
+        for name, kind, help_text, value in samples:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+
+# Per-thread record of the LinkManager calls made while handling one request,
+# for the slow-request log; ``calls`` is None outside a request.
+_sql_trace = threading.local()
+
+def result_rows(result):
+    """Best-effort row count of a LinkManager return value."""
+    if result is None:
+        return 0
+    if isinstance(result, bool):
+        return 1
+    if isinstance(result, int):
+        return result
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        if 'links' in result:
+            return len(result['links'])
+        if 'imported' in result:
+            return result['imported']
+        return 1
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], list):
+        return len(result[1])
+    return 1
+
+def record_sql(name, elapsed, rows):
+    labels = (('method', name),)
+    METRICS.inc('links_sql_calls_total', labels)
+    METRICS.observe('links_sql_duration_seconds', labels, elapsed)
+    METRICS.observe('links_sql_rows', labels, rows)
+    calls = getattr(_sql_trace, 'calls', None)
+    if calls is not None:
+        calls.append((name, elapsed, rows))
+
+def instrumented(method):
+    """Time a LinkManager method and count its rows into METRICS.
+
+    Calls made from inside another instrumented method are folded into the
+    outer one. Generators are timed only while producing rows, so the time
+    a caller spends streaming them out is not charged to the database.
+    """
+    name = method.__name__
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator(self, *args, **kwargs):
+            rows, elapsed = 0, 0.0
+            iterator = method(self, *args, **kwargs)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        elapsed += time.perf_counter() - start
+                    rows += 1
+                    yield item
+            finally:
+                record_sql(name, elapsed, rows)
+        return generator
+    
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        depth = getattr(_sql_trace, 'depth', 0)
+        _sql_trace.depth = depth + 1
+        result = None
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        finally:
+            _sql_trace.depth = depth
+            if depth == 0:
+                record_sql(name, time.perf_counter() - start, result_rows(result))
+    return wrapper
+
+# Markers wrapped around matched terms by FTS5 highlight(); they cannot occur
+# in user text and survive html.escape(), so rendering can swap in <mark>.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+def highlight_html(text):
+    return html.escape(text or '').replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+def build_fts_query(query, tokenizer='unicode61'):
+    """Translate a search box query into an FTS5 MATCH expression.
+
+    "Quoted text" is a phrase, every other word matches as a prefix (or as a
+    substring with the trigram tokenizer). Returns None when the query cannot
+    be answered by the index, e.g. trigram terms shorter than three characters.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        text = (phrase or word).strip()
+        prefix = bool(word) and tokenizer != 'trigram'
+        if word.endswith('*'):
+            text = text.rstrip('*')
+        if not text:
+            continue
+        if tokenizer == 'trigram' and len(text) < 3:
+            return None
+        term = '"' + text.replace('"', '""') + '"'
+        terms.append(term + '*' if prefix else term)
+    return ' '.join(terms) or None
+
+def parse_tag_filter(text):
+    """Parse a tag filter such as ``python|rust,web,-old``.
+
+    Commas AND their terms together, ``|`` ORs tags within a term and a
+    leading ``-`` excludes a tag. Returns (clauses, excluded): a list of
+    tag lists that must each match at least once, and tags that must not
+    match. Raises ValueError for filters that cannot be answered.
+    """
+    clauses, excluded = [], []
+    for term in text.split(','):
+        names = [name.strip() for name in term.split('|')]
+        names = [name for name in names if name]
+        if not names:
+            continue
+        negated = [name for name in names if name.startswith('-')]
+        if negated and len(names) > 1:
+            raise ValueError(f'cannot combine - and | in tag filter term {term.strip()!r}')
+        if negated:
+            name = names[0][1:].strip()
+            if name:
+                excluded.append(name)
+        else:
+            clauses.append(names)
+    if not clauses and not excluded:
+        raise ValueError('empty tag filter')
+    return clauses, excluded
+
+# Query parameters that only record where a visitor came from; any utm_* too.
+TRACKING_PARAMS = frozenset({'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'igshid', 'yclid'})
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+# What adding a link whose canonical URL is already stored does: leave the
+# stored link alone, add the new tags to it, or overwrite it.
+DUPLICATE_POLICIES = ('reject', 'merge', 'update')
+UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+
+class DuplicateLinkError(ValueError):
+    """The URL canonicalizes to one that is already stored."""
+    def __init__(self, existing_id):
+        super().__init__(f'this URL is already stored as link {existing_id}')
+        self.existing_id = existing_id
+
+class ExpiredCursorError(ValueError):
+    """A change-log cursor older than tombstones that have since been dropped."""
+
+class RequestTooLargeError(ValueError):
+    """A request body over the size the server accepts."""
+
+def canonical_url(url):
+    """Normalize ``url`` so that spellings of the same address compare equal.
+
+    Lower-cases the scheme and host, drops default ports, tracking
+    parameters (``utm_*``, ``fbclid`` ...) and the fragment (except ``#!``
+    routes), sorts the query by key, normalizes percent-escapes and removes
+    trailing slashes from the path.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    userinfo, at, host = parts.netloc.rpartition('@')
+    host = host.lower()
+    if host.endswith(':' + DEFAULT_PORTS.get(scheme, '')) or host.endswith(':'):
+        host = host.rsplit(':', 1)[0]
+    host = host.rstrip('.')
+    
+    def escape(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in UNRESERVED else match.group(0).upper()
+    path = parts.path
+    if '%' in path:
+        path = re.sub(r'%([0-9a-fA-F]{2})', escape, path)
+    query = ''
+    if parts.query:
+        pairs = [(key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                 if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS]
+        pairs.sort(key=lambda pair: pair[0])
+        query = urllib.parse.urlencode(pairs)
+    fragment = parts.fragment if parts.fragment.startswith('!') else ''
+    return urllib.parse.urlunsplit((scheme, userinfo + at + host, path.rstrip('/'), query, fragment))
+
+def url_key(url):
+    """(canonical URL, 64-bit hash of it) as stored in ``links``."""
+    canonical = canonical_url(url)
+    digest = hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest()
+    return canonical, int.from_bytes(digest, 'big', signed=True)
+
+def merge_tags(current, incoming):
+    """Comma-separated tags of ``current`` followed by the new ones from ``incoming``."""
+    tags, seen = [], set()
+    for tag in (current or '').split(',') + (incoming or '').split(','):
+        tag = tag.strip()
+        if tag and tag.lower() not in seen:
+            seen.add(tag.lower())
+            tags.append(tag)
+    return ', '.join(tags)
+
+def resolve_duplicate(current, incoming, on_duplicate):
+    """The (description, tags, url, file_group) a duplicate leaves behind."""
+    if on_duplicate == 'update':
+        return tuple(incoming)
+    description, tags, url, file_group = current
+    return description, merge_tags(tags, incoming[1]), url, file_group
+
+def encode_cursor(values):
+    """Opaque page token for a keyset position such as ``[sort_value, id]``."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def is_sql_scalar(value):
+    """Whether SQLite can bind ``value`` as a parameter."""
+    if isinstance(value, int):
+        return -1 << 63 <= value < 1 << 63
+    return value is None or isinstance(value, (str, float))
+
+def decode_cursor(token, length=None):
+    """Inverse of encode_cursor(); raises ValueError for a malformed token or one not ``length`` values long.
+
+    Every value must be one SQLite can bind, and the last an integer id.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'invalid page cursor: {token!r}') from e
+    if (not isinstance(values, list) or not values or not isinstance(values[-1], int)
+            or not all(is_sql_scalar(value) for value in values)):
+        raise ValueError(f'invalid page cursor: {token!r}')
+    if length is not None and len(values) != length:
+        raise ValueError(f'invalid page cursor: {token!r}')
+    return values
+
+class LinkReplica:
+    """In-memory copy of the ``links`` table for the read-mostly paths.
+
+    Columns are parallel lists ordered by id, with the ids themselves in an
+    ``array('q')``, so a link is found by bisection without a dict per row.
+    Group names are interned and every group keeps the sorted ids of its
+    links. LinkManager applies its own writes just before they commit;
+    ``generation`` is the data_version the copy matches, so a change made
+    anywhere else (another process, say) shows up as a gap and the copy is
+    reloaded. Once the estimated size passes ``budget`` bytes the data is
+    dropped and reads go back to SQLite.
+    """
+    # Bytes per row besides its strings: the id, four list slots and the group index entry.
+    ROW_OVERHEAD = 8 + 4 * 8 + 8
+    
+    def __init__(self, budget):
+        self.budget = budget
+        self.lock = threading.Lock()
+        # None until loaded, and again once the copy is known to be stale.
+        self.generation = None
+        self.checked = 0.0
+        self.loading = False
+        self.overflowed = False
+        self.loads = 0
+        self._clear()
+    
+    def _clear(self):
+        self.ids = array.array('q')
+        self.descriptions, self.tags, self.urls, self.groups = [], [], [], []
+        self.group_ids = {}
+        self._group_names = None
+        self.size = 0
+        # Writes made during a reload, keyed by the generation they started from.
+        self.pending = {}
+    
+    @classmethod
+    def row_size(cls, description, tags, url):
+        # Empty tags are the shared None or '' objects and cost nothing extra.
+        return (sys.getsizeof(description) + sys.getsizeof(url) + (sys.getsizeof(tags) if tags else 0)
+                + cls.ROW_OVERHEAD)
+    
+    def load(self, conn):
+        """Read the whole table from one snapshot; returns False if it is over budget or already stale."""
+        ids = array.array('q')
+        descriptions, tags, urls, groups = [], [], [], []
+        group_ids = {}
+        size = 0
+        intern = sys.intern
+        row_size = self.row_size
+        conn.execute('BEGIN')
+        try:
+            generation = conn.execute('SELECT generation FROM data_version WHERE id = 1').fetchone()[0]
+            cursor = conn.execute('SELECT id, description, tags, url, file_group FROM links ORDER BY id')
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                for link_id, description, link_tags, url, group in rows:
+                    group = intern(group)
+                    ids.append(link_id)
+                    descriptions.append(description)
+                    tags.append(link_tags)
+                    urls.append(url)
+                    groups.append(group)
+                    members = group_ids.get(group)
+                    if members is None:
+                        members = group_ids[group] = array.array('q')
+                    members.append(link_id)
+                    size += row_size(description, link_tags, url)
+                if size > self.budget:
+                    break
+        finally:
+            conn.commit()
+        with self.lock:
+            pending = self.pending
+            self._clear()
+            self.loads += 1
+            if size > self.budget:
+                self.overflowed = True
+                self.generation = None
+                return False
+            self.ids, self.descriptions, self.tags, self.urls, self.groups = ids, descriptions, tags, urls, groups
+            self.group_ids = group_ids
+            self.size = size
+            self.generation = generation
+            self.checked = time.monotonic()
+            # Writes that committed while we were reading go on top of the snapshot.
+            self.pending = pending
+            return self._catch_up()
+    
+    def observe(self, generation):
+        """Compare with the current data generation; returns False once the copy is stale.
+
+        A generation older than the copy's was read before one of our writes.
+        """
+        with self.lock:
+            self.checked = time.monotonic()
+            if self.generation is None:
+                return False
+            if generation > self.generation:
+                self._clear()
+                self.generation = None
+                return False
+            return True
+    
+    def apply(self, before, after, rows, deleted):
+        """Apply a write that takes the generation from ``before`` to ``after``.
+
+        ``rows`` are the (id, description, tags, url, file_group) rows it
+        wrote and ``deleted`` the ids it removed. Called with the database
+        write lock held, so writes arrive in commit order; during a reload
+        they are kept until the snapshot is in. Returns False if the copy is
+        now stale or over budget.
+        """
+        with self.lock:
+            if after != before and (self.generation is not None or self.loading):
+                self.pending[before] = (after, rows, deleted)
+            if self.generation is None:
+                return False
+            return self._catch_up()
+    
+    def invalidate(self):
+        with self.lock:
+            self._clear()
+            self.generation = None
+    
+    def _catch_up(self):
+        """Apply pending writes in generation order; returns False if the copy became stale."""
+        for before in [before for before in self.pending if before < self.generation]:
+            # Already in the snapshot a load just read.
+            del self.pending[before]
+        while self.generation in self.pending:
+            after, rows, deleted = self.pending.pop(self.generation)
+            for link_id in deleted:
+                self._remove(link_id)
+            for row in rows:
+                self._put(row)
+            self.generation = after
+        if self.pending:
+            # Someone else wrote in between.
+            self._clear()
+            self.generation = None
+            return False
+        if self.size > self.budget:
+            self.overflowed = True
+            self._clear()
+            self.generation = None
+            return False
+        return True
+    
+    def _index(self, link_id):
+        index = bisect.bisect_left(self.ids, link_id)
+        if index < len(self.ids) and self.ids[index] == link_id:
+            return index
+        return None
+    
+    def _put(self, row):
+        link_id, description, tags, url, group = row
+        group = sys.intern(group)
+        index = self._index(link_id)
+        if index is None:
+            index = bisect.bisect_left(self.ids, link_id)
+            self.ids.insert(index, link_id)
+            self.descriptions.insert(index, description)
+            self.tags.insert(index, tags)
+            self.urls.insert(index, url)
+            self.groups.insert(index, group)
+            self._add_to_group(group, link_id)
+        else:
+            self.size -= self.row_size(self.descriptions[index], self.tags[index], self.urls[index])
+            self.descriptions[index] = description
+            self.tags[index] = tags
+            self.urls[index] = url
+            if self.groups[index] is not group:
+                self._remove_from_group(self.groups[index], link_id)
+                self.groups[index] = group
+                self._add_to_group(group, link_id)
+        self.size += self.row_size(description, tags, url)
+    
+    def _remove(self, link_id):
+        index = self._index(link_id)
+        if index is None:
+            return
+        self.size -= self.row_size(self.descriptions[index], self.tags[index], self.urls[index])
+        self._remove_from_group(self.groups[index], link_id)
+        del self.ids[index], self.descriptions[index], self.tags[index], self.urls[index], self.groups[index]
+    
+    def _add_to_group(self, group, link_id):
+        members = self.group_ids.get(group)
+        if members is None:
+            members = self.group_ids[group] = array.array('q')
+            self._group_names = None
+        if not members or members[-1] < link_id:
+            members.append(link_id)
+        else:
+            members.insert(bisect.bisect_left(members, link_id), link_id)
+    
+    def _remove_from_group(self, group, link_id):
+        members = self.group_ids[group]
+        del members[bisect.bisect_left(members, link_id)]
+        if not members:
+            del self.group_ids[group]
+            self._group_names = None
+    
+    def _row(self, index):
+        return (self.ids[index], self.descriptions[index], self.tags[index], self.urls[index], self.groups[index])
+    
+    def _link(self, index):
+        return {'id': self.ids[index], 'description': self.descriptions[index], 'tags': self.tags[index],
+                'url': self.urls[index], 'file_group': self.groups[index]}
+    
+    def get(self, link_id):
+        with self.lock:
+            index = self._index(link_id)
+            return None if index is None else self._link(index)
+    
+    def all(self):
+        with self.lock:
+            return [self._link(index) for index in range(len(self.ids))]
+    
+    def by_group(self, group):
+        with self.lock:
+            members = self.group_ids.get(group, ())
+            if len(members) == len(self.ids):
+                return [self._link(index) for index in range(len(self.ids))]
+            return [self._link(self._index(link_id)) for link_id in members]
+    
+    def group_names(self):
+        with self.lock:
+            if self._group_names is None:
+                self._group_names = sorted(self.group_ids)
+            return list(self._group_names)
+    
+    def _scan(self, ids, descending, start, count):
+        """Up to ``count`` of the sorted ``ids`` past ``start`` (an id, or None) in scan order."""
+        if descending:
+            end = len(ids) if start is None else bisect.bisect_left(ids, start)
+            chunk = ids[max(0, end - count):end]
+            chunk.reverse()
+            return chunk
+        begin = 0 if start is None else bisect.bisect_right(ids, start)
+        return ids[begin:begin + count]
+    
+    def page_rows(self, group, descending, start, count):
+        """(id, description, tags, url, file_group) rows of a listing in id order, as in get_links_page()."""
+        with self.lock:
+            if group is None:
+                link_ids = self._scan(self.ids, descending, start, count)
+            else:
+                link_ids = self._scan(self.group_ids.get(group, array.array('q')), descending, start, count)
+            return [self._row(self._index(link_id)) for link_id in link_ids]
+    
+    def iter_links(self, group, descending, batch_size=500):
+        """Yield a listing in id order without holding the lock between batches."""
+        start = None
+        while True:
+            rows = self.page_rows(group, descending, start, batch_size)
+            for l in rows:
+                yield {'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]}
+            if len(rows) < batch_size:
+                return
+            start = rows[-1][0]
+
+class SuggestIndex:
+    """Prefix index of description words, tags, group names and URL hosts, for typeahead.
+
+    Every distinct term is a (folded, kind, text) tuple in one sorted list,
+    so the completions of a prefix are the slice found by two bisections;
+    ``counts`` says how many links use each term. The best completions of
+    recently asked prefixes are cached and patched in place as counts
+    change. Unlike LinkReplica the index may lag behind: LinkManager applies
+    its own writes to it, and once the data generation shows changes made
+    elsewhere it is rebuilt, at most every ``REBUILD_INTERVAL`` seconds.
+    """
+    KINDS = ('word', 'tag', 'group', 'host')
+    # Completions cached per prefix, and how many prefixes are cached.
+    MAX_K = 50
+    CACHE_SIZE = 4096
+    # Longer prefixes are not cached; they match few terms anyway.
+    MAX_PREFIX = 32
+    REBUILD_INTERVAL = 30.0
+    # Words start with a letter and are at least two characters long.
+    WORD = re.compile(r'\b[^\W\d_]\w+')
+    # The host of an absolute URL; much cheaper than urlsplit() over a whole table.
+    HOST = re.compile(r'[A-Za-z][\w+.-]*://(?:[^/?#@]*@)?([^/?#:@\[\]]+)')
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.terms = []
+        self.counts = {}
+        self._top = collections.OrderedDict()
+        # None until loaded; ``stale`` once writes from elsewhere are known to be missing.
+        self.generation = None
+        self.stale = False
+        self.checked = 0.0
+        self.loaded = 0.0
+        self.loading = False
+        self.loads = 0
+        # Writes made during a rebuild, in commit order.
+        self.pending = []
+    
+    @classmethod
+    def link_terms(cls, description, tags, url, group):
+        """The set of (folded, kind, text) terms one link contributes."""
+        # Lower-cased ASCII is already folded; the same string then serves as both.
+        terms = {(word if word.isascii() else word.casefold(), 'word', word)
+                 for word in cls.WORD.findall(description.lower())}
+        if tags:
+            for tag in tags.split(','):
+                tag = tag.strip().lower()
+                if tag:
+                    terms.add((tag if tag.isascii() else tag.casefold(), 'tag', tag))
+        if group:
+            terms.add((group.casefold(), 'group', group))
+        match = cls.HOST.match(url)
+        if match:
+            host = match[1].lower().removeprefix('www.')
+            terms.add((host if host.isascii() else host.casefold(), 'host', host))
+        return terms
+    
+    def load(self, conn):
+        """Count the terms of the whole table from one snapshot."""
+        counts = collections.Counter()
+        link_terms = self.link_terms
+        conn.execute('BEGIN')
+        try:
+            generation = conn.execute('SELECT generation FROM data_version WHERE id = 1').fetchone()[0]
+            cursor = conn.execute('SELECT description, tags, url, file_group FROM links')
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                for row in rows:
+                    counts.update(link_terms(*row))
+        finally:
+            conn.commit()
+        terms = sorted(counts)
+        with self.lock:
+            self.terms, self.counts = terms, dict(counts)
+            self._top.clear()
+            self.generation = generation
+            self.stale = False
+            self.loaded = self.checked = time.monotonic()
+            self.loads += 1
+            pending, self.pending = self.pending, []
+            for before, after, old_rows, rows in pending:
+                if before < generation:
+                    # Already in the snapshot.
+                    continue
+                self._apply(before, after, old_rows, rows)
+    
+    def observe(self, generation):
+        """Compare with the current data generation; returns False if the index should be rebuilt."""
+        with self.lock:
+            self.checked = time.monotonic()
+            if self.generation is not None and generation > self.generation:
+                self.stale = True
+            return not self.stale
+    
+    def apply(self, before, after, old_rows, rows):
+        """Apply a write that takes the generation from ``before`` to ``after``.
+
+        ``old_rows`` are the (id, description, tags, url, file_group) rows as
+        they were before the write, with a None description for links it
+        created, and ``rows`` the same links afterwards; deleted links are
+        only in ``old_rows``. Called with the database write lock held.
+        """
+        with self.lock:
+            if self.loading:
+                self.pending.append((before, after, old_rows, rows))
+            if self.generation is not None:
+                self._apply(before, after, old_rows, rows)
+    
+    def invalidate(self):
+        with self.lock:
+            self.stale = True
+    
+    def _apply(self, before, after, old_rows, rows):
+        if before != self.generation:
+            # Someone else wrote in between; keep serving, but rebuild.
+            self.stale = True
+        deltas = collections.Counter()
+        for row in old_rows:
+            if row[1] is not None:
+                deltas.subtract(self.link_terms(*row[1:]))
+        for row in rows:
+            deltas.update(self.link_terms(*row[1:]))
+        for term, delta in deltas.items():
+            if delta:
+                self._count(term, delta)
+        self.generation = max(self.generation, after)
+    
+    def _count(self, term, delta):
+        terms = self.terms
+        count = self.counts.get(term, 0) + delta
+        if count > 0:
+            if term not in self.counts:
+                bisect.insort(terms, term)
+            self.counts[term] = count
+        elif term in self.counts:
+            del self.counts[term]
+            del terms[bisect.bisect_left(terms, term)]
+        folded = term[0]
+        for length in range(1, min(len(folded), self.MAX_PREFIX) + 1):
+            cached = self._top.get(folded[:length])
+            if cached is not None and not self._patch(cached, term, count, delta):
+                del self._top[folded[:length]]
+    
+    def _patch(self, cached, term, count, delta):
+        """Update a cached top list for a new count; returns False if it has to be recomputed."""
+        entries, complete = cached
+        index = next((i for i, entry in enumerate(entries) if entry[1] == term), None)
+        if index is not None:
+            if delta < 0 and not complete:
+                # A term outside the list may now rank higher.
+                return False
+            del entries[index]
+        elif not complete and entries and (-count, term) > entries[-1]:
+            return True
+        if count > 0:
+            bisect.insort(entries, (-count, term))
+        if len(entries) > self.MAX_K:
+            del entries[self.MAX_K:]
+            cached[1] = False
+        return True
+    
+    def _range(self, folded):
+        terms = self.terms
+        start = bisect.bisect_left(terms, (folded,))
+        end = bisect.bisect_left(terms, (folded + '\U0010ffff',), start)
+        return itertools.islice(terms, start, end)
+    
+    def query(self, prefix, limit=10, kinds=None):
+        """Up to ``limit`` terms starting with ``prefix``, most used first, as {text, kind, count} dicts."""
+        folded = prefix.lstrip().casefold()
+        if not folded:
+            return []
+        with self.lock:
+            # Under the lock: load() swaps terms and counts together.
+            counts = self.counts
+            cached = self._top.get(folded)
+            if cached is None:
+                entries = heapq.nsmallest(self.MAX_K + 1, ((-counts[term], term) for term in self._range(folded)))
+                cached = [entries[:self.MAX_K], len(entries) <= self.MAX_K]
+                if len(folded) <= self.MAX_PREFIX:
+                    self._top[folded] = cached
+                    if len(self._top) > self.CACHE_SIZE:
+                        self._top.popitem(last=False)
+            else:
+                self._top.move_to_end(folded)
+            entries, complete = cached
+            if kinds:
+                entries = [entry for entry in entries if entry[1][1] in kinds]
+                if len(entries) < limit and not complete:
+                    entries = heapq.nsmallest(limit, ((-counts[term], term) for term in self._range(folded)
+                                                      if term[1] in kinds))
+            return [{'text': term[2], 'kind': term[1], 'count': -count} for count, term in entries[:limit]]
+
+class GroupCommitQueue:
+    """One writer thread that commits queued single-link writes together.
+
+    Callers block on a Future while the writer takes everything queued and
+    hands each write operation all of its calls at once (see
+    LinkManager._write()), so fifty concurrent adds become one multi-row
+    insert in one transaction, with one commit and one sync. Futures are
+    resolved only after the commit. The writer waits up to ``max_delay``
+    seconds for as many writes as its last batch had, so a lone writer
+    is not held back, and never takes over ``max_batch`` writes at once.
+    Its connection syncs every commit (``synchronous = FULL``), so an
+    acknowledged write survives a power cut too.
+    """
+    def __init__(self, manager, max_batch=256, max_delay=0.002):
+        self.manager = manager
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+    
+    def submit(self, operation, args):
+        """Queue one call of a write operation; returns its result once committed."""
+        future = concurrent.futures.Future()
+        self._writer_queue().put((operation, args, future))
+        return future.result()
+    
+    def _writer_queue(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # Threads do not survive a fork, so each process starts its own writer.
+            with self._lock:
+                if self._pid != pid:
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, args=(self._queue,), name='group-commit',
+                                                    daemon=True)
+                    self._thread.start()
+                    self._pid = pid
+        return self._queue
+    
+    def close(self):
+        """Commit what is queued and stop the writer."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._pid = None
+            self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self, writes):
+        conn = self.manager.pool.connection()
+        conn.execute('PRAGMA synchronous = FULL')
+        self.manager._create_staging(conn)
+        expected = 1
+        try:
+            while True:
+                item = writes.get()
+                if item is None:
+                    return
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    # Wait for about as many writers as last time, then take only what is already queued.
+                    timeout = deadline - time.monotonic() if len(batch) < expected else 0
+                    try:
+                        item = writes.get(timeout=timeout) if timeout > 0 else writes.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        writes.put(None)
+                        break
+                    batch.append(item)
+                expected = len(batch)
+                self._commit(conn, batch)
+        finally:
+            self.manager.pool.release()
+    
+    def _commit(self, conn, batch):
+        # Calls in one batch come from different callers and may run in any order.
+        calls = {}
+        for operation, args, future in batch:
+            calls.setdefault(operation, []).append((args, future))
+        outcomes = []
+        try:
+            with self.manager._write_transaction(conn) as (changed, deleted):
+                for operation, items in calls.items():
+                    results = self._run_savepoint(conn, changed, deleted, operation, [args for args, _ in items])
+                    if isinstance(results, Exception):
+                        # Something failed for the whole group: run the calls one by one to find which.
+                        results = []
+                        for args, _ in items:
+                            result = self._run_savepoint(conn, changed, deleted, operation, [args])
+                            results.append(result if isinstance(result, Exception) else result[0])
+                    outcomes += zip((future for _, future in items), results)
+        except Exception as e:
+            # The commit itself failed: nothing in the batch was written.
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result in outcomes:
+            future.set_result(result)
+    
+    def _run_savepoint(self, conn, changed, deleted, operation, calls):
+        """Results of ``operation`` over ``calls``, or the exception that undid all of them."""
+        own_changed, own_deleted = set(), set()
+        conn.execute('SAVEPOINT queued_writes')
+        try:
+            results = operation(conn, own_changed, own_deleted, calls)
+        except Exception as e:
+            conn.execute('ROLLBACK TO queued_writes')
+            results = e
+        else:
+            changed |= own_changed
+            deleted |= own_deleted
+        conn.execute('RELEASE queued_writes')
+        return results
+
+
+class _ClickShard:
+    __slots__ = ('lock', 'counts')
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {link id: [clicks, last clicked unix time]} since the last flush.
+        self.counts = {}
+
+class ClickCounter:
+    """Counts /go/ clicks in memory and adds them to ``link_clicks`` once per ``interval``.
+
+    Each request thread counts into one of ``shards`` dicts with a lock of
+    its own, so busy threads rarely wait on each other, and a flush only
+    holds a shard's lock long enough to swap its dict for an empty one. A
+    flusher thread, started on the first click in each process, merges the
+    shards and writes them with one upsert (LinkManager.record_clicks()),
+    however many clicks came in. Clicks not yet flushed are lost if the
+    process dies; close() flushes them on a clean shutdown.
+    """
+    def __init__(self, manager, interval=5.0, shards=16):
+        self.manager = manager
+        self.interval = interval
+        self.clicks = 0
+        self.flushes = 0
+        self._shards = [_ClickShard() for _ in range(shards)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+        self._pid = None
+    
+    def record(self, link_id):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._shards[next(self._next_shard) % len(self._shards)]
+        if self._pid != os.getpid():
+            self._start()
+        now = int(time.time())
+        with shard.lock:
+            entry = shard.counts.get(link_id)
+            if entry is None:
+                shard.counts[link_id] = [1, now]
+            else:
+                entry[0] += 1
+                entry[1] = now
+    
+    def pending(self):
+        """Clicks counted but not flushed yet."""
+        return sum(entry[0] for shard in self._shards for entry in list(shard.counts.values()))
+    
+    def flush(self):
+        """Write the counted clicks in one transaction; returns how many links got clicks."""
+        clicks = {}
+        for shard in self._shards:
+            with shard.lock:
+                counts, shard.counts = shard.counts, {}
+            for link_id, (count, last) in counts.items():
+                total = clicks.get(link_id)
+                if total is None:
+                    clicks[link_id] = [count, last]
+                else:
+                    total[0] += count
+                    total[1] = max(total[1], last)
+        if not clicks:
+            return 0
+        try:
+            self.manager.record_clicks(clicks)
+        except Exception:
+            # Keep them for the next flush.
+            shard = self._shards[0]
+            with shard.lock:
+                for link_id, (count, last) in clicks.items():
+                    entry = shard.counts.setdefault(link_id, [0, last])
+                    entry[0] += count
+                    entry[1] = max(entry[1], last)
+            raise
+        self.clicks += sum(count for count, _ in clicks.values())
+        self.flushes += 1
+        return len(clicks)
+    
+    def _start(self):
+        pid = os.getpid()
+        # Threads do not survive a fork, so each process starts its own flusher.
+        with self._lock:
+            if self._pid != pid:
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop,), name='click-flusher',
+                                                daemon=True)
+                self._thread.start()
+                self._pid = pid
+    
+    def close(self):
+        """Stop the flusher and write what it has not."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._pid = None
+            self._stop.set()
+        self._thread.join()
+    
+    def _run(self, stop):
+        try:
+            while not stop.wait(self.interval):
+                try:
+                    self.flush()
+                except Exception:
+                    traceback.print_exc()
+            self.flush()
+        finally:
+            self.manager.pool.release()
+
+
 class LinkManager:
-    def __init__(self, db_path='links.db'):
+    # Columns the listing can be ordered by, each backed by an index.
+    SORT_COLUMNS = {
+        'id': 'id',
+        'description': 'description',
+        'url': 'url',
+        'group': 'file_group',
+        'clicks': 'clicks',
+        'clicked': 'last_clicked',
+    }
+    # Sort columns that live in link_clicks rather than links; see init_clicks().
+    CLICK_COLUMNS = ('clicks', 'last_clicked')
+    # Fields of a link dict, in column order.
+    LINK_FIELDS = ('id', 'description', 'tags', 'url', 'file_group')
+    SEARCH_TOKENIZERS = {
+        # prefix='2 3' keeps short prefix queries on the index.
+        'unicode61': "tokenize='unicode61 remove_diacritics 2', prefix='2 3'",
+        # Indexes every 3-character substring, so "ample.co" finds example.com.
+        'trigram': "tokenize='trigram'",
+    }
+    # Splits a comma-separated tags value into a JSON array for json_each();
+    # json_quote() escapes everything, and commas never appear in escapes.
+    SPLIT_TAGS = "json_each('[' || replace(json_quote({0}), ',', '\",\"') || ']')"
+    # What LinkChecker found at a link's URL; see init_health().
+    HEALTH_STATES = ('unchecked', 'ok', 'redirected', 'broken', 'unreachable')
+    # Seconds a replica or the suggestion index is trusted before reads check the data generation again.
+    REPLICA_CHECK_INTERVAL = 1.0
+    # Redirect targets of recently followed /go/ links kept in memory.
+    TARGET_CACHE_SIZE = 4096
+    # Seconds between drops of expired tombstones, and between checks for
+    # other processes' changes while waiting in wait_for_changes().
+    CHANGE_COMPACT_INTERVAL = 3600.0
+    CHANGE_POLL_INTERVAL = 1.0
+    
+    def __init__(self, db_path='links.db', pool=None, search_tokenizer='unicode61',
+                 search_weights=(10.0, 5.0, 1.0), replica_bytes=0, write_batch=0, write_delay=0.002,
+                 suggest=False, click_interval=5.0, change_retention=30 * 86400):
+        if search_tokenizer not in self.SEARCH_TOKENIZERS:
+            raise ValueError(f'unknown search tokenizer: {search_tokenizer}')
         self.db_path = db_path
+        self.pool = pool or ConnectionPool(db_path)
+        self.search_tokenizer = search_tokenizer
+        # bm25() weights for the description, tags and url columns.
+        self.search_weights = tuple(float(w) for w in search_weights)
+        self.fts_enabled = False
+        # False while older rows still share a canonical URL; see merge_duplicates().
+        self.unique_urls = False
+        # Optional in-memory copy of the table and typeahead index; see LinkReplica and SuggestIndex.
+        self.replica = None
+        self.suggestions = None
+        self.init_db()
+        self.replica_overflowed = False
+        if replica_bytes:
+            self.replica = LinkReplica(replica_bytes)
+            self.load_replica()
+        if suggest:
+            self.suggestions = SuggestIndex()
+            self.suggestions.load(self.pool.connection())
+        # Single-link writes share transactions when group commit is on; see GroupCommitQueue.
+        self.write_queue = GroupCommitQueue(self, write_batch, write_delay) if write_batch > 0 else None
+        self.clicks = ClickCounter(self, click_interval)
+        # {id: url} of /go/ targets, least recently used first; see redirect_target().
+        self._targets = collections.OrderedDict()
+        self._targets_lock = threading.Lock()
+        self._targets_generation = None
+        self._targets_checked = 0.0
+        # Seconds tombstones stay in link_changes (0: forever); see compact_changes().
+        self.change_retention = change_retention
+        self._changes_compacted = None
+        # Notified after every commit, for wait_for_changes().
+        self._changes_cond = threading.Condition()
+        self._commits = 0
+        self._change_waiters = 0
+    
+    def init_db(self):
+        """Create the schema. Runs once per LinkManager, not per request."""
+        conn = self.pool.connection()
+        conn.execute('PRAGMA journal_mode = WAL')
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS links (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    description TEXT NOT NULL,
+                    tags TEXT,
+                    url TEXT NOT NULL,
+                    file_group TEXT NOT NULL,
+                    canonical_url TEXT,
+                    url_hash INTEGER
+                )
+            ''')
+        with conn:
+            # (column, id) indexes serve keyset pagination for every sort order.
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_links_description ON links (description, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_links_url ON links (url, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_links_group ON links (file_group, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_links_group_description ON links (file_group, description, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_links_group_url ON links (file_group, url, id)')
+        self.init_url_index(conn)
+        self.init_catalog(conn)
+        self.init_tag_index(conn)
+        self.init_data_version(conn)
+        self.init_health(conn)
+        self.init_clicks(conn)
+        self.init_changes(conn)
+        self.init_search_index(conn)
+    
+    def init_health(self, conn):
+        """Create ``link_health``, one row per link with the result of its last check, and ``health_version``.
+
+        Triggers give new links an 'unchecked' row, reset it when the URL
+        changes and drop it with the link, so LinkChecker finds the links due
+        for a check through the ``checked`` index alone. Existing links are
+        backfilled when the table is created. Stored results bump
+        ``health_version`` rather than the data generation, like clicks do
+        ``click_version``.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'link_health'").fetchone()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS link_health (
+                    link_id INTEGER PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    status INTEGER,
+                    final_url TEXT,
+                    latency_ms REAL,
+                    error TEXT,
+                    checked INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_link_health_state ON link_health (state, link_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_link_health_checked ON link_health (checked, link_id)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS health_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    generation INTEGER NOT NULL,
+                    modified INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                INSERT OR IGNORE INTO health_version (id, generation, modified)
+                VALUES (1, 0, CAST(strftime('%s', 'now') AS INTEGER))
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS link_health_insert AFTER INSERT ON links BEGIN
+                    INSERT INTO link_health (link_id, state, checked) VALUES (new.id, 'unchecked', 0);
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS link_health_delete AFTER DELETE ON links BEGIN
+                    DELETE FROM link_health WHERE link_id = old.id;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS link_health_update_url
+                AFTER UPDATE OF url ON links WHEN old.url IS NOT new.url BEGIN
+                    UPDATE link_health
+                    SET state = 'unchecked', status = NULL, final_url = NULL, latency_ms = NULL, error = NULL,
+                        checked = 0
+                    WHERE link_id = new.id;
+                END
+            ''')
+            if not exists:
+                conn.execute("INSERT INTO link_health (link_id, state, checked) SELECT id, 'unchecked', 0 FROM links")
+    
+    def init_clicks(self, conn):
+        """Create ``link_clicks``, one row per link with its /go/ clicks, and ``click_version``.
+
+        Like ``link_health`` the rows come and go with the links, so the
+        most and recently clicked listings walk the (clicks, link_id) and
+        (last_clicked, link_id) indexes over every link. ClickCounter adds to
+        them without touching ``links``: flushes bump ``click_version``
+        instead of the data generation, so they invalidate the pages that
+        show clicks but not the replica or the suggestion index.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'link_clicks'").fetchone()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS link_clicks (
+                    link_id INTEGER PRIMARY KEY,
+                    clicks INTEGER NOT NULL,
+                    last_clicked INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_link_clicks_clicks ON link_clicks (clicks, link_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_link_clicks_last ON link_clicks (last_clicked, link_id)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS click_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    generation INTEGER NOT NULL,
+                    modified INTEGER NOT NULL,
+                    total_clicks INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                INSERT OR IGNORE INTO click_version (id, generation, modified, total_clicks)
+                VALUES (1, 0, CAST(strftime('%s', 'now') AS INTEGER), 0)
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS link_clicks_insert AFTER INSERT ON links BEGIN
+                    INSERT INTO link_clicks (link_id, clicks, last_clicked) VALUES (new.id, 0, 0);
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS link_clicks_delete AFTER DELETE ON links BEGIN
+                    UPDATE click_version
+                    SET total_clicks = total_clicks
+                        - COALESCE((SELECT clicks FROM link_clicks WHERE link_id = old.id), 0)
+                    WHERE id = 1;
+                    DELETE FROM link_clicks WHERE link_id = old.id;
+                END
+            ''')
+            if not exists:
+                conn.execute('INSERT INTO link_clicks (link_id, clicks, last_clicked) SELECT id, 0, 0 FROM links')
+    
+    def init_changes(self, conn):
+        """Create ``link_changes``, the change log behind get_changes().
+
+        Triggers give every insert, update and delete of a link the next
+        sequence number, replacing the link's previous entry, so the log is
+        compacted as it is written: one row per live link plus a tombstone
+        per deleted one. AUTOINCREMENT keeps numbers from being reused when
+        the newest entry is replaced, and as SQLite has one writer at a
+        time, numbers are handed out in commit order. compact_changes()
+        drops old tombstones and raises ``change_log.horizon`` to the newest
+        sequence number among them. Existing links are backfilled when the
+        table is created, and the ``horizon_time`` column of older databases,
+        from when cursors carried a time, is dropped.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'link_changes'").fetchone()
+        now = "CAST(strftime('%s', 'now') AS INTEGER)"
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS link_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    link_id INTEGER NOT NULL UNIQUE,
+                    deleted INTEGER NOT NULL,
+                    changed INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_link_changes_tombstones ON link_changes (changed) WHERE deleted
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS change_log (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    horizon INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('INSERT OR IGNORE INTO change_log (id, horizon) VALUES (1, 0)')
+            if 'horizon_time' in {row[1] for row in conn.execute('PRAGMA table_info(change_log)')}:
+                conn.execute('ALTER TABLE change_log DROP COLUMN horizon_time')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS link_changes_insert AFTER INSERT ON links BEGIN
+                    REPLACE INTO link_changes (link_id, deleted, changed) VALUES (new.id, 0, {now});
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS link_changes_update AFTER UPDATE ON links
+                WHEN old.description IS NOT new.description OR old.tags IS NOT new.tags OR old.url IS NOT new.url
+                    OR old.file_group IS NOT new.file_group
+                BEGIN
+                    REPLACE INTO link_changes (link_id, deleted, changed) VALUES (new.id, 0, {now});
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS link_changes_delete AFTER DELETE ON links BEGIN
+                    REPLACE INTO link_changes (link_id, deleted, changed) VALUES (old.id, 1, {now});
+                END
+            ''')
+            if not exists:
+                conn.execute(f'INSERT INTO link_changes (link_id, deleted, changed) SELECT id, 0, {now} FROM links')
+    
+    def init_url_index(self, conn):
+        """Store each link's canonical URL and its hash, and index the hash.
+
+        Databases from before canonical URLs are backfilled once. The index
+        is unique, unless existing rows already repeat a URL: then it is a
+        plain index until ``merge_duplicates()`` has cleaned them up.
+        """
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(links)')}
+        if 'url_hash' not in columns:
+            self._create_staging(conn)
+            with conn:
+                conn.execute('ALTER TABLE links ADD COLUMN canonical_url TEXT')
+                conn.execute('ALTER TABLE links ADD COLUMN url_hash INTEGER')
+                cursor = conn.execute('SELECT id, url FROM links')
+                while True:
+                    rows = cursor.fetchmany(10000)
+                    if not rows:
+                        break
+                    conn.executemany(
+                        'INSERT INTO temp.link_change_staging (id, canonical_url, url_hash) VALUES (?, ?, ?)',
+                        [(link_id,) + url_key(url) for link_id, url in rows])
+                conn.execute('''
+                    UPDATE links SET (canonical_url, url_hash) = (
+                        SELECT canonical_url, url_hash FROM temp.link_change_staging s WHERE s.id = links.id
+                    )
+                ''')
+                conn.execute('DELETE FROM temp.link_change_staging')
+        self.create_url_index(conn)
+    
+    def create_url_index(self, conn):
+        try:
+            with conn:
+                conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_links_url_hash ON links (url_hash)')
+                conn.execute('DROP INDEX IF EXISTS idx_links_url_hash_any')
+            self.unique_urls = True
+        except sqlite3.IntegrityError:
+            with conn:
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_links_url_hash_any ON links (url_hash)')
+            self.unique_urls = False
+    
+    def init_catalog(self, conn):
+        """Create per-group link counts kept current by triggers.
+
+        Statistics and the group dropdown read this small table instead of
+        aggregating over ``links``. It is backfilled when first created.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'group_catalog'").fetchone()
+        with conn:
+            if conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_catalog'").fetchone():
+                # Tag counts used to live here too; init_tag_index() replaces them.
+                for trigger in ('catalog_insert', 'catalog_delete', 'catalog_update_tags'):
+                    conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+                conn.execute('DROP TABLE tag_catalog')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS group_catalog (
+                    name TEXT PRIMARY KEY,
+                    link_count INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_group_catalog_count ON group_catalog (link_count)')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS catalog_insert AFTER INSERT ON links BEGIN
+                    INSERT INTO group_catalog (name, link_count) VALUES (new.file_group, 1)
+                    ON CONFLICT (name) DO UPDATE SET link_count = link_count + 1;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS catalog_delete AFTER DELETE ON links BEGIN
+                    UPDATE group_catalog SET link_count = link_count - 1 WHERE name = old.file_group;
+                    DELETE FROM group_catalog WHERE name = old.file_group AND link_count <= 0;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS catalog_update_group
+                AFTER UPDATE OF file_group ON links WHEN old.file_group IS NOT new.file_group BEGIN
+                    UPDATE group_catalog SET link_count = link_count - 1 WHERE name = old.file_group;
+                    DELETE FROM group_catalog WHERE name = old.file_group AND link_count <= 0;
+                    INSERT INTO group_catalog (name, link_count) VALUES (new.file_group, 1)
+                    ON CONFLICT (name) DO UPDATE SET link_count = link_count + 1;
+                END
+            ''')
+            if not exists:
+                conn.execute('''
+                    INSERT INTO group_catalog (name, link_count)
+                    SELECT file_group, COUNT(*) FROM links GROUP BY file_group
+                ''')
+    
+    def init_tag_index(self, conn):
+        """Create the normalized ``tags``/``link_tags`` index kept in sync by triggers.
+
+        Each distinct tag (lower-cased, trimmed) gets one ``tags`` row holding
+        its link count, and ``link_tags`` maps tags to links in both
+        directions. Existing links are migrated when the tables are created.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'link_tags'").fetchone()
+        split_new = self.SPLIT_TAGS.format('new.tags')
+        # Adds new.tags to the index; shared by the insert and update triggers.
+        add_new_tags = f'''
+                    INSERT INTO tags (name, link_count)
+                    SELECT DISTINCT lower(trim(value)), 0 FROM {split_new}
+                    WHERE trim(value) != ''
+                    ON CONFLICT (name) DO NOTHING;
+                    INSERT OR IGNORE INTO link_tags (tag_id, link_id)
+                    SELECT id, new.id FROM tags
+                    WHERE name IN (SELECT lower(trim(value)) FROM {split_new});'''
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tags (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    link_count INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tags_count ON tags (link_count)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS link_tags (
+                    tag_id INTEGER NOT NULL,
+                    link_id INTEGER NOT NULL,
+                    PRIMARY KEY (tag_id, link_id)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_link_tags_link ON link_tags (link_id, tag_id)')
+            if not exists:
+                conn.execute(f'''
+                    INSERT INTO tags (name, link_count)
+                    SELECT DISTINCT lower(trim(value)), 0 FROM links, {self.SPLIT_TAGS.format('links.tags')}
+                    WHERE links.tags IS NOT NULL AND trim(value) != ''
+                    ON CONFLICT (name) DO NOTHING
+                ''')
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO link_tags (tag_id, link_id)
+                    SELECT tags.id, links.id FROM links, {self.SPLIT_TAGS.format('links.tags')} AS t
+                    JOIN tags ON tags.name = lower(trim(t.value))
+                    WHERE links.tags IS NOT NULL
+                ''')
+                conn.execute('''
+                    UPDATE tags SET link_count = (SELECT COUNT(*) FROM link_tags WHERE tag_id = tags.id)
+                ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS link_tags_count_insert AFTER INSERT ON link_tags BEGIN
+                    UPDATE tags SET link_count = link_count + 1 WHERE id = new.tag_id;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS link_tags_count_delete AFTER DELETE ON link_tags BEGIN
+                    UPDATE tags SET link_count = link_count - 1 WHERE id = old.tag_id;
+                    DELETE FROM tags WHERE id = old.tag_id AND link_count <= 0;
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS link_tags_insert
+                AFTER INSERT ON links WHEN new.tags IS NOT NULL BEGIN{add_new_tags}
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS link_tags_delete AFTER DELETE ON links BEGIN
+                    DELETE FROM link_tags WHERE link_id = old.id;
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS link_tags_update
+                AFTER UPDATE OF tags ON links WHEN old.tags IS NOT new.tags BEGIN
+                    DELETE FROM link_tags WHERE link_id = new.id AND tag_id NOT IN (
+                        SELECT id FROM tags WHERE name IN (SELECT lower(trim(value)) FROM {split_new}));{add_new_tags}
+                END
+            ''')
+    
+    def init_data_version(self, conn):
+        """Create the generation counter that every change to ``links`` bumps.
+
+        Response caches compare it to decide whether a stored page is still
+        valid; being in the database, it also sees writes from other processes.
+        """
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS data_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    generation INTEGER NOT NULL,
+                    modified INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                INSERT OR IGNORE INTO data_version (id, generation, modified)
+                VALUES (1, 0, CAST(strftime('%s', 'now') AS INTEGER))
+            ''')
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS data_version_{event.lower()} AFTER {event} ON links BEGIN
+                        UPDATE data_version
+                        SET generation = generation + 1, modified = CAST(strftime('%s', 'now') AS INTEGER)
+                        WHERE id = 1;
+                    END
+                ''')
+    
+    @instrumented
+    def data_generation(self):
+        """Return (generation, last modified unix time) of the links data."""
+        row = self.pool.connection().execute(
+            'SELECT generation, modified FROM data_version WHERE id = 1').fetchone()
+        replica = self.replica
+        if replica is not None and not replica.observe(row[0]):
+            self.reload_replica()
+        suggestions = self.suggestions
+        if suggestions is not None and not suggestions.observe(row[0]):
+            self.rebuild_suggestions()
+        return row
+    
+    def load_replica(self):
+        """Fill the replica from the database, or give it up if the table is over budget."""
+        replica = self.replica
+        if replica is not None and not replica.load(self.pool.connection()) and replica.overflowed:
+            self._drop_replica()
+    
+    def reload_replica(self):
+        """Reload a stale replica on a background thread; reads use SQLite meanwhile."""
+        replica = self.replica
+        if replica is None:
+            return
+        with replica.lock:
+            if replica.loading:
+                return
+            replica.loading = True
+        
+        def load():
+            try:
+                self.load_replica()
+            finally:
+                replica.loading = False
+                self.pool.release()
+        
+        threading.Thread(target=load, name='replica-loader', daemon=True).start()
+    
+    def _drop_replica(self):
+        self.replica_overflowed = True
+        self.replica = None
+    
+    def _current_replica(self):
+        """The replica if it is loaded and up to date, else None."""
+        replica = self.replica
+        if replica is None or replica.generation is None:
+            return None
+        if time.monotonic() - replica.checked > self.REPLICA_CHECK_INTERVAL:
+            generation = self._generation(self.pool.connection())
+            if not replica.observe(generation):
+                self.reload_replica()
+                return None
+        return replica
+    
+    def rebuild_suggestions(self):
+        """Rebuild a stale suggestion index on a background thread, at most every REBUILD_INTERVAL seconds."""
+        suggestions = self.suggestions
+        if suggestions is None:
+            return
+        with suggestions.lock:
+            if (suggestions.loading or not suggestions.stale
+                    or time.monotonic() - suggestions.loaded < suggestions.REBUILD_INTERVAL):
+                return
+            suggestions.loading = True
+        
+        def load():
+            try:
+                suggestions.load(self.pool.connection())
+            finally:
+                suggestions.loading = False
+                self.pool.release()
+        
+        threading.Thread(target=load, name='suggest-loader', daemon=True).start()
+    
+    def _generation(self, conn):
+        return conn.execute('SELECT generation FROM data_version WHERE id = 1').fetchone()[0]
+    
+    @contextlib.contextmanager
+    def _write_transaction(self, conn):
+        """Run the body in an IMMEDIATE transaction and pass what it changed on to the in-memory views.
+
+        Yields (changed, deleted) sets for the body to fill with the ids it
+        wrote and removed. Their rows go to the replica before the commit,
+        while the write lock still keeps writers in order; the suggestion
+        index gets the rows the temp triggers from _create_staging() saved
+        as well. A failed commit invalidates both.
+        """
+        replica, suggestions = self.replica, self.suggestions
+        changed, deleted = set(), set()
+        current, applied = True, False
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            tracked = replica is not None or suggestions is not None
+            before = self._generation(conn) if tracked else None
+            yield changed, deleted
+            if tracked and conn.in_transaction:
+                after = self._generation(conn)
+                applied = True
+                if replica is not None:
+                    ids = list(changed - deleted)
+                    rows = []
+                    for start in range(0, len(ids), 500):
+                        chunk = ids[start:start + 500]
+                        placeholders = ', '.join('?' * len(chunk))
+                        rows += conn.execute(f'''
+                            SELECT id, description, tags, url, file_group FROM links WHERE id IN ({placeholders})
+                        ''', chunk).fetchall()
+                    current = replica.apply(before, after, rows, deleted)
+                if suggestions is not None:
+                    old_rows = conn.execute('SELECT * FROM temp.link_old_rows').fetchall()
+                    rows = []
+                    if old_rows:
+                        rows = conn.execute('''
+                            SELECT id, links.description, links.tags, links.url, links.file_group
+                            FROM temp.link_old_rows AS old JOIN main.links USING (id)
+                        ''').fetchall()
+                        conn.execute('DELETE FROM temp.link_old_rows')
+                    suggestions.apply(before, after, old_rows, rows)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            if applied:
+                if replica is not None:
+                    replica.invalidate()
+                if suggestions is not None:
+                    suggestions.invalidate()
+            raise
+        if self._targets:
+            with self._targets_lock:
+                for link_id in changed | deleted:
+                    self._targets.pop(link_id, None)
+        with self._changes_cond:
+            self._commits += 1
+            self._changes_cond.notify_all()
+        if self.change_retention and (self._changes_compacted is None or
+                                      time.monotonic() - self._changes_compacted > self.CHANGE_COMPACT_INTERVAL):
+            self._changes_compacted = time.monotonic()
+            threading.Thread(target=self._compact_changes_once, name='change-compactor', daemon=True).start()
+        if not current:
+            if replica.overflowed:
+                self._drop_replica()
+            else:
+                self.reload_replica()
+    
+    def init_search_index(self, conn):
+        """Create the FTS5 index and its sync triggers, backfilling it once.
+
+        The index is rebuilt when the configured tokenizer changes. Without
+        FTS5 support in the sqlite3 library, search falls back to LIKE.
+        """
+        options = self.SEARCH_TOKENIZERS[self.search_tokenizer]
+        row = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'links_fts'").fetchone()
+        if row and options not in row[0]:
+            with conn:
+                conn.execute('DROP TABLE links_fts')
+            row = None
+        try:
+            with conn:
+                conn.execute(f'''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS links_fts USING fts5(
+                        description, tags, url,
+                        content='links', content_rowid='id', {options}
+                    )
+                ''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS links_fts_insert AFTER INSERT ON links BEGIN
+                        INSERT INTO links_fts (rowid, description, tags, url)
+                        VALUES (new.id, new.description, new.tags, new.url);
+                    END
+                ''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS links_fts_delete AFTER DELETE ON links BEGIN
+                        INSERT INTO links_fts (links_fts, rowid, description, tags, url)
+                        VALUES ('delete', old.id, old.description, old.tags, old.url);
+                    END
+                ''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS links_fts_update
+                    AFTER UPDATE OF description, tags, url ON links BEGIN
+                        INSERT INTO links_fts (links_fts, rowid, description, tags, url)
+                        VALUES ('delete', old.id, old.description, old.tags, old.url);
+                        INSERT INTO links_fts (rowid, description, tags, url)
+                        VALUES (new.id, new.description, new.tags, new.url);
+                    END
+                ''')
+                if row is None:
+                    # New index over an existing table: backfill it once.
+                    conn.execute("INSERT INTO links_fts (links_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            self.fts_enabled = False
+            return
+        self.fts_enabled = True
+    
+    def close(self):
+        self.clicks.close()
+        if self.write_queue is not None:
+            self.write_queue.close()
+        self.pool.close_all()
+    
+    @instrumented
+    def get_all_links(self):
+        replica = self._current_replica()
+        if replica is not None:
+            return replica.all()
+        cursor = self.pool.connection().execute('SELECT * FROM links')
+        links = cursor.fetchall()
+        return [{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]} for l in links]
+    
+    @instrumented
+    def get_links_by_group(self, group):
+        replica = self._current_replica()
+        if replica is not None:
+            return replica.by_group(group)
+        cursor = self.pool.connection().execute('SELECT * FROM links WHERE file_group = ?', (group,))
+        links = cursor.fetchall()
+        return [{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]} for l in links]
+    
+    def _resolve_tags(self, tags):
+        """Look up the tags of a ``parse_tag_filter()`` expression.
+
+        Returns (clauses, excluded ids) where each clause is (tag ids, total
+        link count), rarest first, or None when some clause names only
+        unknown tags and so nothing can match.
+        """
+        clauses, excluded = parse_tag_filter(tags)
+        names = [name for clause in clauses for name in clause] + excluded
+        found = {}
+        for name, tag_id, count in self.pool.connection().execute('''
+            SELECT j.value, tags.id, tags.link_count FROM json_each(?) AS j
+            JOIN tags ON tags.name = lower(trim(j.value))
+        ''', (json.dumps(names),)):
+            found[name] = (tag_id, count)
+        resolved = []
+        for clause in clauses:
+            known = [found[name] for name in clause if name in found]
+            if not known:
+                return None
+            resolved.append(([tag_id for tag_id, _ in known], sum(count for _, count in known)))
+        resolved.sort(key=lambda clause: clause[1])
+        return resolved, [found[name][0] for name in excluded if name in found]
+    
+    def _drive_from_tags(self, matches, limit):
+        """Whether a page is cheaper to build from the rarest tag's links.
+
+        Reading the tag's ``matches`` links and sorting them costs about
+        ``matches``; walking the sort index and checking tags per row costs
+        about ``limit * total / matches``. Rare tags favour the former.
+        """
+        total = self.pool.connection().execute(
+            'SELECT COALESCE(SUM(link_count), 0) FROM group_catalog').fetchone()[0]
+        return matches * matches <= limit * total
+    
+    def _resolve_health(self, state, limit):
+        """Check a health filter; returns (state, whether to start from its links) for _listing_query()."""
+        if state not in self.HEALTH_STATES:
+            raise ValueError(f'health must be one of {", ".join(self.HEALTH_STATES)}')
+        if limit is None:
+            return state, True
+        # Counting stops where walking the sort index becomes the cheaper plan.
+        total = self.pool.connection().execute(
+            'SELECT COALESCE(SUM(link_count), 0) FROM group_catalog').fetchone()[0]
+        cap = math.isqrt(limit * total) + 1
+        matches = self.pool.connection().execute(
+            'SELECT COUNT(*) FROM (SELECT 1 FROM link_health WHERE state = ? LIMIT ?)', (state, cap)).fetchone()[0]
+        return state, matches < cap
+    
+    def _listing_query(self, group, sort, descending, position=None, backwards=False, tags=None, limit=None,
+                       health=None):
+        """SQL for a listing; ``limit`` is the page size if paging.
+
+        ``tags`` and ``health`` are results of _resolve_tags() and _resolve_health().
+        Click sorts add the link's clicks and last click time as the last two columns.
+        """
+        column = self.SORT_COLUMNS[sort]
+        key = 'id'
+        scan_desc = descending != backwards
+        direction = 'DESC' if scan_desc else 'ASC'
+        source = 'links'
+        where, params = [], []
+        if tags is not None:
+            clauses, excluded = tags
+            for index, (tag_ids, matches) in enumerate(clauses):
+                marks = ', '.join('?' * len(tag_ids))
+                if index == 0 and (limit is None or self._drive_from_tags(matches, limit)):
+                    # Start from the rarest clause's links; CROSS JOIN keeps SQLite from reordering.
+                    distinct = 'DISTINCT ' if len(tag_ids) > 1 else ''
+                    source = (f'(SELECT {distinct}link_id FROM link_tags WHERE tag_id IN ({marks})) AS tagged '
+                              'CROSS JOIN links ON links.id = tagged.link_id')
+                    params.extend(tag_ids)
+                else:
+                    where.append(f'EXISTS (SELECT 1 FROM link_tags WHERE link_id = links.id AND tag_id IN ({marks}))')
+                    params.extend(tag_ids)
+            if excluded:
+                marks = ', '.join('?' * len(excluded))
+                where.append(f'NOT EXISTS (SELECT 1 FROM link_tags WHERE link_id = links.id AND tag_id IN ({marks}))')
+                params.extend(excluded)
+        if health is not None:
+            state, drive = health
+            if drive and source == 'links':
+                source = ('(SELECT link_id FROM link_health WHERE state = ?) AS checked '
+                          'CROSS JOIN links ON links.id = checked.link_id')
+                # The source comes before every WHERE clause.
+                params.insert(0, state)
+            else:
+                where.append('EXISTS (SELECT 1 FROM link_health WHERE link_id = links.id AND state = ?)')
+                params.append(state)
+        if column in self.CLICK_COLUMNS:
+            if source == 'links':
+                # Walk the clicks index; CROSS JOIN keeps SQLite from scanning links and sorting.
+                source = 'link_clicks CROSS JOIN links ON links.id = link_clicks.link_id'
+            else:
+                source += ' JOIN link_clicks ON link_clicks.link_id = links.id'
+            column, key = f'link_clicks.{column}', 'link_clicks.link_id'
+        if group is not None:
+            where.append('file_group = ?')
+            params.append(group)
+        if position is not None:
+            op = '<' if scan_desc else '>'
+            if column == 'id':
+                where.append(f'id {op} ?')
+                params.append(position[-1])
+            else:
+                where.append(f'({column}, {key}) {op} (?, ?)')
+                params.extend(position[-2:])
+        order = f'id {direction}' if column == 'id' else f'{column} {direction}, {key} {direction}'
+        sql = 'SELECT links.* FROM ' + source
+        if key != 'id':
+            sql = 'SELECT links.*, link_clicks.clicks, link_clicks.last_clicked FROM ' + source
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return sql + ' ORDER BY ' + order, params
+    
+    def _row_cursor(self, row, sort):
+        column = self.SORT_COLUMNS[sort]
+        if column == 'id':
+            return encode_cursor([row[0]])
+        index = {'description': 1, 'url': 3, 'file_group': 4, 'clicks': -2, 'last_clicked': -1}[column]
+        return encode_cursor([row[index], row[0]])
+    
+    @instrumented
+    def get_links_page(self, group=None, sort='id', descending=False, after=None, before=None, limit=50,
+                       tags=None, health=None):
+        """Return one page of links using keyset (seek) pagination.
+
+        ``after``/``before`` are cursors from a previous page; the result is a
+        dict with ``links`` plus ``next``/``prev`` cursors (None at either end).
+        Each page costs one index range scan no matter how deep it is.
+        ``tags`` restricts the listing with a ``parse_tag_filter()`` expression
+        and ``health`` to links in one of HEALTH_STATES.
+        """
+        if sort not in self.SORT_COLUMNS:
+            raise ValueError(f'cannot sort by {sort!r}')
+        backwards = before is not None
+        token = before if backwards else after
+        # [id] for the id order, [sort value, id] for the others; see _row_cursor().
+        position = decode_cursor(token, 1 if self.SORT_COLUMNS[sort] == 'id' else 2) if token else None
+        replica = self._current_replica() if sort == 'id' and not tags and not health else None
+        if replica is not None:
+            rows = replica.page_rows(group, descending != backwards, position[-1] if position else None, limit + 1)
+        else:
+            if tags:
+                tags = self._resolve_tags(tags)
+                if tags is None:
+                    return {'links': [], 'next': None, 'prev': None}
+            if health:
+                health = self._resolve_health(health, limit)
+            sql, params = self._listing_query(group, sort, descending, position, backwards, tags, limit, health)
+            rows = self.pool.connection().execute(sql + ' LIMIT ?', params + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return {'links': [], 'next': None, 'prev': None}
+        has_next = more if not backwards else True
+        has_prev = more if backwards else position is not None
+        return {
+            'links': [{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]} for l in rows],
+            'next': self._row_cursor(rows[-1], sort) if has_next else None,
+            'prev': self._row_cursor(rows[0], sort) if has_prev else None,
+        }
+    
+    @instrumented
+    def iter_links(self, group=None, sort='id', descending=False, batch_size=500, tags=None, health=None):
+        """Yield every link in listing order straight off the cursor."""
+        replica = self._current_replica() if sort == 'id' and not tags and not health else None
+        if replica is not None:
+            yield from replica.iter_links(group, descending, batch_size)
+            return
+        if tags:
+            tags = self._resolve_tags(tags)
+            if tags is None:
+                return
+        if health:
+            health = self._resolve_health(health, None)
+        sql, params = self._listing_query(group, sort, descending, tags=tags, health=health)
+        cursor = self.pool.connection().execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for l in rows:
+                yield {'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]}
+    
+    @instrumented
+    def iter_search_links(self, query, batch_size=500):
+        """Yield every link matching ``query`` in id order, for exports."""
+        query = query.strip()
+        conn = self.pool.connection()
+        match = build_fts_query(query, self.search_tokenizer) if query and self.fts_enabled else None
+        cursor = None
+        if match is not None:
+            try:
+                cursor = conn.execute('''
+                    SELECT * FROM links
+                    WHERE id IN (SELECT rowid FROM links_fts WHERE links_fts MATCH ?)
+                    ORDER BY id
+                ''', (match,))
+            except sqlite3.OperationalError:
+                cursor = None
+        if cursor is None:
+            cursor = conn.execute('''
+                SELECT * FROM links
+                WHERE description LIKE ? OR tags LIKE ? OR url LIKE ?
+                ORDER BY id
+            ''', (f'%{query}%', f'%{query}%', f'%{query}%'))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for l in rows:
+                yield {'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]}
+    
+    @instrumented
+    def search_links(self, query, limit=100):
+        return self.search_links_page(query, limit=limit)['links']
+    
+    @instrumented
+    def search_links_page(self, query, after=None, limit=50):
+        """Return one page of links matching ``query``, best matches first.
+
+        Pages are keyed on (bm25 score, id), so ``after`` is the ``next``
+        cursor of the previous page. Results from the full-text index carry
+        a ``highlight`` dict with the description and tags wrapped in
+        HIGHLIGHT_START/HIGHLIGHT_END markers.
+        """
+        query = query.strip()
+        position = decode_cursor(after, 2) if after else None
+        conn = self.pool.connection()
+        match = build_fts_query(query, self.search_tokenizer) if query and self.fts_enabled else None
+        if match is not None:
+            sql = '''
+                SELECT * FROM (
+                    SELECT l.id, l.description, l.tags, l.url, l.file_group,
+                           highlight(links_fts, 0, ?, ?), highlight(links_fts, 1, ?, ?),
+                           bm25(links_fts, ?, ?, ?) AS score
+                    FROM links_fts JOIN links l ON l.id = links_fts.rowid
+                    WHERE links_fts MATCH ?
+                )
+            '''
+            params = [HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END]
+            params += list(self.search_weights) + [match]
+            if position is not None:
+                sql += ' WHERE (score, id) > (?, ?)'
+                params += position[-2:]
+            try:
+                rows = conn.execute(sql + ' ORDER BY score, id LIMIT ?', params + [limit + 1]).fetchall()
+            except sqlite3.OperationalError:
+                # A query FTS5 cannot parse still gets a (slower) answer.
+                rows = None
+            if rows is not None:
+                more = len(rows) > limit
+                rows = rows[:limit]
+                return {
+                    'links': [{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4],
+                               'highlight': {'description': l[5], 'tags': l[6]}} for l in rows],
+                    'next': encode_cursor([rows[-1][7], rows[-1][0]]) if more else None,
+                    'prev': None,
+                }
+        sql = 'SELECT * FROM links WHERE id > ?'
+        params = [position[-1] if position else 0]
+        if query:
+            sql += ' AND (description LIKE ? OR tags LIKE ? OR url LIKE ?)'
+            params += [f'%{query}%', f'%{query}%', f'%{query}%']
+        rows = conn.execute(sql + ' ORDER BY id LIMIT ?', params + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'links': [{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]} for l in rows],
+            # Shaped like the full-text cursors, with no score.
+            'next': encode_cursor([None, rows[-1][0]]) if more else None,
+            'prev': None,
+        }
+    
+    @instrumented
+    def add_link(self, description, tags, url, file_group, on_duplicate='reject'):
+        """Add one link; returns (status, id) with status 'created', 'merged' or 'updated'.
+
+        If the canonical URL is already stored, ``on_duplicate`` decides:
+        'reject' raises DuplicateLinkError, 'merge' adds the tags to the
+        stored link and 'update' overwrites it.
+        """
+        if on_duplicate not in DUPLICATE_POLICIES:
+            raise ValueError(f'on_duplicate must be one of {", ".join(DUPLICATE_POLICIES)}')
+        status, link_id = self._write(self._add_links, (description, tags, url, file_group), on_duplicate)
+        if status == 'duplicate':
+            raise DuplicateLinkError(link_id)
+        return status, link_id
+    
+    def _add_links(self, conn, changed, deleted, calls):
+        outcomes = {}
+        for on_duplicate in {on_duplicate for _, on_duplicate in calls}:
+            indexes = [index for index, (_, policy) in enumerate(calls) if policy == on_duplicate]
+            results = self._write_rows(conn, [calls[index][0] for index in indexes], on_duplicate)
+            outcomes.update(zip(indexes, results))
+        changed.update(link_id for status, link_id in outcomes.values() if status != 'duplicate')
+        return [outcomes[index] for index in range(len(calls))]
+    
+    def _write(self, operation, *args):
+        """Run one call of a write operation in a transaction and return its result.
+
+        Write operations take (conn, changed, deleted, calls), a list of
+        argument tuples, and return one result per call; a result that is
+        an exception is raised to its caller. With group commit on, the
+        write queue hands an operation the calls of many callers at once;
+        otherwise each call gets a transaction of its own.
+        """
+        if self.write_queue is not None:
+            result = self.write_queue.submit(operation, args)
+        else:
+            conn = self.pool.connection()
+            self._create_staging(conn)
+            with self._write_transaction(conn) as (changed, deleted):
+                [result] = operation(conn, changed, deleted, [args])
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
+    @instrumented
+    def insert_links(self, rows, on_duplicate='reject'):
+        """Insert (description, tags, url, file_group) rows in one transaction.
+
+        Rows whose canonical URL is already stored, or appeared earlier in
+        ``rows``, are handled by ``on_duplicate`` as in add_link(), except
+        that rejected rows are just left out. Returns the number of rows
+        inserted.
+        """
+        conn = self.pool.connection()
+        self._create_staging(conn)
+        with self._write_transaction(conn) as (changed, _):
+            outcomes = self._write_rows(conn, rows, on_duplicate)
+            changed.update(link_id for status, link_id in outcomes if status != 'duplicate')
+        return sum(1 for status, _ in outcomes if status == 'created')
+    
+    def _create_staging(self, conn):
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS link_staging (
+                description TEXT, tags TEXT, url TEXT, file_group TEXT, canonical_url TEXT, url_hash INTEGER
+            )
+        ''')
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS link_change_staging (
+                id INTEGER PRIMARY KEY, description TEXT, tags TEXT, url TEXT, file_group TEXT,
+                canonical_url TEXT, url_hash INTEGER
+            )
+        ''')
+        if self.suggestions is not None:
+            self._create_old_rows(conn)
+    
+    def _create_old_rows(self, conn):
+        """Keep each link as it was before the current transaction in ``temp.link_old_rows``.
+
+        Links the transaction creates get a row with a NULL description.
+        _write_transaction() reads and empties the table before committing.
+        """
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS link_old_rows (
+                id INTEGER PRIMARY KEY, description TEXT, tags TEXT, url TEXT, file_group TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TEMP TRIGGER IF NOT EXISTS link_old_rows_insert AFTER INSERT ON main.links BEGIN
+                INSERT OR IGNORE INTO link_old_rows (id) VALUES (new.id);
+            END
+        ''')
+        for event in ('UPDATE OF description, tags, url, file_group', 'DELETE'):
+            conn.execute(f'''
+                CREATE TEMP TRIGGER IF NOT EXISTS link_old_rows_{event.split()[0].lower()} BEFORE {event} ON main.links
+                BEGIN
+                    INSERT OR IGNORE INTO link_old_rows
+                    VALUES (old.id, old.description, old.tags, old.url, old.file_group);
+                END
+            ''')
+    
+    def _links_by_hash(self, conn, hashes):
+        """Return {url_hash: (id, description, tags, url, file_group)} of stored links.
+
+        Where older rows still share a hash, the oldest link is returned.
+        """
+        hashes = list(hashes)
+        found = {}
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(f'''
+                SELECT url_hash, id, description, tags, url, file_group FROM links
+                WHERE url_hash IN ({placeholders})
+            ''', chunk):
+                if row[0] not in found or row[1] < found[row[0]][0]:
+                    found[row[0]] = row[1:]
+        return found
+    
+    def _write_rows(self, conn, rows, on_duplicate='reject'):
+        """Insert rows inside the caller's transaction, resolving repeated URLs.
+
+        Returns one (status, id) per row: 'created', 'merged' or 'updated'
+        with the id of the link written, or 'duplicate' with the id of the
+        link a rejected row repeats.
+        """
+        if on_duplicate not in DUPLICATE_POLICIES:
+            raise ValueError(f'on_duplicate must be one of {", ".join(DUPLICATE_POLICIES)}')
+        keyed = [(tuple(row), url_key(row[2])) for row in rows]
+        existing = self._links_by_hash(conn, {digest for _, (_, digest) in keyed})
+        changed_status = {'merge': 'merged', 'update': 'updated'}.get(on_duplicate, 'duplicate')
+        # Outcomes point at stored ids, or at positions in new_rows until those are inserted.
+        outcomes, new_rows, pending, changes = [], [], {}, {}
+        for row, (canonical, digest) in keyed:
+            if digest in existing:
+                link_id, *current = existing[digest]
+                if on_duplicate != 'reject':
+                    merged = resolve_duplicate(current, row, on_duplicate)
+                    if merged != tuple(current):
+                        existing[digest] = (link_id,) + merged
+                        changes[link_id] = (link_id,) + merged + (canonical, digest)
+                outcomes.append((changed_status, link_id, None))
+            elif digest in pending:
+                index = pending[digest]
+                if on_duplicate != 'reject':
+                    new_rows[index] = resolve_duplicate(new_rows[index][:4], row, on_duplicate) + (canonical, digest)
+                outcomes.append((changed_status, None, index))
+            else:
+                pending[digest] = len(new_rows)
+                new_rows.append(row + (canonical, digest))
+                outcomes.append(('created', None, len(new_rows) - 1))
+        if new_rows:
+            # AUTOINCREMENT hands out consecutive ids within one statement.
+            first_id = self._insert_staged(conn, new_rows).lastrowid - len(new_rows) + 1
+        if changes:
+            self._update_staged(conn, changes.values())
+        return [(status, link_id if index is None else first_id + index) for status, link_id, index in outcomes]
+    
+    def _insert_staged(self, conn, rows):
+        """Insert (description, tags, url, file_group, canonical_url, url_hash) rows; returns the cursor."""
+        if len(rows) == 1:
+            return conn.execute('''
+                INSERT INTO links (description, tags, url, file_group, canonical_url, url_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows[0])
+        # Rows are staged with executemany and moved over in one INSERT ... SELECT:
+        # FTS5 flushes its pending index data at every statement boundary, so a
+        # single statement keeps the trigger-maintained index cheap.
+        conn.executemany('''
+            INSERT INTO temp.link_staging (description, tags, url, file_group, canonical_url, url_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        cursor = conn.execute('''
+            INSERT INTO links (description, tags, url, file_group, canonical_url, url_hash)
+            SELECT description, tags, url, file_group, canonical_url, url_hash FROM temp.link_staging
+            ORDER BY rowid
+        ''')
+        conn.execute('DELETE FROM temp.link_staging')
+        return cursor
+    
+    def _update_staged(self, conn, rows):
+        """Overwrite links from (id, description, tags, url, file_group, canonical_url, url_hash) rows."""
+        # Staged for the same reason as inserts: one UPDATE statement for FTS5.
+        conn.executemany('''
+            INSERT INTO temp.link_change_staging (id, description, tags, url, file_group, canonical_url, url_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.execute('''
+            UPDATE links SET (description, tags, url, file_group, canonical_url, url_hash) = (
+                SELECT description, tags, url, file_group, canonical_url, url_hash
+                FROM temp.link_change_staging s WHERE s.id = links.id
+            )
+            WHERE id IN (SELECT id FROM temp.link_change_staging)
+        ''')
+        conn.execute('DELETE FROM temp.link_change_staging')
+    
+    @instrumented
+    def import_links(self, records, on_duplicate='reject', batch_size=20000, progress=None):
+        """Validate and insert an iterable of records in batched transactions.
+
+        Records are consumed lazily, so memory is bounded by ``batch_size``.
+        ``progress`` is called with the running result after every batch.
+        Returns counts of imported, skipped (duplicate), merged, updated and
+        invalid rows plus the first few error messages.
+        """
+        result = {'imported': 0, 'skipped': 0, 'merged': 0, 'updated': 0, 'invalid': 0, 'errors': []}
+        counters = {'created': 'imported', 'duplicate': 'skipped', 'merged': 'merged', 'updated': 'updated'}
+        batch = []
+        conn = self.pool.connection()
+        self._create_staging(conn)
+        
+        def flush():
+            with self._write_transaction(conn) as (changed, _):
+                for status, link_id in self._write_rows(conn, batch, on_duplicate):
+                    result[counters[status]] += 1
+                    if status != 'duplicate':
+                        changed.add(link_id)
+            batch.clear()
+            if progress is not None:
+                progress(result)
+        
+        number = 0
+        try:
+            for number, record in enumerate(records, 1):
+                try:
+                    batch.append(validate_link(record))
+                except ValueError as e:
+                    result['invalid'] += 1
+                    if len(result['errors']) < 20:
+                        result['errors'].append(f'Row {number}: {e}')
+                    continue
+                if len(batch) >= batch_size:
+                    flush()
+        except ValueError as e:
+            # The file itself is malformed; keep what was read before the error.
+            result['errors'].append(f'Stopped after row {number}: {e}')
+        if batch:
+            flush()
+        return result
+    
+    @instrumented
+    def apply_batch(self, operations, on_duplicate='reject'):
+        """Validate and apply create/update/delete operations atomically.
+
+        Each operation is a dict with ``op`` ('create', 'update' or 'delete'),
+        an ``id`` for updates and deletes, and a ``link`` dict of fields for
+        creates and updates (an update only changes the fields it names).
+        A create whose canonical URL is taken is handled by ``on_duplicate``
+        as in add_link(); an update may not take another link's URL.
+        Nothing is written unless every operation is valid. Returns
+        ``(applied, results)`` with one result dict per operation.
+        """
+        if on_duplicate not in DUPLICATE_POLICIES:
+            raise ValueError(f'on_duplicate must be one of {", ".join(DUPLICATE_POLICIES)}')
+        results = []
+        creates, updates, update_results, deletes = [], {}, {}, []
+        failed = False
+        conn = self.pool.connection()
+        self._create_staging(conn)
+        try:
+            # The write lock is taken first, so the rows checked are the rows changed.
+            with self._write_transaction(conn) as (changed, deleted):
+                targets = [operation.get('id') for operation in operations if isinstance(operation, dict)]
+                current = self.get_links_by_ids(
+                    link_id for link_id in targets if type(link_id) is int)
+                for index, operation in enumerate(operations):
+                    result = {'index': index}
+                    results.append(result)
+                    try:
+                        if not isinstance(operation, dict):
+                            raise ValueError('operation must be an object')
+                        op = result['op'] = operation.get('op')
+                        if op not in ('create', 'update', 'delete'):
+                            raise ValueError("op must be 'create', 'update' or 'delete'")
+                        fields = operation.get('link')
+                        if op != 'delete' and not isinstance(fields, dict):
+                            raise ValueError(f'{op} needs a "link" object')
+                        if op == 'create':
+                            creates.append((result, validate_link(fields)))
+                            continue
+                        link_id = result['id'] = operation.get('id')
+                        if type(link_id) is not int or link_id not in current:
+                            result['status'] = 'not_found'
+                            failed = True
+                        elif op == 'update':
+                            row = validate_link(dict(current[link_id], **fields))
+                            # Later operations on the same id see this one.
+                            current[link_id] = dict(zip(('description', 'tags', 'url', 'file_group'), row))
+                            updates[link_id] = row
+                            update_results[link_id] = result
+                        else:
+                            del current[link_id]
+                            updates.pop(link_id, None)
+                            deletes.append((link_id,))
+                    except ValueError as e:
+                        result['status'] = 'invalid'
+                        result['error'] = str(e)
+                        failed = True
+                if not failed:
+                    creates, updates, failed = self._resolve_batch_urls(
+                        conn, creates, updates, update_results, {link_id for link_id, in deletes}, on_duplicate)
+                if failed:
+                    conn.rollback()
+                    for result in results:
+                        result.setdefault('status', 'not_applied')
+                    return False, results
+                # Deletes go first and creates last, so a URL given up in this
+                # batch is free before another link takes it. Each step is one
+                # statement for FTS5.
+                if deletes:
+                    conn.executemany('INSERT INTO temp.link_change_staging (id) VALUES (?)', deletes)
+                    conn.execute('DELETE FROM links WHERE id IN (SELECT id FROM temp.link_change_staging)')
+                    conn.execute('DELETE FROM temp.link_change_staging')
+                    deleted.update(link_id for link_id, in deletes)
+                if updates:
+                    self._update_staged(conn, [(link_id,) + row for link_id, row in updates.items()])
+                    changed.update(updates)
+                if creates:
+                    last_id = self._insert_staged(conn, [row for _, row, _ in creates]).lastrowid
+                    # AUTOINCREMENT hands out consecutive ids within one statement.
+                    for link_id, (result, _, folded) in enumerate(creates, last_id - len(creates) + 1):
+                        for created in [result] + folded:
+                            created['id'] = link_id
+                        changed.add(link_id)
+        except sqlite3.IntegrityError:
+            # Two updates swapping URLs trip the unique index mid-statement.
+            for result in results:
+                result['status'] = 'not_applied'
+                result['error'] = 'conflicting URL changes; apply them in separate batches'
+            return False, results
+        done = {'create': 'created', 'update': 'updated', 'delete': 'deleted'}
+        for result in results:
+            result.setdefault('status', done[result['op']])
+        return True, results
+    
+    def _resolve_batch_urls(self, conn, creates, updates, update_results, deleted, on_duplicate):
+        """Check a batch's URLs against the stored links and each other.
+
+        Returns (creates, updates, failed). Creates become (result, row,
+        results folded into it); a create repeating a URL is folded into the
+        link it repeats unless ``on_duplicate`` is 'reject'. Updates gain
+        their canonical URL and hash.
+        """
+        failed = False
+        keys = {link_id: url_key(row[2]) for link_id, row in updates.items()}
+        create_keys = [url_key(row[2]) for _, row in creates]
+        stored = self._links_by_hash(conn, {digest for _, digest in list(keys.values()) + create_keys})
+        ids = list(keys)
+        moved = set()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for link_id, digest in conn.execute(
+                    f'SELECT id, url_hash FROM links WHERE id IN ({placeholders})', chunk):
+                if digest != keys[link_id][1]:
+                    moved.add(link_id)
+        # Who holds each URL once the batch is applied: a link id, or a create's position.
+        owners = {digest: row[0] for digest, row in stored.items()
+                  if row[0] not in deleted and row[0] not in moved}
+        for link_id in moved:
+            digest = keys[link_id][1]
+            owner = owners.setdefault(digest, link_id)
+            if owner != link_id:
+                update_results[link_id]['status'] = 'duplicate'
+                update_results[link_id]['existing_id'] = owner
+                failed = True
+        new_creates = []
+        for (result, row), (canonical, digest) in zip(creates, create_keys):
+            owner = owners.get(digest)
+            if owner is None:
+                owners[digest] = ('create', len(new_creates))
+                new_creates.append([result, row + (canonical, digest), []])
+            elif on_duplicate == 'reject':
+                result['status'] = 'duplicate'
+                if isinstance(owner, tuple):
+                    result['existing_index'] = new_creates[owner[1]][0]['index']
+                else:
+                    result['existing_id'] = owner
+                failed = True
+            elif isinstance(owner, tuple):
+                target = new_creates[owner[1]]
+                target[1] = resolve_duplicate(target[1][:4], row, on_duplicate) + (canonical, digest)
+                target[2].append(result)
+                result['status'] = 'merged' if on_duplicate == 'merge' else 'updated'
+            else:
+                base = updates.get(owner) or stored[digest][1:]
+                merged = resolve_duplicate(base, row, on_duplicate)
+                if merged != tuple(base):
+                    updates[owner] = merged
+                    keys[owner] = (canonical, digest)
+                result['id'] = owner
+                result['status'] = 'merged' if on_duplicate == 'merge' else 'updated'
+        updates = {link_id: row + keys[link_id] for link_id, row in updates.items()}
+        return [tuple(create) for create in new_creates], updates, failed
+    
+    @instrumented
+    def get_links_by_ids(self, ids):
+        """Return {id: link} for those of ``ids`` that exist."""
+        conn = self.pool.connection()
+        ids = list(ids)
+        links = {}
+        # Chunked to stay under SQLite's limit on bound parameters.
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for l in conn.execute(f'SELECT * FROM links WHERE id IN ({placeholders})', chunk):
+                links[l[0]] = {'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]}
+        return links
+    
+    @instrumented
+    def update_link(self, link_id, description, tags, url, file_group):
+        """Change a link; raises DuplicateLinkError if ``url`` is another link's."""
+        self._write(self._update_links, link_id, (description, tags, url, file_group))
+    
+    def _update_links(self, conn, changed, deleted, calls):
+        results = []
+        for link_id, (description, tags, url, file_group) in calls:
+            canonical, digest = url_key(url)
+            stored = conn.execute('SELECT url_hash FROM links WHERE id = ?', (link_id,)).fetchone()
+            if stored and stored[0] != digest:
+                owner = conn.execute('SELECT MIN(id) FROM links WHERE url_hash = ?', (digest,)).fetchone()[0]
+                if owner is not None:
+                    results.append(DuplicateLinkError(owner))
+                    continue
+            conn.execute('''
+                UPDATE links 
+                SET description = ?, tags = ?, url = ?, file_group = ?, canonical_url = ?, url_hash = ?
+                WHERE id = ?
+            ''', (description, tags, url, file_group, canonical, digest, link_id))
+            changed.add(link_id)
+            results.append(None)
+        return results
+    
+    @instrumented
+    def find_duplicates(self):
+        """Return links that share a canonical URL, as lists ordered oldest first.
+
+        One pass over the url_hash index finds the repeated hashes; only
+        their rows are read back. Empty once the index is unique.
+        """
+        rows = self.pool.connection().execute('''
+            SELECT links.* FROM links
+            JOIN (SELECT url_hash FROM links WHERE url_hash IS NOT NULL
+                  GROUP BY url_hash HAVING COUNT(*) > 1) AS repeated USING (url_hash)
+            ORDER BY links.url_hash, links.id
+        ''')
+        return [[{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4],
+                  'canonical_url': l[5]} for l in group]
+                for _, group in itertools.groupby(rows, key=lambda l: l[6])]
+    
+    @instrumented
+    def merge_duplicates(self):
+        """Fold every group of duplicates into its oldest link, then make the URL index unique.
+
+        The oldest link keeps its description, URL and group and gains the
+        tags of the others, which are deleted. Returns (groups, removed).
+        """
+        conn = self.pool.connection()
+        self._create_staging(conn)
+        with self._write_transaction(conn) as (changed, deleted):
+            groups = self.find_duplicates()
+            keep, removed = [], []
+            for links in groups:
+                first = links[0]
+                tags = first['tags']
+                for link in links[1:]:
+                    tags = merge_tags(tags, link['tags'])
+                    removed.append((link['id'],))
+                if tags != (first['tags'] or ''):
+                    keep.append((first['id'], first['description'], tags, first['url'], first['file_group'])
+                                + url_key(first['url']))
+            conn.executemany('INSERT INTO temp.link_change_staging (id) VALUES (?)', removed)
+            conn.execute('DELETE FROM links WHERE id IN (SELECT id FROM temp.link_change_staging)')
+            conn.execute('DELETE FROM temp.link_change_staging')
+            if keep:
+                self._update_staged(conn, keep)
+            changed.update(row[0] for row in keep)
+            deleted.update(link_id for link_id, in removed)
+        self.create_url_index(conn)
+        return len(groups), sum(len(links) - 1 for links in groups)
+    
+    @instrumented
+    def delete_link(self, link_id):
+        self._write(self._delete_links, link_id)
+    
+    def _delete_links(self, conn, changed, deleted, calls):
+        if len(calls) == 1:
+            conn.execute('DELETE FROM links WHERE id = ?', calls[0])
+        else:
+            # One statement for FTS5, as in apply_batch().
+            conn.executemany('INSERT OR IGNORE INTO temp.link_change_staging (id) VALUES (?)', calls)
+            conn.execute('DELETE FROM links WHERE id IN (SELECT id FROM temp.link_change_staging)')
+            conn.execute('DELETE FROM temp.link_change_staging')
+        deleted.update(link_id for link_id, in calls)
+        return [None] * len(calls)
+    
+    @instrumented
+    def get_link(self, link_id):
+        replica = self._current_replica()
+        if replica is not None:
+            return replica.get(link_id)
+        cursor = self.pool.connection().execute('SELECT * FROM links WHERE id = ?', (link_id,))
+        link = cursor.fetchone()
+        if link:
+            return {'id': link[0], 'description': link[1], 'tags': link[2], 'url': link[3], 'file_group': link[4]}
+        return None
+    
+    @instrumented
+    def get_groups(self):
+        replica = self._current_replica()
+        if replica is not None:
+            return replica.group_names()
+        cursor = self.pool.connection().execute('SELECT name FROM group_catalog ORDER BY name')
+        return [g[0] for g in cursor]
+    
+    @instrumented
+    def get_tag_counts(self, limit=None):
+        """Return (tag, link count) pairs, most used first, e.g. for a tag cloud."""
+        sql = 'SELECT name, link_count FROM tags ORDER BY link_count DESC, name'
+        params = ()
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params = (limit,)
+        return self.pool.connection().execute(sql, params).fetchall()
+    
+    @instrumented
+    def suggest(self, prefix, limit=10, kinds=None):
+        """Completions of ``prefix`` as {text, kind, count} dicts, the most used first.
+
+        ``kinds`` keeps only some of SuggestIndex.KINDS. Without the
+        suggestion index, or while it first loads, only tags and groups are
+        completed, from their catalog tables.
+        """
+        suggestions = self.suggestions
+        if suggestions is not None:
+            if time.monotonic() - suggestions.checked > self.REPLICA_CHECK_INTERVAL:
+                if not suggestions.observe(self._generation(self.pool.connection())):
+                    self.rebuild_suggestions()
+            if suggestions.generation is not None:
+                return suggestions.query(prefix, limit, kinds)
+        prefix = prefix.lstrip()
+        if not prefix:
+            return []
+        conn = self.pool.connection()
+        results = []
+        for kind, sql, start in (
+                ('tag', 'SELECT name, link_count FROM tags', prefix.lower()),
+                ('group', 'SELECT name, link_count FROM group_catalog', prefix)):
+            if not kinds or kind in kinds:
+                cursor = conn.execute(f'{sql} WHERE name >= ? AND name < ? ORDER BY link_count DESC, name LIMIT ?',
+                                      (start, start + '\U0010ffff', limit))
+                results += [{'text': name, 'kind': kind, 'count': count} for name, count in cursor]
+        results.sort(key=lambda result: -result['count'])
+        return results[:limit]
+    
+    @instrumented
+    def stale_links(self, checked_before, after=None, limit=1000):
+        """(checked, id, url) of links last checked before the unix time ``checked_before``, oldest first.
+
+        Never-checked links count as checked at 0. ``after`` is the
+        (checked, id) of the last row of the previous call.
+        """
+        sql = '''
+            SELECT checked, link_id, url FROM link_health JOIN links ON links.id = link_health.link_id
+            WHERE checked < ?'''
+        params = [checked_before]
+        if after is not None:
+            sql += ' AND (checked, link_id) > (?, ?)'
+            params.extend(after)
+        sql += ' ORDER BY checked, link_id LIMIT ?'
+        return self.pool.connection().execute(sql, params + [limit]).fetchall()
+    
+    @instrumented
+    def record_health(self, results):
+        """Store (id, url, state, status, final url, latency ms, error, checked) results in one transaction.
+
+        Links deleted, or given another URL since ``url`` was checked, are left alone.
+        ``health_version`` is bumped once, so cached pages show the new
+        states; the data generation, and with it the replica and the
+        suggestion index, is left alone.
+        """
+        conn = self.pool.connection()
+        self._create_staging(conn)
+        with self._write_transaction(conn):
+            conn.executemany('''
+                UPDATE link_health
+                SET state = ?, status = ?, final_url = ?, latency_ms = ?, error = ?, checked = ?
+                WHERE link_id = ? AND EXISTS (SELECT 1 FROM links WHERE id = link_health.link_id AND url = ?)
+            ''', [result[2:] + result[:2] for result in results])
+            conn.execute('''
+                UPDATE health_version
+                SET generation = generation + 1, modified = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE id = 1
+            ''')
+        return len(results)
+    
+    @instrumented
+    def health_generation(self):
+        """Return (generation, last modified unix time) of the link health results."""
+        return self.pool.connection().execute('SELECT generation, modified FROM health_version WHERE id = 1').fetchone()
+    
+    @instrumented
+    def get_health(self, ids):
+        """Return {id: (state, status, final url, latency ms, error, checked)} for the given link ids."""
+        ids = list(ids)
+        health = {}
+        conn = self.pool.connection()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(f'''
+                SELECT link_id, state, status, final_url, latency_ms, error, checked FROM link_health
+                WHERE link_id IN ({placeholders})
+            ''', chunk):
+                health[row[0]] = row[1:]
+        return health
+    
+    def redirect_target(self, link_id):
+        """URL of a link for /go/, or None if there is no such link.
+
+        Recently followed links are answered from an LRU without SQL. This
+        process's writes drop their ids from it; it is cleared when the data
+        generation moves, checked at most every REPLICA_CHECK_INTERVAL
+        seconds, so writes from other processes show within that time.
+        """
+        now = time.monotonic()
+        if now - self._targets_checked > self.REPLICA_CHECK_INTERVAL:
+            self._targets_checked = now
+            generation = self._generation(self.pool.connection())
+            if generation != self._targets_generation:
+                with self._targets_lock:
+                    self._targets.clear()
+                    self._targets_generation = generation
+        targets = self._targets
+        with self._targets_lock:
+            url = targets.get(link_id)
+            if url is not None:
+                targets.move_to_end(link_id)
+                return url
+        link = self.get_link(link_id)
+        if link is None:
+            return None
+        with self._targets_lock:
+            targets[link_id] = link['url']
+            if len(targets) > self.TARGET_CACHE_SIZE:
+                targets.popitem(last=False)
+        return link['url']
+    
+    def record_click(self, link_id):
+        """Count a click on a link; it reaches ``link_clicks`` with the next ClickCounter flush."""
+        self.clicks.record(link_id)
+    
+    @instrumented
+    def record_clicks(self, clicks):
+        """Add {id: (clicks, last clicked unix time)} to ``link_clicks`` in one upsert.
+
+        Links deleted since they were clicked are skipped. Bumps
+        ``click_version`` rather than the data generation; see init_clicks().
+        """
+        rows = json.dumps([[link_id, count, last] for link_id, (count, last) in clicks.items()])
+        conn = self.pool.connection()
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO link_clicks (link_id, clicks, last_clicked)
+                SELECT links.id, j.value ->> 1, j.value ->> 2
+                FROM json_each(?) AS j JOIN links ON links.id = j.value ->> 0
+                WHERE true
+                ON CONFLICT (link_id) DO UPDATE
+                SET clicks = clicks + excluded.clicks, last_clicked = max(last_clicked, excluded.last_clicked)
+            ''', (rows,))
+            conn.execute('''
+                UPDATE click_version
+                SET generation = generation + 1, modified = CAST(strftime('%s', 'now') AS INTEGER),
+                    total_clicks = total_clicks + (SELECT COALESCE(SUM(j.value ->> 1), 0)
+                                                   FROM json_each(?) AS j JOIN links ON links.id = j.value ->> 0)
+                WHERE id = 1
+            ''', (rows,))
+        return cursor.rowcount
+    
+    @instrumented
+    def click_generation(self):
+        """Return (generation, last modified unix time) of the click counts."""
+        return self.pool.connection().execute('SELECT generation, modified FROM click_version WHERE id = 1').fetchone()
+    
+    @instrumented
+    def get_clicks(self, ids):
+        """Return {id: (clicks, last clicked unix time)} for the given link ids that were ever clicked."""
+        ids = list(ids)
+        clicks = {}
+        conn = self.pool.connection()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(f'''
+                SELECT link_id, clicks, last_clicked FROM link_clicks
+                WHERE link_id IN ({placeholders}) AND clicks > 0
+            ''', chunk):
+                clicks[row[0]] = row[1:]
+        return clicks
+    
+    @instrumented
+    def get_changes(self, since=None, limit=500):
+        """Links changed after the cursor ``since``, in commit order, at most once each.
+
+        Returns {'changes': [(seq, id, link or None if deleted)], 'cursor':
+        the ``since`` for the next call, 'seq': the sequence number it
+        stands for, 'more': whether more changes are waiting}. Without
+        ``since`` every link is listed, leaving out tombstones, so a page
+        may hold fewer than ``limit`` changes. Costs one range scan of the
+        log, however large the table.
+
+        A cursor is [caught_up, seq], ``caught_up`` being the newest
+        sequence number handed out when its caller last caught up with the
+        log (or started from scratch). Tombstones up to it are of links the
+        caller has seen deleted or never got, so the cursor expires, raising
+        ExpiredCursorError, only if a tombstone after both was dropped.
+        Sequence numbers rather than times decide this, as a deletion is
+        numbered in commit order but timed when its transaction wrote it.
+        """
+        if since is not None:
+            values = decode_cursor(since, 2)
+            if not all(isinstance(value, int) for value in values):
+                raise ValueError(f'invalid change cursor: {since!r}')
+            caught_up, after = values
+        else:
+            after = 0
+        conn = self.pool.connection()
+        # One snapshot: the page, the newest number handed out and the horizon agree.
+        conn.execute('BEGIN')
+        try:
+            rows = conn.execute('''
+                SELECT c.seq, c.link_id, c.deleted, links.description, links.tags, links.url, links.file_group
+                FROM link_changes AS c LEFT JOIN links ON links.id = c.link_id
+                WHERE c.seq > ? ORDER BY c.seq LIMIT ?
+            ''', (after, limit + 1)).fetchall()
+            latest = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'link_changes'").fetchone()[0]
+            horizon = conn.execute('SELECT horizon FROM change_log WHERE id = 1').fetchone()[0]
+        finally:
+            conn.commit()
+        if since is None:
+            caught_up = latest
+        # A caught_up past every number handed out is from when cursors carried a time.
+        if horizon > max(caught_up, after) or caught_up > latest:
+            raise ExpiredCursorError('deleted links after this cursor are no longer listed; sync again from the start')
+        more = len(rows) > limit
+        rows = rows[:limit]
+        changes = []
+        for seq, link_id, deleted, description, tags, url, file_group in rows:
+            if deleted:
+                if since is not None:
+                    changes.append((seq, link_id, None))
+            else:
+                changes.append((seq, link_id, {'id': link_id, 'description': description, 'tags': tags, 'url': url,
+                                               'file_group': file_group}))
+        # Past skipped tombstones too, so they are not read again.
+        seq = rows[-1][0] if rows else after
+        if not more:
+            caught_up = latest
+        return {'changes': changes, 'cursor': encode_cursor([caught_up, seq]), 'seq': seq, 'more': more}
+    
+    def latest_change(self):
+        """Sequence number of the newest change, 0 if there is none."""
+        return self.pool.connection().execute('SELECT COALESCE(MAX(seq), 0) FROM link_changes').fetchone()[0]
+    
+    def wait_for_changes(self, since, timeout, max_waiters=None):
+        """Block until a change after ``since`` commits or ``timeout`` seconds pass; returns whether one did.
+
+        Commits in this process wake waiters at once; those of other
+        processes are noticed within CHANGE_POLL_INTERVAL seconds. Returns
+        False straight away if ``max_waiters`` callers are waiting already.
+        """
+        cond = self._changes_cond
+        with cond:
+            if max_waiters is not None and self._change_waiters >= max_waiters:
+                return False
+            self._change_waiters += 1
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                with cond:
+                    seen = self._commits
+                if self.latest_change() > since:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                with cond:
+                    if self._commits == seen:
+                        cond.wait(min(remaining, self.CHANGE_POLL_INTERVAL))
+        finally:
+            with cond:
+                self._change_waiters -= 1
+    
+    @instrumented
+    def compact_changes(self):
+        """Drop tombstones older than ``change_retention`` seconds; returns how many went."""
+        if not self.change_retention:
+            return 0
+        cutoff = int(time.time() - self.change_retention)
+        conn = self.pool.connection()
+        with conn:
+            dropped = conn.execute('DELETE FROM link_changes WHERE deleted AND changed < ? RETURNING seq',
+                                   (cutoff,)).fetchall()
+            if dropped:
+                conn.execute('UPDATE change_log SET horizon = max(horizon, ?) WHERE id = 1',
+                             (max(row[0] for row in dropped),))
+        return len(dropped)
+    
+    def _compact_changes_once(self):
+        try:
+            self.compact_changes()
+        except sqlite3.Error:
+            traceback.print_exc()
+        finally:
+            self.pool.release()
+    
+    def restore(self, source):
+        """Replace the stored data with the snapshot ``source``; returns the number of links restored.
+
+        See restore_database(). The schema is then brought up to date, and
+        the data, click and health generations and the change sequence move
+        past their values before the restore, so caches in running processes
+        drop what they hold and /api/changes cursors from before it expire.
+        """
+        data_generation = self.data_generation()[0]
+        click_generation = self.click_generation()[0]
+        health_generation = self.health_generation()[0]
+        seq = max(self.latest_change(), self.pool.connection().execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'link_changes'").fetchone()[0])
+        count = restore_database(source, self.db_path)
         self.init_db()
+        conn = self.pool.connection()
+        with conn:
+            conn.execute('''
+                UPDATE data_version SET generation = max(generation, ?) + 1,
+                    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = 1
+            ''', (data_generation,))
+            conn.execute('UPDATE click_version SET generation = max(generation, ?) + 1 WHERE id = 1',
+                         (click_generation,))
+            conn.execute('UPDATE health_version SET generation = max(generation, ?) + 1 WHERE id = 1',
+                         (health_generation,))
+            conn.execute('UPDATE change_log SET horizon = max(horizon, ?) WHERE id = 1', (seq + 1,))
+            # Numbering resumes from the horizon, so cursors issued from now on are valid.
+            conn.execute('''
+                INSERT INTO sqlite_sequence (name, seq) SELECT 'link_changes', 0
+                WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'link_changes')
+            ''')
+            conn.execute('''
+                UPDATE sqlite_sequence SET seq = max(seq, (SELECT horizon FROM change_log WHERE id = 1))
+                WHERE name = 'link_changes'
+            ''')
+        with self._targets_lock:
+            self._targets.clear()
+        if self.replica is not None:
+            self.reload_replica()
+        if self.suggestions is not None:
+            self.rebuild_suggestions()
+        return count
+    
+    @instrumented
+    def get_stats(self, top=10):
+        """Totals plus per-group and top tag counts, read from the catalogs."""
+        cursor = self.pool.connection().cursor()
+        groups = cursor.execute('''
+            SELECT name, link_count FROM group_catalog ORDER BY link_count DESC, name
+        ''').fetchall()
+        top_tags = self.get_tag_counts(top)
+        total_tags = cursor.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
+        total_clicks = cursor.execute('SELECT total_clicks FROM click_version WHERE id = 1').fetchone()[0]
+        # (id, description, url, clicks, last clicked) off the two click indexes.
+        most_clicked, recently_clicked = (cursor.execute(f'''
+            SELECT links.id, description, url, clicks, last_clicked
+            FROM link_clicks CROSS JOIN links ON links.id = link_clicks.link_id
+            WHERE clicks > 0 ORDER BY {column} DESC, link_id DESC LIMIT ?
+        ''', (top,)).fetchall() for column in ('clicks', 'last_clicked'))
+        return {
+            'total_links': sum(count for _, count in groups),
+            'total_groups': len(groups),
+            'most_group': groups[0] if groups else None,
+            'groups': groups,
+            'top_groups': groups[:top],
+            'total_tags': total_tags,
+            'top_tags': top_tags,
+            'total_clicks': total_clicks,
+            'most_clicked': most_clicked,
+            'recently_clicked': recently_clicked,
+        }
+
+class _CheckedHost:
+    """What LinkChecker keeps per (scheme, host, port) during a pass."""
+    __slots__ = ('key', 'queue', 'ready', 'active', 'taken', 'next_start', 'idle')
+    
+    def __init__(self, key):
+        self.key = key
+        # Links waiting for a probe; ``ready`` while the host is in the dispatch queue.
+        self.queue = collections.deque()
+        self.ready = False
+        self.active = 0
+        self.taken = 0
+        self.next_start = 0.0
+        # Idle keep-alive (reader, writer) pairs.
+        self.idle = []
+
+class LinkChecker:
+    """Probes stored URLs from an asyncio loop and records what it finds.
+
+    A pass walks the links last checked more than ``max_age`` seconds ago,
+    never-checked ones first. Each URL gets a HEAD request (GET for servers
+    that refuse HEAD), following up to MAX_REDIRECTS redirects, within
+    ``timeout`` seconds. Up to ``concurrency`` probes run at once, at most
+    ``per_host`` of them against one host, started at least ``host_delay``
+    seconds apart. Hosts take turns, and a host gets at most
+    ``max_per_host`` links per pass, so one big site cannot hold up the
+    rest; its other links wait for the next pass. Keep-alive connections are
+    reused per host. Results are stored with record_health() in batches of
+    ``batch_size``, or every ``flush_interval`` seconds.
+    """
+    USER_AGENT = 'WebLinksManager-LinkChecker/1.0'
+    MAX_REDIRECTS = 5
+    # Statuses some servers give HEAD while GET works.
+    HEAD_FALLBACK = frozenset({400, 403, 405, 501})
+    # GET bodies up to this size are read so the connection can be reused.
+    MAX_BODY = 64 * 1024
+    # Idle keep-alive connections kept across all hosts.
+    MAX_IDLE = 256
+    DEFAULT_PORTS = {'http': 80, 'https': 443}
+    
+    def __init__(self, manager, concurrency=500, per_host=2, host_delay=1.0, timeout=10.0, max_age=7 * 86400,
+                 max_per_host=100, batch_size=500, flush_interval=5.0, ssl_context=None):
+        self.manager = manager
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_per_host = max_per_host
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ssl_context = ssl_context
+        self.passes = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._hosts = {}
+        self._idle = 0
+    
+    def start(self, interval):
+        """Run a pass every ``interval`` seconds on a background thread."""
+        self._thread = threading.Thread(target=self.serve, args=(interval,), name='link-checker', daemon=True)
+        self._thread.start()
+    
+    def serve(self, interval):
+        """Run a pass every ``interval`` seconds until stop() is called."""
+        while not self._stop.is_set():
+            try:
+                self.run()
+            except Exception:
+                traceback.print_exc()
+            self._stop.wait(interval)
+    
+    def stop(self):
+        """Let the current pass finish the probes it started, and start no more."""
+        self._stop.set()
+    
+    def close(self):
+        self.stop()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def run(self):
+        """Run one pass; returns {state: links} for the links it checked."""
+        return asyncio.run(self.check())
+    
+    async def check(self):
+        loop = asyncio.get_running_loop()
+        # Database calls run on one thread of their own, off the event loop.
+        database = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='link-checker-db')
+        cutoff = int(time.time() - self.max_age)
+        slots = asyncio.Semaphore(self.concurrency)
+        # Hosts with queued links and a free per-host slot, in turn.
+        ready = collections.deque()
+        running = set()
+        results, counts = [], collections.Counter()
+        flushing = None
+        last_flush = loop.time()
+        position, exhausted, queued = None, False, 0
+        
+        def finished(task, host):
+            running.discard(task)
+            slots.release()
+            host.active -= 1
+            if host.queue and not host.ready:
+                host.ready = True
+                ready.append(host)
+            if not task.cancelled():
+                results.append(task.result())
+        
+        try:
+            while True:
+                while not exhausted and len(ready) < self.concurrency and queued < self.concurrency * 10:
+                    if self._stop.is_set():
+                        exhausted = True
+                        break
+                    rows = await loop.run_in_executor(database, self.manager.stale_links, cutoff, position, 1000)
+                    exhausted = len(rows) < 1000
+                    if rows:
+                        position = rows[-1][:2]
+                    for _, link_id, url in rows:
+                        try:
+                            host = self._host(url)
+                        except ValueError as e:
+                            results.append((link_id, url, 'unreachable', None, None, None, str(e), int(time.time())))
+                            continue
+                        if host.taken >= self.max_per_host:
+                            continue
+                        host.taken += 1
+                        host.queue.append((link_id, url))
+                        queued += 1
+                        if not host.ready and host.active < self.per_host:
+                            host.ready = True
+                            ready.append(host)
+                if ready and not self._stop.is_set():
+                    await slots.acquire()
+                    host = ready.popleft()
+                    link_id, url = host.queue.popleft()
+                    queued -= 1
+                    host.active += 1
+                    host.ready = bool(host.queue) and host.active < self.per_host
+                    if host.ready:
+                        ready.append(host)
+                    task = loop.create_task(self._check(host, link_id, url))
+                    running.add(task)
+                    task.add_done_callback(functools.partial(finished, host=host))
+                elif running:
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                elif not results:
+                    break
+                if results and (len(results) >= self.batch_size or loop.time() - last_flush >= self.flush_interval
+                                or not running):
+                    if flushing is not None:
+                        await flushing
+                    counts.update(result[2] for result in results)
+                    flushing = loop.run_in_executor(database, self.manager.record_health, results)
+                    results, last_flush = [], loop.time()
+            if flushing is not None:
+                await flushing
+        finally:
+            for task in running:
+                task.cancel()
+            self._close_idle()
+            await loop.run_in_executor(database, self.manager.pool.release)
+            database.shutdown()
+        for state, count in counts.items():
+            METRICS.inc('links_health_checks_total', (('state', state),), count)
+        self.passes += 1
+        return dict(counts)
+    
+    def _host(self, url):
+        """The per-host state for ``url``; raises ValueError for URLs it cannot check."""
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in self.DEFAULT_PORTS or not parts.hostname:
+            raise ValueError(f'cannot check {parts.scheme or "relative"} URLs')
+        hostname = parts.hostname.encode('idna').decode('ascii')
+        key = (parts.scheme, hostname, parts.port or self.DEFAULT_PORTS[parts.scheme])
+        host = self._hosts.get(key)
+        if host is None:
+            host = self._hosts[key] = _CheckedHost(key)
+        return host
+    
+    async def _check(self, host, link_id, url):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        wait = host.next_start - now
+        host.next_start = max(now, host.next_start) + self.host_delay
+        if wait > 0:
+            await asyncio.sleep(wait)
+        start = loop.time()
+        status = final_url = error = None
+        try:
+            state, status, final_url = await asyncio.wait_for(self.probe(url), self.timeout)
+        except asyncio.TimeoutError:
+            state, error = 'unreachable', f'timed out after {self.timeout:g} s'
+        except (OSError, EOFError, ValueError) as e:
+            state, error = 'unreachable', str(e) or e.__class__.__name__
+        latency = round((loop.time() - start) * 1000, 1)
+        return (link_id, url, state, status, final_url, latency, error, int(time.time()))
+    
+    async def probe(self, url):
+        """Return (state, final status, final URL) for one URL."""
+        current = url
+        for _ in range(self.MAX_REDIRECTS + 1):
+            status, headers = await self._request('HEAD', current)
+            if status in self.HEAD_FALLBACK:
+                status, headers = await self._request('GET', current)
+            location = headers.get('location')
+            if not (300 <= status < 400 and location):
+                break
+            current = urllib.parse.urljoin(current, location)
+        else:
+            return 'broken', status, current
+        if status >= 300:
+            return 'broken', status, current
+        return ('ok' if current == url else 'redirected'), status, current
+    
+    async def _request(self, method, url):
+        """Send one request over a pooled connection; returns (status, lower-cased headers)."""
+        parts = urllib.parse.urlsplit(url)
+        host = self._host(url)
+        scheme, hostname, port = host.key
+        target = urllib.parse.quote(parts.path or '/', safe="/%:@!$&'()*+,;=~")
+        if parts.query:
+            target += '?' + urllib.parse.quote(parts.query, safe="/%:@!$&'()*+,;=~?")
+        authority = hostname if port == self.DEFAULT_PORTS[scheme] else f'{hostname}:{port}'
+        request = (f'{method} {target} HTTP/1.1\r\nHost: {authority}\r\nUser-Agent: {self.USER_AGENT}\r\n'
+                   'Accept: */*\r\n\r\n').encode('ascii')
+        for attempt in range(2):
+            reused = bool(host.idle)
+            if reused:
+                reader, writer = host.idle.pop()
+                self._idle -= 1
+            else:
+                reader, writer = await asyncio.open_connection(
+                    hostname, port, ssl=(self.ssl_context or True) if scheme == 'https' else None)
+            done = False
+            try:
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    version, status, headers = await self._read_head(reader)
+                except (OSError, EOFError, ValueError):
+                    if reused and attempt == 0:
+                        # The server closed the idle connection; try a fresh one.
+                        continue
+                    raise
+                keep = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                if method == 'GET' and status not in (204, 304):
+                    length = headers.get('content-length', '')
+                    if length.isdigit() and int(length) <= self.MAX_BODY and 'transfer-encoding' not in headers:
+                        await reader.readexactly(int(length))
+                    else:
+                        keep = False
+                if keep and self._idle < self.MAX_IDLE:
+                    host.idle.append((reader, writer))
+                    self._idle += 1
+                    done = True
+                return status, headers
+            finally:
+                if not done:
+                    writer.close()
+    
+    async def _read_head(self, reader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError('connection closed without a response')
+        fields = line.decode('latin-1').split(None, 2)
+        if len(fields) < 2 or not fields[0].startswith('HTTP/') or not fields[1].isdigit():
+            raise ValueError(f'malformed status line {line[:80]!r}')
+        headers = {}
+        for _ in range(100):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return fields[0], int(fields[1]), headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        raise ValueError('too many response headers')
+    
+    def _close_idle(self):
+        for host in self._hosts.values():
+            for _, writer in host.idle:
+                writer.close()
+        self._hosts = {}
+        self._idle = 0
+
+class Snapshotter:
+    """Copies the live database into ``directory`` while the server keeps running.
+
+    A snapshot is taken with the sqlite3 backup API, ``pages`` pages per
+    step with ``pause`` seconds between steps, all inside one read
+    transaction: in WAL mode that pins a consistent view without blocking
+    writers, and keeps their commits from restarting the copy. The copy is
+    written to a ``.partial`` file, switched out of WAL mode, gzipped if
+    ``compress`` is set and renamed into place, so a finished name is
+    always a whole database. The newest ``keep`` snapshots are kept (0:
+    all). Progress goes to a status file in ``directory``, which status()
+    reads from any process.
+    """
+    # Seconds between status file updates while a snapshot runs.
+    STATUS_INTERVAL = 0.5
+    
+    def __init__(self, db_path, directory, interval=0, keep=7, compress=False, compress_level=1, pages=1024,
+                 pause=0.01):
+        self.db_path = db_path
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.compress = compress
+        self.compress_level = compress_level
+        self.pages = pages
+        self.pause = pause
+        stem = os.path.splitext(os.path.basename(db_path))[0]
+        self.prefix = stem + '-'
+        self.status_path = os.path.join(directory, f'.{stem}-snapshot.json')
+        self._pattern = re.compile(re.escape(self.prefix) + r'(\d{8}-\d{6})(?:-(\d+))?\.db(\.gz)?')
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Take snapshots on schedule on a background thread."""
+        self._thread = threading.Thread(target=self.serve, name='snapshotter', daemon=True)
+        self._thread.start()
+    
+    def serve(self):
+        """Take a snapshot whenever the newest one is ``interval`` seconds old, until stop() is called."""
+        while not self._stop.is_set():
+            snapshots = self.snapshots()
+            wait = snapshots[0]['created'] + self.interval - time.time() if snapshots else 0
+            if wait > 0:
+                # Looks again now and then, in case a snapshot was taken by hand meanwhile.
+                self._stop.wait(min(wait, 60))
+                continue
+            try:
+                self.snapshot()
+            except Exception:
+                traceback.print_exc()
+                self._stop.wait(min(self.interval, 300))
+    
+    def stop(self):
+        """Abandon the snapshot being copied, if any, and take no more."""
+        self._stop.set()
+    
+    def close(self):
+        self.stop()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def snapshots(self):
+        """Finished snapshots, newest first, as dicts with name, path, bytes and created (unix time)."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        found = []
+        for name in names:
+            match = self._pattern.fullmatch(name)
+            if match is None:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found.append(((match.group(1), int(match.group(2) or 0)),
+                          {'name': name, 'path': path, 'bytes': stat.st_size, 'created': int(stat.st_mtime)}))
+        found.sort(key=lambda item: item[0], reverse=True)
+        return [snapshot for _, snapshot in found]
+    
+    def status(self):
+        """What the status file says, plus the snapshots on disk and when the next one is due."""
+        try:
+            with open(self.status_path) as f:
+                status = json.load(f)
+        except (FileNotFoundError, ValueError):
+            status = {}
+        running = status.get('running')
+        if running is not None and not self._alive(running['pid']):
+            # Its process died mid-copy; the partial file is left for deletion.
+            running = None
+        snapshots = self.snapshots()
+        due = None
+        if self.interval > 0:
+            due = snapshots[0]['created'] + int(self.interval) if snapshots else int(time.time())
+        return {
+            'directory': os.path.abspath(self.directory),
+            'interval': self.interval,
+            'keep': self.keep,
+            'compress': self.compress,
+            'running': running,
+            'last': status.get('last'),
+            'next': due,
+            'snapshots': [{key: value for key, value in snapshot.items() if key != 'path'}
+                          for snapshot in snapshots],
+        }
+    
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+    
+    def snapshot(self, rotate=True):
+        """Take one snapshot now; returns {'name', 'bytes', 'seconds', 'finished'}."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+            taken = {snapshot['name'] for snapshot in self.snapshots()}
+            for n in itertools.count(1):
+                name = f'{self.prefix}{stamp}{"" if n == 1 else f"-{n}"}.db' + ('.gz' if self.compress else '')
+                if name not in taken:
+                    break
+            path = os.path.join(self.directory, name)
+            partial = f'{path}.{os.getpid()}.partial'
+            # Where the database is copied before it is gzipped into ``partial``.
+            copy = f'{path[:-3]}.{os.getpid()}.partial' if self.compress else partial
+            started = time.time()
+            running = {'name': name, 'pid': os.getpid(), 'state': 'copying', 'started': int(started),
+                       'pages_done': 0, 'pages_total': None}
+            last = self.status()['last']
+            self._write_status(running, last)
+            try:
+                self._copy(copy, running, last)
+                if self.compress:
+                    running['state'] = 'compressing'
+                    self._write_status(running, last)
+                    try:
+                        with open(copy, 'rb') as source, open(partial, 'wb') as target:
+                            with gzip.GzipFile(os.path.basename(path)[:-3], 'wb', self.compress_level, target,
+                                               mtime=int(started)) as archive:
+                                shutil.copyfileobj(source, archive, 1024 * 1024)
+                            target.flush()
+                            os.fsync(target.fileno())
+                    finally:
+                        os.remove(copy)
+                os.replace(partial, path)
+            except BaseException as e:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(partial)
+                METRICS.inc('links_snapshots_total', (('result', 'failed'),))
+                self._write_status(None, {'name': name, 'error': str(e) or e.__class__.__name__,
+                                          'finished': int(time.time())})
+                raise
+            result = {'name': name, 'bytes': os.path.getsize(path), 'seconds': round(time.time() - started, 3),
+                      'finished': int(time.time())}
+            METRICS.inc('links_snapshots_total', (('result', 'ok'),))
+            self._write_status(None, result)
+            if rotate:
+                self.rotate()
+            return result
+    
+    def _copy(self, path, running, last):
+        source = sqlite3.connect(self.db_path, timeout=30.0)
+        try:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            target = sqlite3.connect(path)
+            try:
+                written = 0.0
+                
+                def progress(status, remaining, total):
+                    nonlocal written
+                    if self._stop.is_set():
+                        raise InterruptedError('snapshot stopped')
+                    running['pages_done'], running['pages_total'] = total - remaining, total
+                    if time.monotonic() - written >= self.STATUS_INTERVAL:
+                        self._write_status(running, last)
+                        written = time.monotonic()
+                    if remaining and self.pause:
+                        time.sleep(self.pause)
+                
+                source.backup(target, pages=self.pages, progress=progress)
+                # A file that stands on its own, with no -wal beside it.
+                target.execute('PRAGMA journal_mode = DELETE')
+            finally:
+                target.close()
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            raise
+        finally:
+            source.close()
+    
+    def _write_status(self, running, last):
+        partial = f'{self.status_path}.{os.getpid()}.partial'
+        with open(partial, 'w') as f:
+            json.dump({'running': running, 'last': last}, f)
+        os.replace(partial, self.status_path)
+    
+    def rotate(self):
+        """Delete all but the newest ``keep`` snapshots; returns the names deleted."""
+        if self.keep <= 0:
+            return []
+        removed = []
+        for snapshot in self.snapshots()[self.keep:]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(snapshot['path'])
+                removed.append(snapshot['name'])
+        return removed
+
+def restore_database(source, db_path, timeout=30.0):
+    """Replace the contents of ``db_path`` with the snapshot ``source`` (a database file, gzipped or not).
+
+    The snapshot is copied (or unpacked) beside the database and must pass
+    ``PRAGMA integrity_check`` and hold a links table, or ValueError is
+    raised and nothing changes. It is then written over the database with
+    the backup API in one transaction: connections open on it, a running
+    server's included, see the old data or the new, never a mix. Returns
+    the number of links restored.
+    """
+    scratch = f'{db_path}.restore-{os.getpid()}'
+    try:
+        with open(source, 'rb') as f:
+            gzipped = f.read(2) == b'\x1f\x8b'
+        try:
+            with (gzip.open if gzipped else open)(source, 'rb') as f, open(scratch, 'wb') as out:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            raise ValueError(f'{source} is not a readable snapshot: {e}') from None
+        check = sqlite3.connect(scratch)
+        try:
+            try:
+                problems = [row[0] for row in check.execute('PRAGMA integrity_check')]
+                tables = {row[0] for row in check.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            except sqlite3.DatabaseError as e:
+                raise ValueError(f'{source} is not a readable snapshot: {e}') from None
+            if problems != ['ok']:
+                raise ValueError(f'{source} failed the integrity check: ' + '; '.join(problems[:5]))
+            if 'links' not in tables:
+                raise ValueError(f'{source} holds no links table')
+            count = check.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+            target = sqlite3.connect(db_path, timeout=timeout)
+            try:
+                check.backup(target)
+                # Moves the restored pages out of the WAL.
+                target.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            finally:
+                target.close()
+        finally:
+            check.close()
+    finally:
+        for suffix in ('', '-journal', '-wal', '-shm'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(scratch + suffix)
+    return count
+
+class LinkServer(HTTPServer):
+    """HTTPServer that owns the LinkManager shared by every request."""
+    # Only servers that can park idle connections on a thread keep them open.
+    keep_alive = False
+    # ResponseCache shared by all handler threads, or None to disable caching.
+    response_cache = None
+    
+    def __init__(self, server_address, handler_class, link_manager, **kwargs):
+        self.link_manager = link_manager
+        super().__init__(server_address, handler_class, **kwargs)
+    
+    def server_close(self):
+        super().server_close()
+        self.link_manager.close()
+
+class ThreadPoolLinkServer(LinkServer):
+    """LinkServer that serves connections from a fixed pool of worker threads.
+
+    Accepted connections wait in a bounded queue. When the queue is full the
+    client gets an immediate 503 instead of an ever-growing backlog.
+    """
+    keep_alive = True
+    
+    def __init__(self, server_address, handler_class, link_manager,
+                 threads=8, queue_size=64, **kwargs):
+        self.threads = threads
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._workers = []
+        super().__init__(server_address, handler_class, link_manager, **kwargs)
+        for i in range(threads):
+            worker = threading.Thread(target=self._worker, name=f'link-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+    
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+    
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request)
+    
+    def reject_request(self, request):
+        METRICS.inc('links_http_rejected_connections_total')
+        try:
+            request.sendall(b'HTTP/1.0 503 Service Unavailable\r\n'
+                            b'Retry-After: 1\r\n'
+                            b'Content-Length: 0\r\n'
+                            b'Connection: close\r\n\r\n')
+        except OSError:
+            pass
+        self.shutdown_request(request)
+    
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+        self.link_manager.pool.release()
+    
+    def server_close(self):
+        # Let queued and in-flight requests finish before closing the database.
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        super().server_close()
+
+# Content type and download file name for each /export/<format>.
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'links.csv'),
+    'json': ('application/json', 'links.json'),
+    'ndjson': ('application/x-ndjson', 'links.ndjson'),
+}
+
+def iter_export(fmt, links, batch_size=500):
+    """Yield an export of ``links`` as text pieces of about ``batch_size`` rows."""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Description', 'Tags', 'URL', 'File Group'])
+        for i, link in enumerate(links, 1):
+            writer.writerow([link['description'], link['tags'], link['url'], link['file_group']])
+            if i % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        return
+    pieces = []
+    separator = '' if fmt == 'ndjson' else '[\n  '
+    for i, link in enumerate(links, 1):
+        data = {'description': link['description'], 'tags': link['tags'], 'url': link['url'], 'file_group': link['file_group']}
+        pieces.append(separator + json.dumps(data))
+        separator = '\n' if fmt == 'ndjson' else ',\n  '
+        if i % batch_size == 0:
+            yield ''.join(pieces)
+            pieces = []
+    if fmt == 'json':
+        pieces.append('[]' if separator == '[\n  ' else '\n]')
+    elif separator:
+        pieces.append('\n')
+    yield ''.join(pieces)
+
+# zlib window bits for each HTTP content coding: gzip framing, or the zlib
+# stream that HTTP calls "deflate".
+ENCODING_WBITS = {'gzip': 31, 'deflate': zlib.MAX_WBITS}
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'image/svg+xml')
+
+def is_compressible(content_type):
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    return media_type.startswith('text/') or media_type in COMPRESSIBLE_TYPES
+
+def compressor_for(encoding, level=6):
+    return zlib.compressobj(level, zlib.DEFLATED, ENCODING_WBITS[encoding])
+
+def compress_body(data, encoding, level=6):
+    compressor = compressor_for(encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+class GzipWriter:
+    """Compresses everything written to it into ``out`` as a gzip stream."""
+    def __init__(self, out, level=6):
+        self.out = out
+        self._compressor = compressor_for('gzip', level)
+    
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.out.write(self._compressor.compress(data))
+    
+    def close(self):
+        self.out.write(self._compressor.flush())
+        self.out.close()
+
+class MultipartPart(io.RawIOBase):
+    """One part of a multipart body, readable as a stream up to its boundary."""
+    def __init__(self, reader, headers):
+        super().__init__()
+        self._reader = reader
+        self._ended = False
+        self.headers = headers
+        disposition = email.message.Message()
+        disposition['content-disposition'] = headers.get('content-disposition', '')
+        self.name = disposition.get_param('name', header='content-disposition')
+        self.filename = disposition.get_param('filename', header='content-disposition')
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+    
+    def read(self, size=-1):
+        if self._ended:
+            return b''
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(65536), b''))
+        data = self._reader.read_part(size)
+        if not data:
+            self._ended = True
+        return data
+    
+    def drain(self):
+        while self.read(65536):
+            pass
+
+class MultipartReader:
+    """Incremental multipart/form-data parser over a request body.
+
+    Iterating yields MultipartPart streams in order; the body is read in
+    ``chunk_size`` pieces, so uploads of any size use bounded memory. A part
+    that is not read to the end is skipped when the next one is requested.
+    """
+    max_header_size = 16384
+    
+    def __init__(self, rfile, boundary, length, chunk_size=65536):
+        if isinstance(boundary, str):
+            boundary = boundary.encode('latin-1')
+        self.rfile = rfile
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.delimiter = b'\r\n--' + boundary
+        # A leading CRLF lets the first boundary match the same delimiter.
+        self.buffer = bytearray(b'\r\n')
+    
+    @classmethod
+    def boundary_from(cls, content_type):
+        message = email.message.Message()
+        message['content-type'] = content_type
+        boundary = message.get_param('boundary')
+        if message.get_content_type() != 'multipart/form-data' or not boundary:
+            raise ValueError('expected a multipart/form-data body')
+        return boundary
+    
+    def _fill(self):
+        if self.remaining <= 0:
+            return False
+        data = self.rfile.read(min(self.chunk_size, self.remaining))
+        if not data:
+            self.remaining = 0
+            return False
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+    
+    def _ensure(self, size):
+        while len(self.buffer) < size:
+            if not self._fill():
+                raise ValueError('multipart body ended unexpectedly')
+    
+    def read_part(self, size):
+        """Return up to ``size`` bytes of the current part; b'' at its boundary."""
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index == 0:
+                del self.buffer[:len(self.delimiter)]
+                return b''
+            if index > 0:
+                available = index
+            else:
+                # Hold back enough bytes to recognise a delimiter split across reads.
+                available = len(self.buffer) - len(self.delimiter) + 1
+            if available > 0 and (index > 0 or available >= size or self.remaining <= 0):
+                data = bytes(self.buffer[:min(size, available)])
+                del self.buffer[:len(data)]
+                return data
+            if not self._fill():
+                raise ValueError('multipart body ended before the closing boundary')
+    
+    def _read_headers(self):
+        while True:
+            end = self.buffer.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            if len(self.buffer) > self.max_header_size or not self._fill():
+                raise ValueError('malformed multipart part headers')
+        raw = bytes(self.buffer[:end]).decode('utf-8', 'replace')
+        del self.buffer[:end + 4]
+        headers = {}
+        for line in raw.split('\r\n'):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return headers
+    
+    def __iter__(self):
+        # Skip the preamble up to the first boundary.
+        while self.read_part(self.chunk_size):
+            pass
+        while True:
+            self._ensure(2)
+            if self.buffer[:2] == b'--':
+                # Closing boundary: discard the epilogue.
+                while self._fill():
+                    del self.buffer[:]
+                return
+            del self.buffer[:2]
+            part = MultipartPart(self, self._read_headers())
+            yield part
+            part.drain()
+
+def iter_json_array(stream, chunk_size=65536):
+    """Yield the elements of a JSON array read incrementally from a text stream."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    started = False
+    while True:
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise ValueError('expected a JSON array')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            if position >= len(buffer):
+                break
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f'invalid JSON: {e}') from e
+                # Probably cut off mid-value; read more and retry.
+                break
+            position = end
+            yield value
+        buffer = buffer[position:]
+        if eof:
+            raise ValueError('JSON array is not closed')
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+# Header names accepted in CSV imports, including those written by /export/csv.
+CSV_IMPORT_FIELDS = {
+    'description': 'description',
+    'tags': 'tags',
+    'url': 'url',
+    'file_group': 'file_group',
+    'file group': 'file_group',
+    'group': 'file_group',
+}
+
+def iter_import_records(fmt, stream):
+    """Yield raw link records from a binary ``stream`` in csv, json or ndjson."""
+    text = io.TextIOWrapper(io.BufferedReader(stream) if isinstance(stream, io.RawIOBase) else stream,
+                            encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        reader = csv.reader(text)
+        fields = ['description', 'tags', 'url', 'file_group']
+        for number, row in enumerate(reader):
+            if number == 0:
+                names = [CSV_IMPORT_FIELDS.get(name.strip().lower()) for name in row]
+                if 'url' in names:
+                    fields = names
+                    continue
+            if row:
+                yield {field: value for field, value in zip(fields, row) if field}
+    elif fmt == 'ndjson':
+        for line in text:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield ValueError(f'invalid JSON: {e}')
+    elif fmt == 'json':
+        yield from iter_json_array(text)
+    else:
+        raise ValueError(f'unsupported import format: {fmt}')
+
+def validate_link(record):
+    """Check an imported record and return its (description, tags, url, file_group)."""
+    if isinstance(record, ValueError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError('expected an object with description, tags, url and file_group')
+    tags = record.get('tags') or ''
+    if isinstance(tags, (list, tuple)):
+        tags = ', '.join(str(tag) for tag in tags)
+    description = str(record.get('description') or '').strip()
+    url = str(record.get('url') or '').strip()
+    file_group = str(record.get('file_group') or '').strip()
+    if not url.startswith('http://') and not url.startswith('https://'):
+        raise ValueError('URL must start with http:// or https://')
+    return description, str(tags).strip(), url, file_group
+
+# ``variants`` maps a content coding to the compressed body, filled in the
+# first time a client asks for that coding.
+CachedResponse = collections.namedtuple(
+    'CachedResponse', 'generation status content_type headers body variants')
+
+def entry_size(entry):
+    return len(entry.body) + sum(len(data) for data in entry.variants.values())
+
+class ResponseCache:
+    """LRU cache of rendered GET responses, bounded by entry count and bytes.
+
+    Entries are tagged with the data generation they were rendered from and
+    are only served while that generation is current, so any write to the
+    links table invalidates them without explicit purging.
+    """
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # One response may not take more than a quarter of the cache.
+        self.max_entry_bytes = max_bytes // 4
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != generation:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, entry):
+        if len(entry.body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry_size(entry)
+            self._evict()
+    
+    def add_variant(self, key, entry, encoding, data):
+        """Keep a compressed copy of ``entry`` alongside the identity body."""
+        with self._lock:
+            if self._entries.get(key) is not entry or encoding in entry.variants:
+                return
+            entry.variants[encoding] = data
+            self._bytes += len(data)
+            self._evict()
+    
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= entry_size(evicted)
+    
+    def _remove(self, key):
+        self._bytes -= entry_size(self._entries.pop(key))
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+class ResponseCapture:
+    """Collects a response body as it is sent so it can be cached."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.status = None
+        self.content_type = None
+        self.headers = None
+        self.parts = []
+        self.size = 0
+        self.complete = False
+        self.overflow = False
+    
+    def start(self, status, content_type, headers):
+        self.status = status
+        self.content_type = content_type
+        self.headers = dict(headers or {})
+    
+    def add(self, data):
+        if self.overflow:
+            return
+        self.size += len(data)
+        if self.size > self.limit:
+            self.overflow = True
+            self.parts = []
+        else:
+            self.parts.append(bytes(data))
+    
+    def body(self):
+        return b''.join(self.parts)
+
+class ChunkedWriter:
+    """Buffers a streamed response body into HTTP/1.1 chunks.
+
+    With ``chunked=False`` (HTTP/1.0 clients) the body is written raw and
+    the end of the response is marked by closing the connection. A zlib
+    ``compressor`` applies a Content-Encoding on the way out; ``capture``
+    always sees the uncompressed body.
+    """
+    def __init__(self, wfile, chunked=True, buffer_size=16384, capture=None, compressor=None):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self.capture = capture
+        self.compressor = compressor
+        self.sent = 0
+        self._buffer = []
+        self._buffered = 0
     
-    def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS links (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                description TEXT NOT NULL,
-                tags TEXT,
-                url TEXT NOT NULL,
-                file_group TEXT NOT NULL
-            )
-        ''')
-        conn.commit()
-        conn.close()
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if not data:
+            return
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self.flush()
     
-    def get_all_links(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM links')
-        links = cursor.fetchall()
-        conn.close()
-        return [{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]} for l in links]
+    def flush(self):
+        if not self._buffered:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if self.capture is not None:
+            self.capture.add(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self._send(data)
     
-    def get_links_by_group(self, group):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM links WHERE file_group = ?', (group,))
-        links = cursor.fetchall()
-        conn.close()
-        return [{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]} for l in links]
+    def _send(self, data):
+        if not data:
+            return
+        self.sent += len(data)
+        if self.chunked:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        else:
+            self.wfile.write(data)
     
-    def search_links(self, query):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM links 
-            WHERE description LIKE ? OR tags LIKE ? OR url LIKE ?
-        ''', (f'%{query}%', f'%{query}%', f'%{query}%'))
-        links = cursor.fetchall()
-        conn.close()
-        return [{'id': l[0], 'description': l[1], 'tags': l[2], 'url': l[3], 'file_group': l[4]} for l in links]
+    def close(self):
+        self.flush()
+        if self.compressor is not None:
+            self._send(self.compressor.flush())
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        if self.capture is not None:
+            self.capture.complete = True
+
+class Template:
+    """A template parsed once into literal text and ``{{ name }}`` slots.
+
+    Slot values must be strings and are HTML-escaped; ``{{ name|raw }}``
+    inserts markup (or numbers) as is and ``{{ name|url }}`` percent-encodes
+    the value. Parsing compiles the
+    segments into one Python function, so rendering is a single f-string
+    evaluation with no scanning or per-slot dispatch.
+    """
+    FILTERS = {
+        'html': html.escape,
+        'url': lambda value: urllib.parse.quote(str(value)),
+    }
+    SLOT = re.compile(r'\{\{\s*(\w+)(?:\|(\w+))?\s*\}\}')
     
-    def add_link(self, description, tags, url, file_group):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO links (description, tags, url, file_group)
-            VALUES (?, ?, ?, ?)
-        ''', (description, tags, url, file_group))
-        conn.commit()
-        conn.close()
+    def __init__(self, source=''):
+        self.segments = []
+        position = 0
+        for match in self.SLOT.finditer(source):
+            if match.start() > position:
+                self.segments.append(source[position:match.start()])
+            self.segments.append((match.group(1), match.group(2) or 'html'))
+            position = match.end()
+        if position < len(source):
+            self.segments.append(source[position:])
+        self.compile()
     
-    def update_link(self, link_id, description, tags, url, file_group):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE links 
-            SET description = ?, tags = ?, url = ?, file_group = ?
-            WHERE id = ?
-        ''', (description, tags, url, file_group, link_id))
-        conn.commit()
-        conn.close()
+    def compile(self):
+        parts = []
+        values = {}
+        for segment in self.segments:
+            if segment.__class__ is str:
+                for char, escaped in (('\\', '\\\\'), ("'", "\\'"), ('\n', '\\n'), ('\r', '\\r'),
+                                      ('{', '{{'), ('}', '}}')):
+                    segment = segment.replace(char, escaped)
+                parts.append(segment)
+            else:
+                # A slot used twice (a URL in href and text) is filtered once.
+                variable = values.setdefault(segment, f'v{len(values)}')
+                parts.append(f'{{{variable}}}')
+        lines = ['def render(c):']
+        for (name, filter_name), variable in values.items():
+            if filter_name == 'raw':
+                lines.append(f'    {variable} = c["{name}"]')
+            else:
+                lines.append(f'    {variable} = {filter_name}(c["{name}"])')
+        lines.append(f"    return f'{''.join(parts)}'")
+        namespace = {}
+        exec('\n'.join(lines), dict(self.FILTERS), namespace)
+        self.render_context = namespace['render']
     
-    def delete_link(self, link_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM links WHERE id = ?', (link_id,))
-        conn.commit()
-        conn.close()
+    def render(self, context=None, **kwargs):
+        return self.render_context(kwargs if context is None else context)
     
-    def get_link(self, link_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM links WHERE id = ?', (link_id,))
-        link = cursor.fetchone()
-        conn.close()
-        if link:
-            return {'id': link[0], 'description': link[1], 'tags': link[2], 'url': link[3], 'file_group': link[4]}
-        return None
+    def render_into(self, out, context):
+        out.append(self.render_context(context))
     
-    def get_groups(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT DISTINCT file_group FROM links')
-        groups = cursor.fetchall()
-        conn.close()
-        return [g[0] for g in groups]
-    
-    def get_stats(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM links')
-        total_links = cursor.fetchone()[0]
-        cursor.execute('SELECT COUNT(DISTINCT file_group) FROM links')
-        total_groups = cursor.fetchone()[0]
-        cursor.execute('''
-            SELECT file_group, COUNT(*) as count 
-            FROM links 
-            GROUP BY file_group 
-            ORDER BY count DESC 
-            LIMIT 1
-        ''')
-        most_group = cursor.fetchone()
-        conn.close()
-        return {
-            'total_links': total_links,
-            'total_groups': total_groups,
-            'most_group': most_group
+    def split(self, name):
+        """Return the templates before and after the slot ``name``."""
+        for i, segment in enumerate(self.segments):
+            if segment.__class__ is not str and segment[0] == name:
+                before, after = Template(), Template()
+                before.segments, after.segments = self.segments[:i], self.segments[i + 1:]
+                before.compile()
+                after.compile()
+                return before, after
+        raise KeyError(name)
+
+STYLESHEET = '''body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
+.container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+.container.narrow { max-width: 600px; }
+h1 { color: #333; text-align: center; }
+h2 { color: #495057; font-size: 1.1em; margin-top: 30px; }
+.nav { margin-bottom: 20px; text-align: center; }
+.nav a { margin: 0 10px; padding: 10px 20px; background: #007bff; color: white; text-decoration: none; border-radius: 5px; }
+.nav a:hover { background: #0056b3; }
+.search-box { margin: 20px 0; text-align: center; }
+.search-box input { padding: 10px; width: 300px; border: 1px solid #ddd; border-radius: 5px; }
+.search-box button { padding: 10px 20px; background: #28a745; color: white; border: none; border-radius: 5px; cursor: pointer; }
+.group-filter { margin: 20px 0; text-align: center; }
+.group-filter select { padding: 10px; border: 1px solid #ddd; border-radius: 5px; }
+table { width: 100%; border-collapse: collapse; margin-top: 20px; }
+th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
+th { background-color: #f8f9fa; font-weight: bold; }
+th a { color: inherit; text-decoration: none; }
+table.compact { margin-top: 0; }
+table.compact th, table.compact td { padding: 8px; }
+td a { color: #007bff; text-decoration: none; }
+.action-buttons a { margin-right: 10px; padding: 5px 10px; text-decoration: none; border-radius: 3px; }
+.edit-btn { background: #ffc107; color: #212529; }
+.delete-btn { background: #dc3545; color: white; }
+form.inline { display: inline; }
+.url-cell { max-width: 300px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+.group-filter select + select { margin-left: 10px; }
+.health { padding: 2px 6px; border-radius: 3px; font-size: 0.85em; white-space: nowrap; }
+.health-ok { background: #d4edda; color: #155724; }
+.health-redirected { background: #fff3cd; color: #856404; }
+.health-broken, .health-unreachable { background: #f8d7da; color: #721c24; }
+mark { background: #fff3a0; padding: 0 1px; }
+.pager { margin-top: 20px; text-align: center; }
+.pager a { margin: 0 10px; color: #007bff; text-decoration: none; }
+.form-group { margin-bottom: 15px; }
+.form-group label { display: block; margin-bottom: 5px; font-weight: bold; }
+.form-group input, .form-group textarea, .form-group select { width: 100%; padding: 10px; border: 1px solid #ddd; border-radius: 5px; box-sizing: border-box; }
+.form-group input[type="checkbox"] { width: auto; }
+.primary-btn { background: #007bff; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer; }
+.primary-btn:hover { background: #0056b3; }
+.error { color: red; margin-bottom: 10px; }
+.stat-item { margin: 20px 0; padding: 15px; background: #f8f9fa; border-radius: 5px; }
+.stat-label { font-weight: bold; color: #495057; }
+.stat-value { font-size: 1.2em; color: #007bff; margin-top: 5px; }
+.tag-cloud { margin: 20px 0; line-height: 2.2; text-align: center; }
+.tag-cloud a { margin: 0 8px; color: #007bff; text-decoration: none; white-space: nowrap; }
+.tag-cloud a:hover { text-decoration: underline; }
+.back-link { margin-top: 20px; text-align: center; }
+.back-link a { color: #007bff; text-decoration: none; margin: 0 10px; }
+'''
+
+# name -> (body, content type, fingerprint, precompressed variants); served
+# at /static/<stem>.<fingerprint><ext>.
+STATIC_FILES = {}
+
+def add_static_file(name, body, content_type):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    variants = {encoding: compress_body(body, encoding, 9) for encoding in ENCODING_WBITS}
+    STATIC_FILES[name] = (body, content_type, hashlib.sha1(body).hexdigest()[:10], variants)
+
+def static_url(name):
+    stem, ext = os.path.splitext(name)
+    return f'/static/{stem}.{STATIC_FILES[name][2]}{ext}'
+
+add_static_file('app.css', STYLESHEET, 'text/css; charset=utf-8')
+
+# Fills the <datalist> of each input[data-suggest] from /suggest as the user
+# types, completing the last word (or tag) of the value.
+SUGGEST_SCRIPT = '''document.querySelectorAll('input[data-suggest]').forEach(function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var kind = input.dataset.suggest;
+    var asked = 0;
+    input.addEventListener('input', function () {
+        var value = input.value;
+        var split = kind === 'tag' ? value.search(/[^,|]*$/) : value.search(/\\S*$/);
+        var prefix = value.slice(split);
+        var lead = prefix.match(kind === 'tag' ? /^\\s*-?/ : /^[-"(]*/)[0];
+        var head = value.slice(0, split) + lead;
+        prefix = prefix.slice(lead.length);
+        var ask = ++asked;
+        if (!prefix) {
+            list.replaceChildren();
+            return;
         }
+        fetch('/suggest?limit=8&q=' + encodeURIComponent(prefix) + (kind === 'any' ? '' : '&kind=' + kind))
+            .then(function (response) { return response.ok ? response.json() : []; })
+            .then(function (suggestions) {
+                if (ask !== asked) {
+                    return;
+                }
+                list.replaceChildren.apply(list, suggestions.map(function (suggestion) {
+                    var option = document.createElement('option');
+                    option.value = head + suggestion.text;
+                    option.label = suggestion.kind + ', ' + suggestion.count;
+                    return option;
+                }));
+            });
+    });
+});
+'''
+add_static_file('suggest.js', SUGGEST_SCRIPT, 'text/javascript; charset=utf-8')
+
+LAYOUT = Template('''<!DOCTYPE html>
+<html>
+<head>
+    <title>{{title}}</title>
+    <link rel="stylesheet" href="{{stylesheet}}">
+</head>
+<body>
+    <div class="container{{container_class}}">
+{{content|raw}}
+    </div>
+</body>
+</html>
+''')
+LAYOUT_HEAD, LAYOUT_FOOT = LAYOUT.split('content')
+
+BACK_LINK = '<div class="back-link"><a href="/">← Back to Home</a></div>'
+
+INDEX_HEAD = Template('''        <h1>Web Links Manager</h1>
+        <div class="nav">
+            <a href="/">Home</a>
+            <a href="/add">Add Link</a>
+            <a href="/import">Import</a>
+            <a href="/tags">Tags</a>
+            <a href="/stats">Stats</a>
+        </div>
+        <div class="search-box">
+            <form action="/search" method="GET">
+                <input type="text" name="q" placeholder="Search links... (&quot;exact phrase&quot;, prefix*)" value="{{search}}"
+                       list="search-suggestions" data-suggest="any" autocomplete="off">
+                <datalist id="search-suggestions"></datalist>
+                <button type="submit">Search</button>
+            </form>
+        </div>
+        <div class="search-box">
+            <form action="/" method="GET">{{group_input|raw}}
+                <input type="text" name="tags" placeholder="Filter by tags... (a,b  a|b  -a)" value="{{tags}}"
+                       list="tag-suggestions" data-suggest="tag" autocomplete="off">
+                <datalist id="tag-suggestions"></datalist>
+                <button type="submit">Filter</button>
+            </form>
+        </div>
+        <div class="group-filter">
+            <select onchange="window.location.href=this.value">
+                <option value="/">All Groups</option>{{group_options|raw}}
+            </select>{{health_select|raw}}
+        </div>
+        <script src="{{suggest_script}}" defer></script>
+        <table>
+            <thead>
+                <tr>{{column_headers|raw}}<th>Actions</th></tr>
+            </thead>
+            <tbody>
+''')
+
+GROUP_OPTION = Template('<option value="/?group={{group|url}}"{{selected}}>{{group}}</option>')
+HEALTH_OPTION = Template('<option value="{{url|raw}}"{{selected}}>{{label}}</option>')
+HEALTH_BADGE = Template('<span class="health health-{{state}}" title="{{title}}">{{state}}</span>')
+CLICK_COUNT = Template('<span title="last click {{when}}">{{clicks|raw}}</span>')
+
+LINK_ROW_SOURCE = '''<tr><td>{{description}}</td><td>{{tags}}</td><td class="url-cell"><a href="/go/{{id|raw}}" target="_blank">{{url}}</a></td><td>{{health|raw}}</td><td>{{clicks|raw}}</td><td>{{file_group}}</td><td><a href="/edit/{{id|raw}}" class="action-buttons edit-btn">Edit</a><form method="POST" action="/delete/{{id|raw}}" class="inline"><button type="submit" class="action-buttons delete-btn" onclick="return confirm('Are you sure?')">Delete</button></form></td></tr>
+'''
+LINK_ROW = Template(LINK_ROW_SOURCE)
+# Search results carry pre-escaped, highlighted description and tags.
+SEARCH_ROW = Template(LINK_ROW_SOURCE.replace('{{description}}', '{{description|raw}}')
+                      .replace('{{tags}}', '{{tags|raw}}'))
+
+INDEX_FOOT = Template('''            </tbody>
+        </table>
+        {{pager|raw}}
+''')
+
+LINK_FORM = Template('''        <h1>{{heading}}</h1>
+        {{error_html|raw}}
+        <form method="POST">
+            <div class="form-group">
+                <label for="description">Description:</label>
+                <input type="text" id="description" name="description" value="{{description}}" required>
+            </div>
+            <div class="form-group">
+                <label for="tags">Tags:</label>
+                <input type="text" id="tags" name="tags" value="{{tags}}">
+            </div>
+            <div class="form-group">
+                <label for="url">URL:</label>
+                <input type="url" id="url" name="url" value="{{url}}" required>
+            </div>
+            <div class="form-group">
+                <label for="file_group">Group:</label>
+                <input type="text" id="file_group" name="file_group" value="{{file_group}}" required>
+            </div>
+            <button type="submit" class="primary-btn">{{submit}}</button>
+        </form>
+        ''' + BACK_LINK)
+
+IMPORT_FORM = Template('''        <h1>Import Links</h1>
+        {{error_html|raw}}
+        <form method="POST" enctype="multipart/form-data">
+            <div class="form-group">
+                <label for="format">Format:</label>
+                <select id="format" name="format">
+                    <option value="auto">Detect from file extension</option>
+                    <option value="csv">CSV</option>
+                    <option value="json">JSON</option>
+                    <option value="ndjson">NDJSON (one JSON object per line)</option>
+                </select>
+            </div>
+            <div class="form-group">
+                <label for="on_duplicate">Links whose URL is already stored:</label>
+                <select id="on_duplicate" name="on_duplicate">{{duplicate_options|raw}}
+                </select>
+            </div>
+            <div class="form-group">
+                <label for="file">File:</label>
+                <input type="file" id="file" name="file" accept=".csv,.json,.ndjson,.jsonl" required>
+            </div>
+            <button type="submit" class="primary-btn">Import</button>
+        </form>
+        ''' + BACK_LINK)
+
+IMPORT_RESULT = Template('''        <h1>Import Finished</h1>
+        <div class="stat-item"><span class="stat-label">Imported:</span> {{imported|raw}}</div>
+        <div class="stat-item"><span class="stat-label">Skipped duplicates:</span> {{skipped|raw}}</div>
+        <div class="stat-item"><span class="stat-label">Merged into stored links:</span> {{merged|raw}}</div>
+        <div class="stat-item"><span class="stat-label">Updated stored links:</span> {{updated|raw}}</div>
+        <div class="stat-item"><span class="stat-label">Invalid rows:</span> {{invalid|raw}}</div>
+        {{errors_html|raw}}
+        <div class="back-link"><a href="/">← Back to Home</a><a href="/import">Import another file</a></div>
+''')
+
+STAT_ITEM = Template('''        <div class="stat-item">
+            <div class="stat-label">{{label}}:</div>
+            <div class="stat-value">{{value}}</div>
+        </div>
+''')
+
+STATS_PAGE = Template('''        <h1>Statistics</h1>
+{{items|raw}}        <h2>Links per Group</h2>
+        <table class="compact">
+            <thead><tr><th>Group</th><th>Links</th><th>Share</th></tr></thead>
+            <tbody>{{group_rows|raw}}</tbody>
+        </table>
+        <h2>Top {{tag_count|raw}} Tags</h2>
+        <table class="compact">
+            <thead><tr><th>Tag</th><th>Links</th></tr></thead>
+            <tbody>{{tag_rows|raw}}</tbody>
+        </table>
+        <h2>Most Clicked</h2>
+        <table class="compact">
+            <thead><tr><th>Link</th><th>Clicks</th><th>Last Click</th></tr></thead>
+            <tbody>{{most_clicked_rows|raw}}</tbody>
+        </table>
+        <p><a href="/?sort=clicks&amp;order=desc">All links by clicks</a></p>
+        <h2>Recently Clicked</h2>
+        <table class="compact">
+            <thead><tr><th>Link</th><th>Clicks</th><th>Last Click</th></tr></thead>
+            <tbody>{{recently_clicked_rows|raw}}</tbody>
+        </table>
+        <p><a href="/?sort=clicked&amp;order=desc">All links by last click</a>
+        &middot; <a href="/?sort=clicked">Links clicked least recently</a></p>
+        ''' + BACK_LINK)
+
+GROUP_STAT_ROW = Template('<tr><td><a href="/?group={{name|url}}">{{name}}</a></td><td>{{count|raw}}</td><td>{{share}}</td></tr>')
+TAG_STAT_ROW = Template('<tr><td><a href="/?tags={{tag|url}}">{{tag}}</a></td><td>{{count|raw}}</td></tr>')
+CLICK_STAT_ROW = Template('<tr><td><a href="/go/{{id|raw}}" title="{{url}}">{{description}}</a></td>'
+                          '<td>{{clicks|raw}}</td><td>{{when}}</td></tr>')
+
+TAG_CLOUD_PAGE = Template('''        <h1>Tags</h1>
+        <p>{{tag_count|raw}} tags. Combine them on the home page: <code>a,b</code> needs both,
+        <code>a|b</code> either, <code>-a</code> leaves a tag out.</p>
+        <div class="tag-cloud">{{items|raw}}</div>
+        ''' + BACK_LINK)
+
+TAG_CLOUD_ITEM = Template('<a href="/?tags={{tag|url}}" style="font-size: {{size|raw}}em" title="{{count|raw}} links">{{tag}}</a> ')
 
 class LinkHandler(BaseHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.link_manager = LinkManager()
-        super().__init__(*args, **kwargs)
+    # HTTP/1.1 keeps connections open between requests; every response
+    # therefore carries a Content-Length (or is chunked).
+    protocol_version = 'HTTP/1.1'
+    # Socket timeout for reading a request once it has started, and for the
+    # first request of a connection.
+    timeout = 15
+    # A kept-alive connection gives its worker thread back after this long
+    # without a request, or at once when other connections wait for a thread.
+    keep_alive_timeout = 1.0
+    keep_alive_poll = 0.05
+    # Headers and body go out in separate writes; without TCP_NODELAY a
+    # kept-alive connection stalls on delayed ACKs between them.
+    disable_nagle_algorithm = True
+    # Rows per page on / and /search; ?per_page= may ask for up to max_page_size.
+    page_size = 50
+    max_page_size = 500
+    # Rows per import transaction, and how often imports log their progress.
+    import_batch_size = 20000
+    import_progress_every = 100000
+    # zlib level for negotiated Content-Encoding (0 disables), and the smallest
+    # complete body worth compressing.
+    compress_level = 6
+    compress_min_size = 1024
+    # Largest JSON request body the API will read.
+    max_json_body = 64 * 1024 * 1024
+    # Requests slower than this are logged with their SQL breakdown (0 disables).
+    slow_request_ms = 1000
+    # What adding a link whose canonical URL is already stored does (DUPLICATE_POLICIES).
+    on_duplicate = 'reject'
+    # Path prefixes reported as one route, so metric labels stay bounded.
+    METRIC_ROUTES = ('/edit/', '/delete/', '/export/', '/static/', '/api/links/', '/go/')
+    # Cached pages that show click counts; their validators include the click generation.
+    CLICK_PAGES = ('/', '/search', '/stats')
+    # Cached pages that show link health; their validators include the health generation. /api/links
+    # joins them when filtered by health.
+    HEALTH_PAGES = ('/', '/search')
+    # Most changes per /api/changes response, and the longest ?wait= it honours.
+    max_changes_page = 5000
+    max_change_wait = 30
+    # Reports on --snapshot-dir at /admin/snapshots; None leaves the page out.
+    snapshotter = None
+    
+    @property
+    def link_manager(self):
+        return self.server.link_manager
+    
+    def handle(self):
+        self.close_connection = True
+        if self.wait_for_request(self.timeout, self.keep_alive_timeout):
+            self.handle_one_request()
+        while not self.close_connection and self.wait_for_request(self.keep_alive_timeout, 0):
+            self.handle_one_request()
+    
+    def wait_for_request(self, limit, patience):
+        """Wait up to ``limit`` seconds for the next request to arrive; False to close the connection instead.
+
+        Once the connection has been quiet for ``patience`` seconds the wait
+        also ends as soon as accepted connections queue for a worker thread,
+        so idle clients cannot starve active ones.
+        """
+        start = time.monotonic()
+        while True:
+            # A pipelined request may already sit in the read buffer.
+            self.connection.settimeout(0)
+            try:
+                if self.rfile.peek(1):
+                    return True
+            except OSError:
+                return False
+            finally:
+                self.connection.settimeout(self.timeout)
+            idle = time.monotonic() - start
+            if idle >= limit or (idle >= patience and getattr(self.server, 'queue_depth', 0)):
+                return False
+            if select.select([self.connection], [], [], min(self.keep_alive_poll, limit - idle))[0]:
+                return True
+    
+    def handle_one_request(self):
+        self._request_start = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._request_start is not None:
+                self.record_request()
+    
+    def parse_request(self):
+        # The request line has been read; time from here to the last byte out.
+        self._request_start = time.perf_counter()
+        self._status = None
+        self._response_bytes = 0
+        self._stream = None
+        _sql_trace.calls = []
+        METRICS.add_in_flight(1)
+        ok = super().parse_request()
+        if not getattr(self.server, 'keep_alive', True):
+            # A single-threaded server cannot afford to wait on idle clients.
+            self.close_connection = True
+        return ok
+    
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+    
+    def route_label(self, path):
+        if path in ('/', '/add', '/search', '/stats', '/tags', '/import', '/metrics',
+                    '/api/links', '/api/links:batch', '/api/tags', '/api/changes', '/suggest', '/admin/snapshots'):
+            return path
+        for prefix in self.METRIC_ROUTES:
+            if path.startswith(prefix):
+                return prefix + '*'
+        return 'other'
+    
+    def record_request(self):
+        """Count the finished request into METRICS and log it if it was slow."""
+        elapsed = time.perf_counter() - self._request_start
+        calls, _sql_trace.calls = _sql_trace.calls, None
+        METRICS.add_in_flight(-1)
+        path = urllib.parse.urlsplit(getattr(self, 'path', '') or '')
+        route = self.route_label(path.path)
+        method = getattr(self, 'command', None) or 'other'
+        size = self._stream.sent if self._stream is not None else self._response_bytes
+        METRICS.inc('links_http_requests_total',
+                    (('route', route), ('method', method), ('status', self._status or 0)))
+        METRICS.observe('links_http_request_duration_seconds', (('route', route),), elapsed)
+        METRICS.observe('links_http_response_size_bytes', (('route', route),), size)
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            breakdown = '; '.join(f'{name} {seconds * 1000:.1f} ms {rows} rows' for name, seconds, rows in calls or ())
+            self.log_message('slow request: %s %s%s %.1f ms status %s, %d bytes; sql: %s',
+                             method, path.path, '?' + path.query if path.query else '',
+                             elapsed * 1000, self._status, size, breakdown or 'none')
+    
+    def send_metrics(self):
+        samples = []
+        queue_depth = getattr(self.server, 'queue_depth', None)
+        if queue_depth is not None:
+            samples.append(('links_http_queue_depth', 'gauge',
+                            'Connections or requests waiting for a handler thread.', queue_depth))
+        cache = getattr(self.server, 'response_cache', None)
+        if cache is not None:
+            samples += [
+                ('links_response_cache_entries', 'gauge', 'Responses held in the page cache.', len(cache._entries)),
+                ('links_response_cache_bytes', 'gauge', 'Bytes held in the page cache.', cache._bytes),
+                ('links_response_cache_hits_total', 'counter', 'Page cache hits.', cache.hits),
+                ('links_response_cache_misses_total', 'counter', 'Page cache misses.', cache.misses),
+            ]
+        replica = self.link_manager.replica
+        if replica is not None:
+            samples += [
+                ('links_replica_rows', 'gauge', 'Links held in the in-memory replica.', len(replica.ids)),
+                ('links_replica_bytes', 'gauge', 'Estimated size of the in-memory replica.', replica.size),
+                ('links_replica_loads_total', 'counter', 'Full loads of the in-memory replica.', replica.loads),
+            ]
+        suggestions = self.link_manager.suggestions
+        if suggestions is not None:
+            samples += [
+                ('links_suggest_terms', 'gauge', 'Distinct terms in the typeahead index.', len(suggestions.terms)),
+                ('links_suggest_loads_total', 'counter', 'Full builds of the typeahead index.', suggestions.loads),
+            ]
+        write_queue = self.link_manager.write_queue
+        if write_queue is not None:
+            samples += [
+                ('links_group_commit_batches_total', 'counter', 'Transactions committed by the writer thread.',
+                 write_queue.batches),
+                ('links_group_commit_writes_total', 'counter', 'Writes committed by the writer thread.',
+                 write_queue.writes),
+            ]
+        samples.append(('links_changes_waiting', 'gauge', 'Requests waiting in /api/changes for a change.',
+                        self.link_manager._change_waiters))
+        clicks = self.link_manager.clicks
+        samples += [
+            ('links_clicks_total', 'counter', 'Clicks on /go/ links written to the database.', clicks.clicks),
+            ('links_clicks_pending', 'gauge', 'Clicks counted in memory, not written yet.', clicks.pending()),
+            ('links_click_flushes_total', 'counter', 'Transactions that wrote counted clicks.', clicks.flushes),
+        ]
+        generation, _ = self.link_manager.data_generation()
+        samples.append(('links_data_generation', 'gauge', 'Current data generation (bumped on every write).',
+                        generation))
+        self.send_body(METRICS.render(samples).encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8',
+                       headers={'Cache-Control': 'no-store'})
+    
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection':
+            self._connection_header_sent = True
+        super().send_header(keyword, value)
+    
+    def end_headers(self):
+        if (self.close_connection and self.request_version == 'HTTP/1.1'
+                and not getattr(self, '_connection_header_sent', False)):
+            super().send_header('Connection', 'close')
+        self._connection_header_sent = False
+        super().end_headers()
     
     def parse_form_data(self):
         """Parse form data from POST request"""
@@ -133,27 +4598,16 @@ class LinkHandler(BaseHTTPRequestHandler):
         if content_length == 0:
             return {}
         
-        post_data = self.rfile.read(content_length).decode('utf-8')
         form_data = {}
         
         # Check if it's multipart form data
         if 'multipart/form-data' in self.headers.get('Content-Type', ''):
-            # Simple multipart parsing for file uploads
-            boundary = self.headers.get('Content-Type').split('boundary=')[1]
-            parts = post_data.split('--' + boundary)
-            
-            for part in parts:
-                if 'Content-Disposition: form-data' in part:
-                    lines = part.split('\r\n')
-                    for i, line in enumerate(lines):
-                        if 'name=' in line:
-                            name = line.split('name="')[1].split('"')[0]
-                            if i + 2 < len(lines):
-                                value = lines[i + 2]
-                                form_data[name] = value
-                            break
+            boundary = MultipartReader.boundary_from(self.headers.get('Content-Type'))
+            for part in MultipartReader(self.rfile, boundary, content_length):
+                form_data[part.name] = part.read().decode('utf-8', 'replace')
         else:
             # Regular form data
+            post_data = self.rfile.read(content_length).decode('utf-8')
             pairs = post_data.split('&')
             for pair in pairs:
                 if '=' in pair:
@@ -162,85 +4616,449 @@ class LinkHandler(BaseHTTPRequestHandler):
         
         return form_data
     
+    def handle_import(self):
+        """Stream an uploaded CSV, JSON or NDJSON file into the database.
+
+        Form fields sent before the file part (``format``, ``on_duplicate``)
+        choose how it is read; without ``format`` the file extension decides.
+        """
+        boundary = MultipartReader.boundary_from(self.headers.get('Content-Type', ''))
+        length = int(self.headers.get('Content-Length', 0))
+        fields = {}
+        result = None
+        logged = 0
+        
+        def progress(counts):
+            nonlocal logged
+            done = counts['imported'] + counts['skipped'] + counts['invalid']
+            if done - logged >= self.import_progress_every:
+                logged = done
+                self.log_message('import: %d imported, %d skipped, %d invalid',
+                                 counts['imported'], counts['skipped'], counts['invalid'])
+        
+        for part in MultipartReader(self.rfile, boundary, length):
+            if part.filename is None:
+                fields[part.name] = part.read().decode('utf-8', 'replace')
+                continue
+            if not part.filename or result is not None:
+                continue
+            fmt = fields.get('format') or 'auto'
+            if fmt == 'auto':
+                fmt = os.path.splitext(part.filename)[1].lstrip('.').lower()
+                fmt = {'jsonl': 'ndjson'}.get(fmt, fmt)
+            if fmt not in EXPORT_FORMATS:
+                raise ValueError(f'cannot import {part.filename!r}: choose CSV, JSON or NDJSON')
+            result = self.link_manager.import_links(
+                iter_import_records(fmt, part),
+                on_duplicate=fields.get('on_duplicate') or self.on_duplicate,
+                batch_size=self.import_batch_size, progress=progress)
+        if result is None:
+            raise ValueError('choose a file to import')
+        return result
+    
+    def accepted_encoding(self):
+        """The content coding the client prefers among gzip and deflate, if any."""
+        quality = {}
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            coding, _, params = item.partition(';')
+            coding = coding.strip().lower()
+            q = 1.0
+            for param in params.split(';'):
+                name, _, value = param.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            quality[coding] = q
+        best, best_q = None, 0.0
+        for coding in ENCODING_WBITS:
+            q = quality.get(coding, quality.get('*', 0.0))
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+    
+    def choose_encoding(self, content_type, size=None):
+        """Coding for a response body; ``size`` is None for streamed bodies."""
+        if self.compress_level <= 0 or not is_compressible(content_type):
+            return None
+        if size is not None and size < self.compress_min_size:
+            return None
+        return self.accepted_encoding()
+    
+    def send_encoding_headers(self, content_type, encoding):
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        if self.compress_level > 0 and is_compressible(content_type):
+            self.send_header('Vary', 'Accept-Encoding')
+    
+    def send_body(self, body, content_type, status=200, headers=None, variants=None):
+        """Send a complete response with an exact Content-Length.
+
+        The body is compressed when the client accepts it; ``variants`` may
+        hold precompressed copies keyed by content coding.
+        """
+        capture = getattr(self, '_capture', None)
+        if capture is not None:
+            capture.start(status, content_type, headers)
+            capture.add(body)
+            capture.complete = True
+        encoding = self.choose_encoding(content_type, len(body))
+        if encoding is not None:
+            encoded = (variants or {}).get(encoding)
+            body = encoded if encoded is not None else compress_body(body, encoding, self.compress_level)
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_encoding_headers(content_type, encoding)
+        self.send_validators()
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self._response_bytes = len(body)
+    
+    def send_html(self, content, status=200):
+        self.send_body(content.encode('utf-8'), 'text/html; charset=utf-8', status)
+    
+    def start_stream(self, content_type, status=200, headers=None):
+        """Send headers for a body of unknown length and return its writer."""
+        chunked = self.request_version == 'HTTP/1.1'
+        capture = getattr(self, '_capture', None)
+        if capture is not None:
+            capture.start(status, content_type, headers)
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        encoding = self.choose_encoding(content_type)
+        self.send_encoding_headers(content_type, encoding)
+        self.send_validators()
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = True
+        self.end_headers()
+        compressor = compressor_for(encoding, self.compress_level) if encoding else None
+        self._stream = ChunkedWriter(self.wfile, chunked=chunked, capture=capture, compressor=compressor)
+        return self._stream
+    
+    def send_validators(self):
+        for name, value in (getattr(self, '_validators', None) or {}).items():
+            self.send_header(name, value)
+    
+    def is_cacheable(self, path):
+        return (path in ('/', '/search', '/stats', '/tags', '/api/links', '/api/tags')
+                or path.startswith('/export/') or path.startswith('/api/links/'))
+    
+    def not_modified(self, etag, modified):
+        """Evaluate If-None-Match / If-Modified-Since against the current data."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # Weak comparison: W/"x" and "x" name the same version.
+            opaque = lambda tag: tag[2:] if tag.startswith('W/') else tag
+            tags = [opaque(tag.strip()) for tag in if_none_match.split(',')]
+            return '*' in tags or opaque(etag) in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return modified <= since
+        return False
+    
+    def conditional_get(self, path, query):
+        """Serve a read-only page with validators, a 304, or from the cache.
+
+        The ETag is derived from the data generation and the normalized URL,
+        so it can be checked before any rendering or SQL beyond one lookup.
+        Pages showing clicks or link health add those generations to it.
+        """
+        generation, modified = self.link_manager.data_generation()
+        params = sorted(urllib.parse.parse_qsl(query))
+        key = path + '?' + urllib.parse.urlencode(params)
+        generations = [generation]
+        if path in self.CLICK_PAGES:
+            clicks, clicks_modified = self.link_manager.click_generation()
+            generations.append(clicks)
+            modified = max(modified, clicks_modified)
+        if path in self.HEALTH_PAGES or (path == '/api/links' and any(name == 'health' for name, _ in params)):
+            health, health_modified = self.link_manager.health_generation()
+            generations.append(health)
+            modified = max(modified, health_modified)
+        version = '.'.join(f'{part:x}' for part in generations)
+        if len(generations) > 1:
+            generation = tuple(generations)
+        etag = f'W/"{version}-{zlib.crc32(key.encode("utf-8")):08x}"'
+        validators = {
+            'ETag': etag,
+            'Last-Modified': email.utils.formatdate(modified, usegmt=True),
+            'Cache-Control': 'no-cache',
+        }
+        if self.not_modified(etag, modified):
+            self.send_response(304)
+            for name, value in validators.items():
+                self.send_header(name, value)
+            if self.compress_level > 0:
+                self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+        cache = getattr(self.server, 'response_cache', None)
+        self._validators = validators
+        try:
+            self._capture = None
+            if cache is not None:
+                entry = cache.get(key, generation)
+                if entry is not None:
+                    encoding = self.choose_encoding(entry.content_type, len(entry.body))
+                    if encoding is not None and encoding not in entry.variants:
+                        cache.add_variant(key, entry, encoding,
+                                          compress_body(entry.body, encoding, self.compress_level))
+                    self.send_body(entry.body, entry.content_type, entry.status, entry.headers,
+                                   variants=entry.variants)
+                    return
+                self._capture = ResponseCapture(cache.max_entry_bytes)
+            self.route_get(path, urllib.parse.parse_qs(query))
+            capture = self._capture
+            if capture is not None and capture.complete and not capture.overflow and capture.status == 200:
+                cache.put(key, CachedResponse(generation, capture.status, capture.content_type,
+                                              capture.headers, capture.body(), {}))
+        finally:
+            self._validators = None
+            self._capture = None
+    
+    def parse_listing(self, query_params):
+        """Read group, sort order, page size and cursors for the link listing."""
+        def param(name, default=None):
+            return query_params.get(name, [default])[0]
+        sort = param('sort', 'id')
+        if sort not in LinkManager.SORT_COLUMNS:
+            raise ValueError(f'cannot sort by {sort!r}')
+        limit = int(param('per_page', self.page_size))
+        if not 1 <= limit <= self.max_page_size:
+            raise ValueError(f'per_page must be between 1 and {self.max_page_size}')
+        tags = param('tags') or None
+        if tags:
+            parse_tag_filter(tags)
+        health = param('health') or None
+        if health is not None and health not in LinkManager.HEALTH_STATES:
+            raise ValueError(f'health must be one of {", ".join(LinkManager.HEALTH_STATES)}')
+        return {
+            'group': param('group') or None,
+            'tags': tags,
+            'health': health,
+            'sort': sort,
+            'descending': param('order') == 'desc',
+            'limit': limit,
+            'after': param('after'),
+            'before': param('before'),
+        }
+    
+    def stream_index(self, groups, listing):
+        """Write the unpaginated listing row by row as it comes off the cursor."""
+        links = self.link_manager.iter_links(listing['group'], listing['sort'], listing['descending'],
+                                             tags=listing['tags'], health=listing['health'])
+        self.stream_rows(self.render_index_head(groups, listing=listing), links)
+    
+    def stream_search(self, groups, query):
+        """Write every match of ``query``, in id order, row by row as it comes off the cursor."""
+        self.stream_rows(self.render_index_head(groups, search=query), self.link_manager.iter_search_links(query))
+    
+    def stream_rows(self, head, links):
+        """Write ``head``, the rows for ``links`` in batches and the page foot as one chunked response."""
+        out = self.start_stream('text/html; charset=utf-8')
+        out.write(head)
+        batch = []
+        for link in links:
+            batch.append(link)
+            if len(batch) == 256:
+                out.write(self.render_link_rows(batch))
+                batch = []
+        out.write(self.render_link_rows(batch) + self.render_index_foot())
+        out.close()
+    
+    def serve_static(self, path):
+        """Serve a bundled asset; fingerprinted URLs may be cached forever."""
+        name = path[len('/static/'):]
+        stem, ext = os.path.splitext(name)
+        stem, _, fingerprint = stem.partition('.')
+        entry = STATIC_FILES.get(stem + ext)
+        if entry is None or fingerprint not in ('', entry[2]):
+            self.send_error(404)
+            return
+        body, content_type, current, variants = entry
+        # Weak, because the gzip and identity bodies share it.
+        etag = f'W/"{current}"'
+        if fingerprint:
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'
+        opaque = lambda tag: tag[2:] if tag.startswith('W/') else tag
+        if_none_match = self.headers.get('If-None-Match', '')
+        if etag[2:] in (opaque(tag.strip()) for tag in if_none_match.split(',')):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+        self.send_body(body, content_type, headers={'ETag': etag, 'Cache-Control': cache_control},
+                       variants=variants)
+    
+    def stream_export(self, fmt, query_params):
+        """Stream an export straight from the cursor in constant memory.
+
+        ``?group=``, ``?tags=`` or ``?q=`` restrict the export; ``?gzip=1``
+        downloads a gzip-compressed file instead.
+        """
+        group = query_params.get('group', [None])[0]
+        tags = query_params.get('tags', [None])[0]
+        search = query_params.get('q', [None])[0]
+        compress = query_params.get('gzip', [''])[0] == '1'
+        if search is not None:
+            links = self.link_manager.iter_search_links(search)
+        else:
+            if tags:
+                try:
+                    parse_tag_filter(tags)
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+            links = self.link_manager.iter_links(group or None, tags=tags)
+        content_type, filename = EXPORT_FORMATS[fmt]
+        if compress:
+            content_type, filename = 'application/gzip', filename + '.gz'
+        out = self.start_stream(content_type, headers={
+            'Content-Disposition': f'attachment; filename={filename}'})
+        if compress:
+            out = GzipWriter(out)
+        for piece in iter_export(fmt, links):
+            out.write(piece)
+        out.close()
+    
+    def redirect(self, location):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def discard_body(self):
+        """Consume an unused request body so the connection can be reused."""
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+    
     def do_GET(self):
         parsed_path = urllib.parse.urlparse(self.path)
         path = parsed_path.path
-        query_params = urllib.parse.parse_qs(parsed_path.query)
+        if self.is_cacheable(path):
+            self.conditional_get(path, parsed_path.query)
+        else:
+            self.route_get(path, urllib.parse.parse_qs(parsed_path.query))
+    
+    def route_get(self, path, query_params):
+        if path.startswith('/static/'):
+            self.serve_static(path)
         
-        if path == '/':
-            group = query_params.get('group', [None])[0]
-            if group:
-                links = self.link_manager.get_links_by_group(group)
-            else:
-                links = self.link_manager.get_all_links()
-            groups = self.link_manager.get_groups()
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(self.render_index(links, groups).encode('utf-8'))
+        elif path == '/metrics':
+            self.send_metrics()
+        
+        elif path == '/':
+            try:
+                listing = self.parse_listing(query_params)
+                groups = self.link_manager.get_groups()
+                if query_params.get('all', [''])[0] == '1':
+                    self.stream_index(groups, listing)
+                    return
+                page = self.link_manager.get_links_page(
+                    listing['group'], listing['sort'], listing['descending'],
+                    after=listing['after'], before=listing['before'], limit=listing['limit'],
+                    tags=listing['tags'], health=listing['health'])
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            self.send_html(self.render_index(page['links'], groups, listing=listing,
+                                             pager=self.render_pager(page, listing=listing)))
+        
+        elif path.startswith('/go/'):
+            try:
+                link_id = int(path[4:])
+            except ValueError:
+                self.send_error(404)
+                return
+            url = self.link_manager.redirect_target(link_id)
+            if url is None:
+                self.send_error(404)
+                return
+            self.link_manager.record_click(link_id)
+            self.redirect(url)
         
         elif path == '/add':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(self.render_add_form().encode('utf-8'))
+            self.send_html(self.render_add_form())
         
         elif path.startswith('/edit/'):
             link_id = int(path.split('/')[-1])
             link = self.link_manager.get_link(link_id)
             if link:
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html; charset=utf-8')
-                self.end_headers()
-                self.wfile.write(self.render_edit_form(link).encode('utf-8'))
+                self.send_html(self.render_edit_form(link))
             else:
                 self.send_error(404)
         
         elif path == '/search':
             query = query_params.get('q', [''])[0]
-            links = self.link_manager.search_links(query)
             groups = self.link_manager.get_groups()
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(self.render_index(links, groups, search=query).encode('utf-8'))
+            if query_params.get('all', [''])[0] == '1':
+                self.stream_search(groups, query)
+                return
+            try:
+                page = self.link_manager.search_links_page(
+                    query, after=query_params.get('after', [None])[0], limit=self.page_size)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            self.send_html(self.render_index(page['links'], groups, search=query,
+                                             pager=self.render_pager(page, search=query)))
         
         elif path == '/stats':
-            stats = self.link_manager.get_stats()
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(self.render_stats(stats).encode('utf-8'))
+            try:
+                top = max(1, min(int(query_params.get('top', ['10'])[0]), 100))
+            except ValueError:
+                self.send_error(400)
+                return
+            stats = self.link_manager.get_stats(top=top)
+            self.send_html(self.render_stats(stats))
+        
+        elif path == '/tags':
+            self.send_html(self.render_tag_cloud(self.link_manager.get_tag_counts()))
         
         elif path.startswith('/export/'):
             fmt = path.split('/')[-1]
-            links = self.link_manager.get_all_links()
-            if fmt == 'csv':
-                self.send_response(200)
-                self.send_header('Content-type', 'text/csv')
-                self.send_header('Content-Disposition', 'attachment; filename=links.csv')
-                self.end_headers()
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(['Description', 'Tags', 'URL', 'File Group'])
-                for link in links:
-                    writer.writerow([link['description'], link['tags'], link['url'], link['file_group']])
-                self.wfile.write(output.getvalue().encode('utf-8'))
-            elif fmt == 'json':
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Content-Disposition', 'attachment; filename=links.json')
-                self.end_headers()
-                data = [{'description': l['description'], 'tags': l['tags'], 'url': l['url'], 'file_group': l['file_group']} for l in links]
-                self.wfile.write(json.dumps(data, indent=2).encode('utf-8'))
-            else:
+            if fmt not in EXPORT_FORMATS:
                 self.send_error(400)
+                return
+            self.stream_export(fmt, query_params)
         
         elif path == '/import':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(self.render_import_form().encode('utf-8'))
+            self.send_html(self.render_import_form())
+        
+        elif path == '/api/links' or path.startswith('/api/links/'):
+            self.api_get(path, query_params)
+        
+        elif path == '/api/tags':
+            self.send_json([{'tag': tag, 'count': count} for tag, count in self.link_manager.get_tag_counts()])
+        
+        elif path == '/api/changes':
+            self.send_changes(query_params)
+        
+        elif path == '/suggest':
+            self.send_suggestions(query_params)
+        
+        elif path == '/admin/snapshots' and self.snapshotter is not None:
+            self.send_json(self.snapshotter.status(), headers={'Cache-Control': 'no-store'})
         
         else:
             self.send_error(404)
@@ -257,16 +5075,16 @@ class LinkHandler(BaseHTTPRequestHandler):
             file_group = form_data.get('file_group', '')
             
             if not url.startswith('http://') and not url.startswith('https://'):
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html; charset=utf-8')
-                self.end_headers()
-                self.wfile.write(self.render_add_form(error='URL must start with http:// or https://').encode('utf-8'))
+                self.send_html(self.render_add_form(error='URL must start with http:// or https://'))
                 return
             
-            self.link_manager.add_link(description, tags, url, file_group)
-            self.send_response(302)
-            self.send_header('Location', '/')
-            self.end_headers()
+            try:
+                self.link_manager.add_link(description, tags, url, file_group, on_duplicate=self.on_duplicate)
+            except DuplicateLinkError as e:
+                self.send_html(self.render_add_form(error=str(e), link={
+                    'description': description, 'tags': tags, 'url': url, 'file_group': file_group}), status=409)
+                return
+            self.redirect('/')
         
         elif path.startswith('/edit/'):
             link_id = int(path.split('/')[-1])
@@ -276,302 +5094,1045 @@ class LinkHandler(BaseHTTPRequestHandler):
             url = form_data.get('url', '')
             file_group = form_data.get('file_group', '')
             
-            self.link_manager.update_link(link_id, description, tags, url, file_group)
-            self.send_response(302)
-            self.send_header('Location', '/')
-            self.end_headers()
+            try:
+                self.link_manager.update_link(link_id, description, tags, url, file_group)
+            except DuplicateLinkError as e:
+                self.send_html(self.render_edit_form({
+                    'description': description, 'tags': tags, 'url': url, 'file_group': file_group},
+                    error=str(e)), status=409)
+                return
+            self.redirect('/')
         
         elif path.startswith('/delete/'):
             link_id = int(path.split('/')[-1])
+            self.discard_body()
             self.link_manager.delete_link(link_id)
-            self.send_response(302)
-            self.send_header('Location', '/')
-            self.end_headers()
+            self.redirect('/')
         
         elif path == '/import':
-            # For now, we'll skip file import functionality to keep it simple
-            # You can implement it later if needed
-            self.send_response(302)
-            self.send_header('Location', '/')
-            self.end_headers()
+            try:
+                result = self.handle_import()
+            except ValueError as e:
+                # The body may be half read; do not reuse the connection.
+                self.close_connection = True
+                self.send_html(self.render_import_form(error=str(e)), status=400)
+                return
+            self.send_html(self.render_import_result(result))
+        
+        elif path in ('/api/links', '/api/links:batch'):
+            self.api_write('POST', path)
+        
+        else:
+            self.discard_body()
+            self.send_error(404)
     
-    def render_index(self, links, groups, search=''):
-        html_content = '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Web Links Manager</title>
-            <style>
-                body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
-                .container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-                h1 { color: #333; text-align: center; }
-                .nav { margin-bottom: 20px; text-align: center; }
-                .nav a { margin: 0 10px; padding: 10px 20px; background: #007bff; color: white; text-decoration: none; border-radius: 5px; }
-                .nav a:hover { background: #0056b3; }
-                .search-box { margin: 20px 0; text-align: center; }
-                .search-box input { padding: 10px; width: 300px; border: 1px solid #ddd; border-radius: 5px; }
-                .search-box button { padding: 10px 20px; background: #28a745; color: white; border: none; border-radius: 5px; cursor: pointer; }
-                .group-filter { margin: 20px 0; text-align: center; }
-                .group-filter select { padding: 10px; border: 1px solid #ddd; border-radius: 5px; }
-                table { width: 100%; border-collapse: collapse; margin-top: 20px; }
-                th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
-                th { background-color: #f8f9fa; font-weight: bold; }
-                .action-buttons a { margin-right: 10px; padding: 5px 10px; text-decoration: none; border-radius: 3px; }
-                .edit-btn { background: #ffc107; color: #212529; }
-                .delete-btn { background: #dc3545; color: white; }
-                .url-cell { max-width: 300px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Web Links Manager</h1>
-                <div class="nav">
-                    <a href="/">Home</a>
-                    <a href="/add">Add Link</a>
-                    <a href="/import">Import</a>
-                    <a href="/stats">Stats</a>
-                </div>
-                
-                <div class="search-box">
-                    <form action="/search" method="GET">
-                        <input type="text" name="q" placeholder="Search links..." value="''' + html.escape(search) + '''">
-                        <button type="submit">Search</button>
-                    </form>
-                </div>
-                
-                <div class="group-filter">
-                    <select onchange="window.location.href=this.value">
-                        <option value="/">All Groups</option>
-        '''
+    def do_PATCH(self):
+        self.api_write('PATCH', urllib.parse.urlparse(self.path).path)
+    
+    def do_DELETE(self):
+        self.api_write('DELETE', urllib.parse.urlparse(self.path).path)
+    
+    def send_suggestions(self, query_params):
+        """Typeahead completions of ``?q=``; ``?kind=tag,group`` and ``?limit=`` narrow them."""
+        kinds = [kind for kind in query_params.get('kind', [''])[0].split(',') if kind]
+        try:
+            limit = int(query_params.get('limit', ['10'])[0])
+        except ValueError:
+            self.send_error(400, 'limit must be an integer')
+            return
+        if not 1 <= limit <= SuggestIndex.MAX_K:
+            self.send_error(400, f'limit must be between 1 and {SuggestIndex.MAX_K}')
+            return
+        if any(kind not in SuggestIndex.KINDS for kind in kinds):
+            self.send_error(400, f'kind must be among {", ".join(SuggestIndex.KINDS)}')
+            return
+        suggestions = self.link_manager.suggest(query_params.get('q', [''])[0], limit, kinds)
+        # Answers change with every write and are cheaper to compute than to cache.
+        self.send_json(suggestions, headers={'Cache-Control': 'no-store'})
+    
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_body(body, 'application/json', status, headers)
+    
+    def read_json_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError as e:
+            raise ValueError(f'request body is not valid JSON: {e}')
+    
+    def api_link_id(self, path):
+        """The id in /api/links/<id>, or None."""
+        link_id = path[len('/api/links/'):]
+        return int(link_id) if path.startswith('/api/links/') and link_id.isdigit() else None
+    
+    def api_fields(self, query_params):
+        """Fields named by ?fields=a,b for projecting API responses."""
+        fields = query_params.get('fields', [''])[0]
+        if not fields:
+            return LinkManager.LINK_FIELDS
+        fields = tuple(field.strip() for field in fields.split(','))
+        unknown = set(fields) - set(LinkManager.LINK_FIELDS)
+        if unknown:
+            raise ValueError(f'unknown field {sorted(unknown)[0]!r}')
+        return fields
+    
+    def api_get(self, path, query_params):
+        """GET /api/links (a page, like / and /search) or /api/links/<id>."""
+        try:
+            fields = self.api_fields(query_params)
+            if path == '/api/links':
+                query = query_params.get('q', [None])[0]
+                listing = self.parse_listing(query_params)
+                if query is not None:
+                    page = self.link_manager.search_links_page(query, after=listing['after'], limit=listing['limit'])
+                else:
+                    page = self.link_manager.get_links_page(
+                        listing['group'], listing['sort'], listing['descending'],
+                        after=listing['after'], before=listing['before'], limit=listing['limit'],
+                        tags=listing['tags'], health=listing['health'])
+            else:
+                link_id = self.api_link_id(path)
+                link = self.link_manager.get_link(link_id) if link_id is not None else None
+        except ValueError as e:
+            self.send_json({'error': str(e)}, 400)
+            return
+        if path == '/api/links':
+            self.send_json({
+                'links': [{field: link[field] for field in fields} for link in page['links']],
+                'next': page['next'],
+                'prev': page['prev'],
+            })
+        elif link is None:
+            self.send_json({'error': 'link not found'}, 404)
+        else:
+            self.send_json({field: link[field] for field in fields})
+    
+    def send_changes(self, query_params):
+        """GET /api/changes?since=<cursor>: what changed after a cursor, for incremental sync.
+
+        Answers {"changes": [...], "cursor": ..., "more": ...}, each change
+        being {"seq", "id", "op": "upsert", "link"} or {"seq", "id", "op":
+        "delete"}. Pass the cursor back as ``since`` until ``more`` is false;
+        without ``since`` every link is listed. With ``wait=<seconds>`` an
+        empty answer with nothing ``more`` is held until something changes,
+        but only by up to half the handler threads at once. An expired
+        cursor gets 410.
+        """
+        def param(name, default):
+            return query_params.get(name, [default])[0]
+        try:
+            since = param('since', None) or None
+            limit = int(param('limit', '500'))
+            wait = min(float(param('wait', '0')), self.max_change_wait)
+            if not 1 <= limit <= self.max_changes_page:
+                raise ValueError(f'limit must be between 1 and {self.max_changes_page}')
+            fields = self.api_fields(query_params)
+            page = self.link_manager.get_changes(since, limit)
+            # A page of skipped tombstones is empty too; its cursor moves on, so answer at once.
+            if not page['changes'] and not page['more'] and wait > 0:
+                max_waiters = getattr(self.server, 'threads', 1) // 2
+                if self.link_manager.wait_for_changes(page['seq'], wait, max_waiters):
+                    page = self.link_manager.get_changes(since, limit)
+        except ExpiredCursorError as e:
+            self.send_json({'error': str(e)}, 410)
+            return
+        except ValueError as e:
+            self.send_json({'error': str(e)}, 400)
+            return
+        changes = []
+        for seq, link_id, link in page['changes']:
+            if link is None:
+                changes.append({'seq': seq, 'id': link_id, 'op': 'delete'})
+            else:
+                changes.append({'seq': seq, 'id': link_id, 'op': 'upsert',
+                                'link': {field: link[field] for field in fields}})
+        self.send_json({'changes': changes, 'cursor': page['cursor'], 'more': page['more']},
+                       headers={'Cache-Control': 'no-store'})
+    
+    def api_write(self, method, path):
+        """Create, update and delete links through the JSON API.
+
+        ``POST /api/links`` creates one link, ``PATCH`` and ``DELETE`` on
+        ``/api/links/<id>`` change one, and ``POST /api/links:batch`` takes
+        ``{"operations": [...]}`` and applies all of them or none.
+        """
+        link_id = self.api_link_id(path)
+        query_params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        on_duplicate = query_params.get('on_duplicate', [self.on_duplicate])[0]
+        route = (method, path if link_id is None else '/api/links/<id>')
+        if route not in (('POST', '/api/links'), ('POST', '/api/links:batch'),
+                         ('PATCH', '/api/links/<id>'), ('DELETE', '/api/links/<id>')):
+            self.discard_body()
+            self.send_json({'error': 'not found'}, 404)
+            return
+        if int(self.headers.get('Content-Length', 0)) > self.max_json_body:
+            self.close_connection = True
+            self.send_json({'error': f'request body is larger than {self.max_json_body} bytes'}, 413)
+            return
+        try:
+            if method == 'DELETE':
+                self.discard_body()
+            else:
+                body = self.read_json_body()
+            if path == '/api/links:batch':
+                operations = body.get('operations') if isinstance(body, dict) else body
+                if not isinstance(operations, list):
+                    raise ValueError('expected {"operations": [...]}')
+            elif method == 'POST':
+                operations = [{'op': 'create', 'link': body}]
+            elif method == 'PATCH':
+                operations = [{'op': 'update', 'id': link_id, 'link': body}]
+            else:
+                operations = [{'op': 'delete', 'id': link_id}]
+            applied, results = self.link_manager.apply_batch(operations, on_duplicate)
+        except ValueError as e:
+            self.send_json({'error': str(e)}, 400)
+            return
         
+        if path == '/api/links:batch':
+            self.send_json({'applied': applied, 'results': results}, 200 if applied else 422)
+            return
+        result = results[0]
+        if result['status'] == 'not_found':
+            self.send_json({'error': 'link not found'}, 404)
+        elif result['status'] == 'invalid':
+            self.send_json({'error': result['error']}, 400)
+        elif result['status'] == 'duplicate':
+            self.send_json({'error': str(DuplicateLinkError(result['existing_id'])),
+                            'existing_id': result['existing_id']}, 409,
+                           {'Location': f'/api/links/{result["existing_id"]}'})
+        elif result['status'] == 'not_applied':
+            self.send_json({'error': result['error']}, 409)
+        elif method == 'DELETE':
+            self.send_response(204)
+            self.end_headers()
+        else:
+            link = self.link_manager.get_link(result['id'])
+            if method == 'POST' and result['status'] == 'created':
+                self.send_json(link, 201, {'Location': f'/api/links/{link["id"]}'})
+            else:
+                self.send_json(link)
+    
+    def render_page(self, title, content, narrow=True):
+        return LAYOUT.render(title=title, stylesheet=static_url('app.css'),
+                             container_class=' narrow' if narrow else '', content=content)
+    
+    def render_index(self, links, groups, search='', listing=None, pager=''):
+        return (self.render_index_head(groups, search, listing) + self.render_link_rows(links)
+                + self.render_index_foot(pager))
+    
+    def render_index_head(self, groups, search='', listing=None):
+        current_group = listing['group'] if listing else None
+        options = []
         for group in groups:
-            html_content += f'<option value="/?group={urllib.parse.quote(group)}">{html.escape(group)}</option>'
+            GROUP_OPTION.render_into(options, {
+                'group': group, 'selected': ' selected' if group == current_group else ''})
         
-        html_content += '''
-                    </select>
-                </div>
-                
-                <table>
-                    <thead>
-                        <tr>
-                            <th>Description</th>
-                            <th>Tags</th>
-                            <th>URL</th>
-                            <th>Group</th>
-                            <th>Actions</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-        '''
+        health_select = ''
+        if listing:
+            health_options = []
+            for state in (None,) + LinkManager.HEALTH_STATES:
+                HEALTH_OPTION.render_into(health_options, {
+                    'url': self.listing_url(dict(listing, health=state)), 'label': state or 'Any health',
+                    'selected': ' selected' if state == listing['health'] else ''})
+            health_select = ('\n            <select onchange="window.location.href=this.value">'
+                             + ''.join(health_options) + '</select>')
         
-        for link in links:
-            html_content += f'''
-                        <tr>
-                            <td>{html.escape(link['description'])}</td>
-                            <td>{html.escape(link['tags'] or '')}</td>
-                            <td class="url-cell"><a href="{html.escape(link['url'])}" target="_blank">{html.escape(link['url'])}</a></td>
-                            <td>{html.escape(link['file_group'])}</td>
-                            <td>
-                                <a href="/edit/{link['id']}" class="action-buttons edit-btn">Edit</a>
-                                <form method="POST" action="/delete/{link['id']}" style="display: inline;">
-                                    <button type="submit" class="action-buttons delete-btn" onclick="return confirm('Are you sure?')">Delete</button>
-                                </form>
-                            </td>
-                        </tr>
-            '''
+        headers = []
+        for label, sort in (('Description', 'description'), ('Tags', None), ('URL', 'url'), ('Health', None),
+                            ('Clicks', 'clicks'), ('Group', 'group')):
+            if listing and sort:
+                headers.append(f'<th><a href="{self.listing_url(listing, sort=sort)}">{label}{self.sort_arrow(listing, sort)}</a></th>')
+            else:
+                headers.append(f'<th>{label}</th>')
         
-        html_content += '''
-                    </tbody>
-                </table>
-            </div>
-        </body>
-        </html>
-        '''
-        return html_content
+        out = []
+        LAYOUT_HEAD.render_into(out, {'title': 'Web Links Manager',
+                                      'stylesheet': static_url('app.css'), 'container_class': ''})
+        group_input = ''
+        if current_group:
+            group_input = f'<input type="hidden" name="group" value="{html.escape(current_group)}">'
+        INDEX_HEAD.render_into(out, {'search': search, 'group_options': ''.join(options),
+                                     'tags': listing['tags'] or '' if listing else '',
+                                     'group_input': group_input, 'column_headers': ''.join(headers),
+                                     'health_select': health_select,
+                                     'suggest_script': static_url('suggest.js')})
+        return ''.join(out)
+    
+    def render_link_rows(self, links):
+        """Render table rows for ``links``, looking up their health and clicks in one query each."""
+        if not links:
+            return ''
+        ids = [link['id'] for link in links]
+        health, clicks = self.link_manager.get_health(ids), self.link_manager.get_clicks(ids)
+        return ''.join(self.render_link_row(link, health.get(link['id']), clicks.get(link['id'])) for link in links)
+    
+    def render_link_row(self, link, health=None, clicks=None):
+        context = {'health': self.render_health(health), 'clicks': self.render_clicks(clicks)}
+        highlight = link.get('highlight')
+        if highlight:
+            return SEARCH_ROW.render(dict(link, description=highlight_html(highlight['description']),
+                                          tags=highlight_html(highlight['tags']), **context))
+        return LINK_ROW.render_context(dict(link, tags=link['tags'] or '', **context))
+    
+    def render_clicks(self, clicks):
+        """The click count of a get_clicks() entry, with the last click in its tooltip."""
+        if clicks is None:
+            return ''
+        count, last = clicks
+        return CLICK_COUNT.render(clicks=count, when=time.strftime('%Y-%m-%d %H:%M', time.localtime(last)))
+    
+    def render_health(self, health):
+        """A badge for a get_health() entry, with the details in its tooltip; empty if never checked."""
+        if health is None or health[0] == 'unchecked':
+            return ''
+        state, status, final_url, latency_ms, error, checked = health
+        if error:
+            detail = error
+        elif state == 'redirected':
+            detail = f'{status} at {final_url}'
+        else:
+            detail = f'{status} in {latency_ms:g} ms'
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(checked))
+        return HEALTH_BADGE.render(state=state, title=f'{detail}, checked {when}')
+    
+    def render_index_foot(self, pager=''):
+        return INDEX_FOOT.render(pager=pager) + LAYOUT_FOOT.render()
+    
+    def sort_arrow(self, listing, sort):
+        if listing['sort'] != sort:
+            return ''
+        return ' &#9660;' if listing['descending'] else ' &#9650;'
+    
+    def listing_url(self, listing, sort=None, **cursor):
+        """URL of the listing with a different sort column or page cursor."""
+        params = {}
+        if listing['group']:
+            params['group'] = listing['group']
+        if listing['tags']:
+            params['tags'] = listing['tags']
+        if listing['health']:
+            params['health'] = listing['health']
+        if sort is not None:
+            # Click columns list the most (recently) clicked first.
+            descending = not listing['descending'] if sort == listing['sort'] else sort in ('clicks', 'clicked')
+        else:
+            sort, descending = listing['sort'], listing['descending']
+        if sort != 'id':
+            params['sort'] = sort
+        if descending:
+            params['order'] = 'desc'
+        if listing['limit'] != self.page_size:
+            params['per_page'] = listing['limit']
+        params.update(cursor)
+        return html.escape('/?' + urllib.parse.urlencode(params))
+    
+    def render_pager(self, page, listing=None, search=None):
+        links = []
+        if listing is not None:
+            if page['prev'] or page['next']:
+                links.append(f'<a href="{self.listing_url(listing)}">&laquo; First</a>')
+            if page['prev']:
+                links.append(f'<a href="{self.listing_url(listing, before=page["prev"])}">&lsaquo; Previous</a>')
+            if page['next']:
+                links.append(f'<a href="{self.listing_url(listing, after=page["next"])}">Next &rsaquo;</a>')
+            links.append(f'<a href="{self.listing_url(listing, all=1)}">Show all</a>')
+        elif page['next']:
+            params = urllib.parse.urlencode({'q': search, 'after': page['next']})
+            links.append(f'<a href="/search?{html.escape(params)}">More results &rsaquo;</a>')
+            params = urllib.parse.urlencode({'q': search, 'all': 1})
+            links.append(f'<a href="/search?{html.escape(params)}">Show all</a>')
+        return '<div class="pager">' + ''.join(links) + '</div>'
     
-    def render_add_form(self, error=''):
+    def render_add_form(self, error='', link=None):
         error_html = f'<div class="error">{html.escape(error)}</div>' if error else ''
-        return f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Add Link - Web Links Manager</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }}
-                .container {{ max-width: 600px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-                h1 {{ color: #333; text-align: center; }}
-                .form-group {{ margin-bottom: 15px; }}
-                label {{ display: block; margin-bottom: 5px; font-weight: bold; }}
-                input, textarea {{ width: 100%; padding: 10px; border: 1px solid #ddd; border-radius: 5px; box-sizing: border-box; }}
-                button {{ background: #007bff; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer; }}
-                button:hover {{ background: #0056b3; }}
-                .error {{ color: red; margin-bottom: 10px; }}
-                .back-link {{ margin-top: 20px; text-align: center; }}
-                .back-link a {{ color: #007bff; text-decoration: none; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Add New Link</h1>
-                {error_html}
-                <form method="POST">
-                    <div class="form-group">
-                        <label for="description">Description:</label>
-                        <input type="text" id="description" name="description" required>
-                    </div>
-                    <div class="form-group">
-                        <label for="tags">Tags:</label>
-                        <input type="text" id="tags" name="tags">
-                    </div>
-                    <div class="form-group">
-                        <label for="url">URL:</label>
-                        <input type="url" id="url" name="url" required>
-                    </div>
-                    <div class="form-group">
-                        <label for="file_group">Group:</label>
-                        <input type="text" id="file_group" name="file_group" required>
-                    </div>
-                    <button type="submit">Add Link</button>
-                </form>
-                <div class="back-link">
-                    <a href="/">← Back to Home</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-    
-    def render_edit_form(self, link):
-        return f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Edit Link - Web Links Manager</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }}
-                .container {{ max-width: 600px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-                h1 {{ color: #333; text-align: center; }}
-                .form-group {{ margin-bottom: 15px; }}
-                label {{ display: block; margin-bottom: 5px; font-weight: bold; }}
-                input, textarea {{ width: 100%; padding: 10px; border: 1px solid #ddd; border-radius: 5px; box-sizing: border-box; }}
-                button {{ background: #007bff; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer; }}
-                button:hover {{ background: #0056b3; }}
-                .back-link {{ margin-top: 20px; text-align: center; }}
-                .back-link a {{ color: #007bff; text-decoration: none; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Edit Link</h1>
-                <form method="POST">
-                    <div class="form-group">
-                        <label for="description">Description:</label>
-                        <input type="text" id="description" name="description" value="{html.escape(link['description'])}" required>
-                    </div>
-                    <div class="form-group">
-                        <label for="tags">Tags:</label>
-                        <input type="text" id="tags" name="tags" value="{html.escape(link['tags'] or '')}">
-                    </div>
-                    <div class="form-group">
-                        <label for="url">URL:</label>
-                        <input type="url" id="url" name="url" value="{html.escape(link['url'])}" required>
-                    </div>
-                    <div class="form-group">
-                        <label for="file_group">Group:</label>
-                        <input type="text" id="file_group" name="file_group" value="{html.escape(link['file_group'])}" required>
-                    </div>
-                    <button type="submit">Update Link</button>
-                </form>
-                <div class="back-link">
-                    <a href="/">← Back to Home</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-    
-    def render_import_form(self):
-        return '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Import Links - Web Links Manager</title>
-            <style>
-                body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
-                .container { max-width: 600px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-                h1 { color: #333; text-align: center; }
-                .form-group { margin-bottom: 15px; }
-                label { display: block; margin-bottom: 5px; font-weight: bold; }
-                input, select { width: 100%; padding: 10px; border: 1px solid #ddd; border-radius: 5px; box-sizing: border-box; }
-                button { background: #007bff; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer; }
-                button:hover { background: #0056b3; }
-                .back-link { margin-top: 20px; text-align: center; }
-                .back-link a { color: #007bff; text-decoration: none; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Import Links</h1>
-                <p style="text-align: center; color: #666;">File import functionality is currently disabled.</p>
-                <div class="back-link">
-                    <a href="/">← Back to Home</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
+        link = link or {'description': '', 'tags': '', 'url': '', 'file_group': ''}
+        return self.render_page('Add Link - Web Links Manager', LINK_FORM.render(
+            heading='Add New Link', error_html=error_html, submit='Add Link',
+            description=link['description'], tags=link['tags'], url=link['url'], file_group=link['file_group']))
+    
+    def render_edit_form(self, link, error=''):
+        error_html = f'<div class="error">{html.escape(error)}</div>' if error else ''
+        return self.render_page('Edit Link - Web Links Manager', LINK_FORM.render(
+            heading='Edit Link', error_html=error_html, submit='Update Link',
+            description=link['description'], tags=link['tags'] or '',
+            url=link['url'], file_group=link['file_group']))
+    
+    def render_import_form(self, error=''):
+        error_html = f'<div class="error">{html.escape(error)}</div>' if error else ''
+        options = ''.join(
+            f'\n                    <option value="{policy}"{" selected" if policy == self.on_duplicate else ""}>{label}</option>'
+            for policy, label in (('reject', 'Skip them'), ('merge', 'Add their tags to the stored link'),
+                                  ('update', 'Overwrite the stored link')))
+        return self.render_page('Import Links - Web Links Manager', IMPORT_FORM.render(
+            error_html=error_html, duplicate_options=options))
+    
+    def render_import_result(self, result):
+        errors_html = ''.join(f'<li>{html.escape(error)}</li>' for error in result['errors'])
+        if errors_html:
+            errors_html = f'<ul class="error">{errors_html}</ul>'
+        return self.render_page('Import Links - Web Links Manager', IMPORT_RESULT.render(
+            imported=result['imported'], skipped=result['skipped'], merged=result['merged'],
+            updated=result['updated'], invalid=result['invalid'], errors_html=errors_html))
     
     def render_stats(self, stats):
         most_group_text = f"{stats['most_group'][0]} ({stats['most_group'][1]} links)" if stats['most_group'] else "None"
-        return f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Statistics - Web Links Manager</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }}
-                .container {{ max-width: 600px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-                h1 {{ color: #333; text-align: center; }}
-                .stat-item {{ margin: 20px 0; padding: 15px; background: #f8f9fa; border-radius: 5px; }}
-                .stat-label {{ font-weight: bold; color: #495057; }}
-                .stat-value {{ font-size: 1.2em; color: #007bff; margin-top: 5px; }}
-                .back-link {{ margin-top: 20px; text-align: center; }}
-                .back-link a {{ color: #007bff; text-decoration: none; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Statistics</h1>
-                <div class="stat-item">
-                    <div class="stat-label">Total Links:</div>
-                    <div class="stat-value">{stats['total_links']}</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">Total Groups:</div>
-                    <div class="stat-value">{stats['total_groups']}</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">Most Popular Group:</div>
-                    <div class="stat-value">{html.escape(most_group_text)}</div>
-                </div>
-                <div class="back-link">
-                    <a href="/">← Back to Home</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-
-def run_server(port=8000):
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, LinkHandler)
-    print(f"Server running on http://localhost:{port}")
+        total = stats['total_links'] or 1
+        items = []
+        for label, value in (('Total Links', stats['total_links']), ('Total Groups', stats['total_groups']),
+                             ('Most Popular Group', most_group_text), ('Distinct Tags', stats['total_tags']),
+                             ('Total Clicks', stats['total_clicks'])):
+            STAT_ITEM.render_into(items, {'label': label, 'value': str(value)})
+        group_rows = []
+        for name, count in stats['groups']:
+            GROUP_STAT_ROW.render_into(group_rows, {'name': name, 'count': count,
+                                                    'share': f'{count * 100 / total:.1f}%'})
+        tag_rows = []
+        for tag, count in stats['top_tags']:
+            TAG_STAT_ROW.render_into(tag_rows, {'tag': tag, 'count': count})
+        click_rows = {}
+        for name in ('most_clicked', 'recently_clicked'):
+            rows = click_rows[name + '_rows'] = []
+            for link_id, description, url, clicks, last in stats[name]:
+                CLICK_STAT_ROW.render_into(rows, {
+                    'id': link_id, 'description': description, 'url': url, 'clicks': clicks,
+                    'when': time.strftime('%Y-%m-%d %H:%M', time.localtime(last))})
+        return self.render_page('Statistics - Web Links Manager', STATS_PAGE.render(
+            items=''.join(items), group_rows=''.join(group_rows),
+            tag_rows=''.join(tag_rows), tag_count=len(stats['top_tags']),
+            **{name: ''.join(rows) for name, rows in click_rows.items()}))
+
+    def render_tag_cloud(self, counts):
+        """Tags in name order, sized by the log of how many links use them."""
+        items = []
+        if counts:
+            low = math.log(min(count for _, count in counts))
+            spread = math.log(max(count for _, count in counts)) - low or 1.0
+            for tag, count in sorted(counts):
+                size = 0.8 + 1.6 * (math.log(count) - low) / spread
+                TAG_CLOUD_ITEM.render_into(items, {'tag': tag, 'count': count, 'size': f'{size:.2f}'})
+        return self.render_page('Tags - Web Links Manager', TAG_CLOUD_PAGE.render(
+            tag_count=len(counts), items=''.join(items)), narrow=False)
+
+class _TransportWriter:
+    """File-like ``wfile`` that forwards a handler thread's output to an asyncio stream."""
+    def __init__(self, loop, writer, timeout=60.0):
+        self.loop = loop
+        self.writer = writer
+        self.timeout = timeout
+    
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+    
+    def write(self, data):
+        # Waiting for drain() gives slow clients backpressure on the handler.
+        future = asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self.loop)
+        try:
+            future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise ConnectionAbortedError('client stopped reading')
+        return len(data)
+    
+    def flush(self):
+        pass
+
+class _TransportReader(io.RawIOBase):
+    """Raw ``rfile`` for a handler thread: the request head, then ``length`` body bytes from an asyncio stream.
+
+    The body is read as the handler asks for it, so an upload is never held
+    in memory as a whole.
+    """
+    def __init__(self, loop, reader, head, length, timeout=60.0):
+        super().__init__()
+        self.loop = loop
+        self.reader = reader
+        self.head = head
+        self.remaining = length
+        self.timeout = timeout
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        if self.head:
+            size = min(len(b), len(self.head))
+            b[:size] = self.head[:size]
+            self.head = self.head[size:]
+            return size
+        if self.remaining <= 0:
+            return 0
+        future = asyncio.run_coroutine_threadsafe(self.reader.read(min(len(b), self.remaining)), self.loop)
+        try:
+            data = future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise ConnectionAbortedError('client stopped sending')
+        if not data:
+            raise ConnectionAbortedError('client closed the connection mid-body')
+        self.remaining -= len(data)
+        b[:len(data)] = data
+        return len(data)
+
+class AsyncLinkServer:
+    """asyncio HTTP/1.1 engine serving the same routes as the threaded servers.
+
+    The event loop owns every socket, so idle keep-alive connections cost a
+    coroutine rather than a thread. Each parsed request (pipelined requests
+    are answered in order) is run through ``LinkHandler`` on a bounded thread
+    pool, which keeps the blocking SQLite work off the loop.
+    """
+    keep_alive = True
+    response_cache = None
+    max_header_size = 65536
+    # Largest body streamed to a handler, and the largest chunked body, which
+    # is collected first as the handlers need a Content-Length; above them
+    # the client gets 413.
+    max_body_size = 1024 * 1024 * 1024
+    max_chunked_body = 64 * 1024 * 1024
+    
+    def __init__(self, server_address, handler_class, link_manager,
+                 threads=8, idle_timeout=60.0):
+        self.server_address = server_address
+        self.handler_class = handler_class
+        self.link_manager = link_manager
+        self.threads = threads
+        self.idle_timeout = idle_timeout
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='link-async')
+        self._server = None
+        self._waiting = 0
+        self._waiting_lock = threading.Lock()
+    
+    @property
+    def queue_depth(self):
+        """Parsed requests waiting for a free handler thread."""
+        return self._waiting
+    
+    def _count_waiting(self, amount):
+        with self._waiting_lock:
+            self._waiting += amount
+    
+    async def start(self, sock=None):
+        if sock is not None:
+            self._server = await asyncio.start_server(
+                self.handle_connection, sock=sock, limit=self.max_header_size)
+        else:
+            host, port = self.server_address
+            self._server = await asyncio.start_server(
+                self.handle_connection, host or None, port, limit=self.max_header_size)
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+    
+    async def serve_forever(self, sock=None):
+        await self.start(sock)
+        async with self._server:
+            await self._server.serve_forever()
+    
+    async def read_request(self, reader):
+        """Read one request's head; returns (head, length of the body still to be read).
+
+        A chunked body is read here, up to ``max_chunked_body``, and
+        re-framed with a Content-Length after the head. Raises
+        RequestTooLargeError for a body over the limits.
+        """
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idle_timeout)
+        lines = head.split(b'\r\n')
+        length = 0
+        chunked = False
+        for line in lines[1:]:
+            name, _, value = line.partition(b':')
+            name = name.strip().lower()
+            if name == b'content-length':
+                length = int(value.strip() or 0)
+                if length < 0:
+                    raise ValueError('negative Content-Length')
+            elif name == b'transfer-encoding' and b'chunked' in value.lower():
+                chunked = True
+        if not chunked:
+            if length > self.max_body_size:
+                raise RequestTooLargeError(f'request body is larger than {self.max_body_size} bytes')
+            return head, length
+        parts = []
+        total = 0
+        while True:
+            size_line = await reader.readuntil(b'\r\n')
+            size = int(size_line.split(b';')[0].strip(), 16)
+            if size == 0:
+                # Skip trailers up to the blank line.
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                break
+            total += size
+            if total > self.max_chunked_body:
+                raise RequestTooLargeError(f'chunked request body is larger than {self.max_chunked_body} bytes')
+            parts.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(parts)
+        kept = [line for line in lines[1:-2]
+                if line.split(b':')[0].strip().lower() not in (b'transfer-encoding', b'content-length')]
+        kept.append(b'Content-Length: ' + str(len(body)).encode())
+        return b'\r\n'.join([lines[0]] + kept) + b'\r\n\r\n' + body, 0
+    
+    def run_handler(self, rfile, wfile, client_address):
+        """Run one request through the handler on an executor thread.
+
+        Returns True when the connection should be closed afterwards.
+        """
+        self._count_waiting(-1)
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.server = self
+        handler.request = None
+        handler.client_address = client_address
+        handler.rfile = rfile
+        handler.wfile = wfile
+        handler.close_connection = True
+        try:
+            handler.handle_one_request()
+        except (ConnectionError, concurrent.futures.CancelledError):
+            return True
+        except Exception:
+            traceback.print_exc()
+            return True
+        return handler.close_connection
+    
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info('peername') or ('', 0)
+        wfile = _TransportWriter(loop, writer)
+        try:
+            while True:
+                try:
+                    head, length = await self.read_request(reader)
+                except RequestTooLargeError:
+                    writer.write(b'HTTP/1.1 413 Request Entity Too Large\r\n'
+                                 b'Content-Length: 0\r\n'
+                                 b'Connection: close\r\n\r\n')
+                    with contextlib.suppress(ConnectionError):
+                        await writer.drain()
+                    break
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError, ValueError):
+                    break
+                body = _TransportReader(loop, reader, head, length)
+                self._count_waiting(1)
+                close = await loop.run_in_executor(
+                    self.executor, self.run_handler, io.BufferedReader(body, 65536), wfile, peer[:2])
+                # Body bytes the handler left unread would be taken for the next request.
+                if close or body.remaining:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+    
+    def server_close(self):
+        if self._server is not None:
+            self._server.close()
+        # Handlers blocked on a stopped loop must not hold up shutdown.
+        self.executor.shutdown(wait=False)
+        self.link_manager.close()
+
+def handler_for(config):
+    """LinkHandler subclass carrying the per-server settings from ``config``."""
+    return type('LinkHandler', (LinkHandler,), {
+        'page_size': config.page_size,
+        'max_page_size': max(config.page_size, LinkHandler.max_page_size),
+        'compress_level': config.compress_level,
+        'compress_min_size': config.compress_min_size,
+        'slow_request_ms': config.slow_ms,
+        'on_duplicate': config.on_duplicate,
+        'snapshotter': make_snapshotter(config),
+    })
+
+def make_response_cache(config):
+    if config.cache_mb <= 0:
+        return None
+    return ResponseCache(max_entries=config.cache_entries, max_bytes=config.cache_mb * 1024 * 1024)
+
+def make_server(config, link_manager, sock=None):
+    """Build the server for ``config.mode``, optionally around an existing socket."""
+    address = (config.host, config.port)
+    handler = handler_for(config)
+    if config.threads > 1:
+        factory = lambda **kw: ThreadPoolLinkServer(
+            address, handler, link_manager,
+            threads=config.threads, queue_size=config.queue_size, **kw)
+    else:
+        factory = lambda **kw: LinkServer(address, handler, link_manager, **kw)
+    if sock is None:
+        httpd = factory()
+    else:
+        httpd = factory(bind_and_activate=False)
+        httpd.socket.close()
+        httpd.socket = sock
+        httpd.server_address = sock.getsockname()
+    httpd.response_cache = make_response_cache(config)
+    return httpd
+
+def create_listen_socket(host, port, backlog=128):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        # Lets a restarted master bind while old workers are still draining.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+def _serve_worker(sock, link_manager, config):
+    """Body of a pre-fork worker process."""
+    httpd = make_server(config, link_manager, sock=sock)
+    
+    def stop(signum, frame):
+        # shutdown() blocks until serve_forever() returns, so it needs its own thread.
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        # Writes the clicks counted since the last flush.
+        link_manager.clicks.close()
+
+def _serve_checker(link_manager, config):
+    """Body of the pre-fork process that runs the link checker."""
+    checker = make_checker(config, link_manager)
+    signal.signal(signal.SIGTERM, lambda signum, frame: checker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: checker.stop())
+    checker.serve(config.check_interval)
+
+def _serve_snapshotter(config):
+    """Body of the pre-fork process that takes scheduled snapshots."""
+    snapshotter = make_snapshotter(config)
+    signal.signal(signal.SIGTERM, lambda signum, frame: snapshotter.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: snapshotter.stop())
+    snapshotter.serve()
+
+def run_prefork(config, link_manager, shutdown_timeout=10.0):
+    """Run ``config.workers`` processes accepting on one shared socket.
+
+    Workers that die are restarted. SIGTERM or Ctrl+C stops the workers
+    gracefully, letting in-flight requests finish. With --check-interval,
+    one more process runs the link checker, and with scheduled snapshots
+    another takes them.
+    """
+    sock = create_listen_socket(config.host, config.port)
+    # The schema is created by the master; workers open their own connections.
+    link_manager.close()
+    children = {}
+    stopping = False
+    
+    def spawn(role='worker'):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                if role == 'checker':
+                    sock.close()
+                    _serve_checker(link_manager, config)
+                elif role == 'snapshotter':
+                    sock.close()
+                    _serve_snapshotter(config)
+                else:
+                    _serve_worker(sock, link_manager, config)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                # Never fall back into the master's code in a child.
+                os._exit(status)
+        children[pid] = (time.monotonic(), role)
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(config.workers):
+        spawn()
+    if config.check_interval > 0:
+        spawn('checker')
+    if config.snapshot_dir and config.snapshot_interval_hours > 0:
+        spawn('snapshotter')
+    
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if not pid:
+            time.sleep(0.2)
+            continue
+        child = children.pop(pid, None)
+        if child is None or stopping:
+            continue
+        started, role = child
+        print(f"{role.capitalize()} {pid} exited with status {status}, restarting")
+        if time.monotonic() - started < 1.0:
+            # Avoid a fork loop when workers crash on startup.
+            time.sleep(1.0)
+        spawn(role)
+    
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + shutdown_timeout
+    while children and time.monotonic() < deadline:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            children.pop(pid, None)
+        else:
+            time.sleep(0.05)
+    for pid in children:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    sock.close()
+
+def parse_args(argv=None):
+    env = os.environ
+    parser = argparse.ArgumentParser(description='Web Links Manager')
+    parser.add_argument('--host', default=env.get('LINKS_HOST', ''),
+                        help='address to bind (env LINKS_HOST, default all interfaces)')
+    parser.add_argument('--port', type=int, default=int(env.get('LINKS_PORT', 8000)),
+                        help='port to listen on (env LINKS_PORT, default 8000)')
+    parser.add_argument('--db', dest='db_path', default=env.get('LINKS_DB', 'links.db'),
+                        help='SQLite database file (env LINKS_DB, default links.db)')
+    parser.add_argument('--mode', choices=['single', 'threaded', 'prefork', 'asyncio'],
+                        default=env.get('LINKS_MODE', 'single'),
+                        help='concurrency mode (env LINKS_MODE, default single)')
+    parser.add_argument('--workers', type=int, default=int(env.get('LINKS_WORKERS', os.cpu_count() or 1)),
+                        help='worker processes in prefork mode (env LINKS_WORKERS, default CPU count)')
+    parser.add_argument('--threads', type=int, default=int(env.get('LINKS_THREADS', 8)),
+                        help='threads per process in threaded/prefork mode, or handler threads '
+                             'in asyncio mode (env LINKS_THREADS, default 8)')
+    parser.add_argument('--queue', dest='queue_size', type=int, default=int(env.get('LINKS_QUEUE', 64)),
+                        help='connections allowed to wait for a thread (env LINKS_QUEUE, default 64)')
+    parser.add_argument('--search-tokenizer', choices=sorted(LinkManager.SEARCH_TOKENIZERS),
+                        default=env.get('LINKS_SEARCH_TOKENIZER', 'unicode61'),
+                        help='full-text search tokenizer; trigram also matches substrings '
+                             'inside URLs (env LINKS_SEARCH_TOKENIZER, default unicode61)')
+    parser.add_argument('--page-size', type=int, default=int(env.get('LINKS_PAGE_SIZE', 50)),
+                        help='links per page on the index and search pages (env LINKS_PAGE_SIZE, default 50)')
+    parser.add_argument('--cache-mb', type=int, default=int(env.get('LINKS_CACHE_MB', 32)),
+                        help='memory for cached pages per process in MB, 0 disables (env LINKS_CACHE_MB, default 32)')
+    parser.add_argument('--cache-entries', type=int, default=int(env.get('LINKS_CACHE_ENTRIES', 1024)),
+                        help='maximum number of cached pages (env LINKS_CACHE_ENTRIES, default 1024)')
+    parser.add_argument('--replica-mb', type=int, default=int(env.get('LINKS_REPLICA_MB', 0)),
+                        help='keep a copy of the links table in memory for listings and lookups, up to '
+                             'this many MB per process, 0 disables (env LINKS_REPLICA_MB, default 0)')
+    parser.add_argument('--no-suggest', dest='suggest', action='store_false',
+                        default=env.get('LINKS_SUGGEST', '1') != '0',
+                        help='do not keep the in-memory typeahead index behind /suggest, which then completes '
+                             'only tags and groups from SQLite (env LINKS_SUGGEST=0)')
+    parser.add_argument('--write-batch', type=int, default=int(env.get('LINKS_WRITE_BATCH', 256)),
+                        help='most add/edit/delete requests committed together by the writer thread, '
+                             '0 commits each on its own (env LINKS_WRITE_BATCH, default 256)')
+    parser.add_argument('--write-delay-ms', type=float, default=float(env.get('LINKS_WRITE_DELAY_MS', 2)),
+                        help='longest the writer thread waits to fill a batch (env LINKS_WRITE_DELAY_MS, default 2)')
+    parser.add_argument('--click-flush-interval', type=float, default=float(env.get('LINKS_CLICK_FLUSH_INTERVAL', 5)),
+                        help='seconds between writes of the /go/ clicks counted in memory; each write is one '
+                             'transaction however many clicks came in (env LINKS_CLICK_FLUSH_INTERVAL, default 5)')
+    parser.add_argument('--change-retention-days', type=float,
+                        default=float(env.get('LINKS_CHANGE_RETENTION_DAYS', 30)),
+                        help='how long /api/changes remembers deleted links; clients that last synced before '
+                             'that start over, 0 keeps them forever (env LINKS_CHANGE_RETENTION_DAYS, default 30)')
+    parser.add_argument('--compress-level', type=int, choices=range(0, 10), metavar='0-9',
+                        default=int(env.get('LINKS_COMPRESS_LEVEL', 6)),
+                        help='gzip/deflate level for clients that accept it, 0 disables '
+                             '(env LINKS_COMPRESS_LEVEL, default 6)')
+    parser.add_argument('--compress-min-size', type=int, default=int(env.get('LINKS_COMPRESS_MIN_SIZE', 1024)),
+                        help='smallest response in bytes worth compressing (env LINKS_COMPRESS_MIN_SIZE, default 1024)')
+    parser.add_argument('--slow-ms', type=float, default=float(env.get('LINKS_SLOW_MS', 1000)),
+                        help='log requests slower than this with their SQL breakdown, 0 disables '
+                             '(env LINKS_SLOW_MS, default 1000)')
+    parser.add_argument('--on-duplicate', choices=DUPLICATE_POLICIES,
+                        default=env.get('LINKS_ON_DUPLICATE', 'reject'),
+                        help='adding a link whose canonical URL is stored: reject it, merge its tags into '
+                             'the stored link, or update the stored link (env LINKS_ON_DUPLICATE, default reject)')
+    parser.add_argument('--dedup-report', action='store_true',
+                        help='list links that share a canonical URL and exit')
+    parser.add_argument('--merge-duplicates', action='store_true',
+                        help='merge links that share a canonical URL into the oldest one and exit')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='copy the database into --snapshot-dir once and exit; safe while the server runs')
+    parser.add_argument('--restore', metavar='SNAPSHOT',
+                        help='check a snapshot (.db or .db.gz) and copy it over the database, after saving '
+                             'the current data into --snapshot-dir if set, then exit')
+    parser.add_argument('--snapshot-dir', default=env.get('LINKS_SNAPSHOT_DIR', ''),
+                        help='directory for database snapshots, reported at /admin/snapshots '
+                             '(env LINKS_SNAPSHOT_DIR, default none)')
+    parser.add_argument('--snapshot-interval-hours', type=float,
+                        default=float(env.get('LINKS_SNAPSHOT_INTERVAL_HOURS', 24)),
+                        help='take a snapshot once the newest is this old, 0 only by hand '
+                             '(env LINKS_SNAPSHOT_INTERVAL_HOURS, default 24)')
+    parser.add_argument('--snapshot-keep', type=int, default=int(env.get('LINKS_SNAPSHOT_KEEP', 7)),
+                        help='newest snapshots kept, 0 keeps all (env LINKS_SNAPSHOT_KEEP, default 7)')
+    parser.add_argument('--snapshot-compress', action='store_true',
+                        default=env.get('LINKS_SNAPSHOT_COMPRESS', '0') != '0',
+                        help='gzip snapshots (env LINKS_SNAPSHOT_COMPRESS=1)')
+    parser.add_argument('--snapshot-step-pages', type=int, default=int(env.get('LINKS_SNAPSHOT_STEP_PAGES', 1024)),
+                        help='database pages copied per step (env LINKS_SNAPSHOT_STEP_PAGES, default 1024)')
+    parser.add_argument('--snapshot-step-pause-ms', type=float,
+                        default=float(env.get('LINKS_SNAPSHOT_STEP_PAUSE_MS', 10)),
+                        help='pause between steps, leaving the disk to requests '
+                             '(env LINKS_SNAPSHOT_STEP_PAUSE_MS, default 10)')
+    parser.add_argument('--check-links', action='store_true',
+                        help='check the links not checked within --check-max-age-hours once and exit')
+    parser.add_argument('--check-interval', type=float, default=float(env.get('LINKS_CHECK_INTERVAL', 0)),
+                        help='check links in the background, starting a pass this many seconds after the last '
+                             'one ends, 0 disables (env LINKS_CHECK_INTERVAL, default 0)')
+    parser.add_argument('--check-max-age-hours', type=float,
+                        default=float(env.get('LINKS_CHECK_MAX_AGE_HOURS', 168)),
+                        help='recheck links after this many hours (env LINKS_CHECK_MAX_AGE_HOURS, default 168)')
+    parser.add_argument('--check-concurrency', type=int, default=int(env.get('LINKS_CHECK_CONCURRENCY', 500)),
+                        help='links checked at once (env LINKS_CHECK_CONCURRENCY, default 500)')
+    parser.add_argument('--check-per-host', type=int, default=int(env.get('LINKS_CHECK_PER_HOST', 2)),
+                        help='links checked at once on one host (env LINKS_CHECK_PER_HOST, default 2)')
+    parser.add_argument('--check-host-delay', type=float, default=float(env.get('LINKS_CHECK_HOST_DELAY', 1.0)),
+                        help='seconds between starting checks on one host (env LINKS_CHECK_HOST_DELAY, default 1)')
+    parser.add_argument('--check-timeout', type=float, default=float(env.get('LINKS_CHECK_TIMEOUT', 10)),
+                        help='seconds allowed for one check, redirects included '
+                             '(env LINKS_CHECK_TIMEOUT, default 10)')
+    config = parser.parse_args(argv)
+    if config.mode == 'single':
+        config.threads = 1
+    if config.mode == 'prefork' and not hasattr(os, 'fork'):
+        print("Prefork mode needs os.fork(); falling back to threaded mode")
+        config.mode = 'threaded'
+    if config.snapshot and not config.snapshot_dir:
+        parser.error('--snapshot needs --snapshot-dir')
+    return config
+
+def run_dedup(link_manager, merge=False):
+    """Print the links that share a canonical URL, then merge them if asked."""
+    groups = link_manager.find_duplicates()
+    for links in groups:
+        print(links[0]['canonical_url'])
+        for link in links:
+            print(f"  #{link['id']:<8} {link['url']}  [{link['tags'] or ''}]")
+    print(f"{len(groups)} URLs stored more than once, {sum(len(links) - 1 for links in groups)} extra links")
+    if merge:
+        merged, removed = link_manager.merge_duplicates()
+        print(f"Merged {merged} URLs, removed {removed} links; URLs are now unique")
+
+def make_checker(config, link_manager):
+    return LinkChecker(link_manager, concurrency=config.check_concurrency, per_host=config.check_per_host,
+                       host_delay=config.check_host_delay, timeout=config.check_timeout,
+                       max_age=config.check_max_age_hours * 3600)
+
+def run_check(link_manager, config):
+    """Check the stale links once and print what was found."""
+    started = time.perf_counter()
+    counts = make_checker(config, link_manager).run()
+    elapsed = time.perf_counter() - started
+    print(f"Checked {sum(counts.values())} links in {elapsed:.1f}s: "
+          + ', '.join(f"{counts.get(state, 0)} {state}" for state in LinkManager.HEALTH_STATES[1:]))
+
+def make_snapshotter(config):
+    if not config.snapshot_dir:
+        return None
+    return Snapshotter(config.db_path, config.snapshot_dir, interval=config.snapshot_interval_hours * 3600,
+                       keep=config.snapshot_keep, compress=config.snapshot_compress,
+                       pages=config.snapshot_step_pages, pause=config.snapshot_step_pause_ms / 1000)
+
+def run_snapshot(config):
+    """Take one snapshot and print where it went."""
+    result = make_snapshotter(config).snapshot()
+    print(f"Saved {os.path.join(config.snapshot_dir, result['name'])} "
+          f"({result['bytes'] / 1e6:.1f} MB in {result['seconds']:.1f}s)")
+
+def run_restore(link_manager, config):
+    """Check the --restore snapshot and copy it over the database, saving the current data first."""
+    snapshotter = make_snapshotter(config)
+    if snapshotter is not None:
+        # Not rotated, so the snapshot being restored cannot be deleted first.
+        result = snapshotter.snapshot(rotate=False)
+        print(f"Saved the current data as {os.path.join(config.snapshot_dir, result['name'])}")
+    try:
+        count = link_manager.restore(config.restore)
+    except (ValueError, OSError) as e:
+        print(f"Not restored: {e}")
+        sys.exit(1)
+    print(f"Restored {count} links from {config.restore}")
+
+def run_server(port=8000, db_path='links.db', config=None):
+    if config is None:
+        config = parse_args([])
+        config.port = port
+        config.db_path = db_path
+    link_manager = LinkManager(config.db_path, search_tokenizer=config.search_tokenizer,
+                               replica_bytes=config.replica_mb * 1024 * 1024,
+                               write_batch=config.write_batch, write_delay=config.write_delay_ms / 1000,
+                               suggest=config.suggest, click_interval=config.click_flush_interval,
+                               change_retention=config.change_retention_days * 86400)
+    if link_manager.replica_overflowed:
+        print(f"The links table does not fit in --replica-mb {config.replica_mb}; reading from SQLite")
+    if config.dedup_report or config.merge_duplicates:
+        run_dedup(link_manager, merge=config.merge_duplicates)
+        return
+    if config.check_links:
+        run_check(link_manager, config)
+        return
+    if config.snapshot:
+        run_snapshot(config)
+        return
+    if config.restore:
+        run_restore(link_manager, config)
+        return
+    if not link_manager.unique_urls:
+        print("Some links share a canonical URL; see --dedup-report and --merge-duplicates")
+    print(f"Server running on http://localhost:{config.port} ({config.mode} mode)")
     print("Press Ctrl+C to stop the server")
+    if config.mode == 'prefork':
+        run_prefork(config, link_manager)
+        print("\nServer stopped")
+        return
+    checker = None
+    if config.check_interval > 0:
+        checker = make_checker(config, link_manager)
+        checker.start(config.check_interval)
+    snapshotter = None
+    if config.snapshot_dir and config.snapshot_interval_hours > 0:
+        snapshotter = make_snapshotter(config)
+        snapshotter.start()
+    try:
+        serve(config, link_manager)
+    finally:
+        if checker is not None:
+            checker.close()
+        if snapshotter is not None:
+            snapshotter.close()
+        link_manager.clicks.close()
+
+def serve(config, link_manager):
+    """Serve in ``config.mode`` until interrupted; prefork mode has run_prefork()."""
+    if config.mode == 'asyncio':
+        server = AsyncLinkServer((config.host, config.port), handler_for(config), link_manager,
+                                 threads=config.threads)
+        server.response_cache = make_response_cache(config)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            print("\nShutting down server...")
+        finally:
+            server.server_close()
+        return
+    httpd = make_server(config, link_manager)
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\nShutting down server...")
+    finally:
         httpd.server_close()
 
 if __name__ == '__main__':
-    run_server() 
\ No newline at end of file
+    run_server(config=parse_args())
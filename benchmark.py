@@ -0,0 +1,1059 @@
+"""Benchmarks for Web Links Manager.
+
+Run with ``python3 benchmark.py <name>``; every benchmark works on a scratch
+database in a temporary directory and never touches ``links.db``.
+
+``manager``, ``load``, ``replica``, ``suggest``, ``writes``, ``health``, ``clicks``, ``changes`` and ``snapshot``
+save their results with ``--output`` and compare them against an earlier run with ``--baseline``,
+exiting non-zero when a metric got worse by more than ``--tolerance``.
+"""
+import argparse
+import asyncio
+import html
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+from app import (EXPORT_FORMATS, STYLESHEET, ConnectionPool, LinkChecker, LinkHandler, LinkManager, LinkReplica,
+                 Snapshotter, SuggestIndex, compress_body, iter_export, iter_import_records)
+
+GROUPS = ['work', 'personal', 'reading', 'python', 'news', 'tools', 'music', 'travel'] + [
+    f'project-{n}' for n in range(1, 43)]
+TAGS = ['python', 'sqlite', 'http', 'docs', 'video', 'blog', 'tutorial', 'reference', 'api', 'news'] + [
+    f'topic-{n}' for n in range(1, 291)]
+WORDS = ('guide intro advanced notes release python sqlite server async cache index query '
+         'design pattern testing deploy docker linux network security performance tuning '
+         'database search http api json css html template stream export import backup '
+         'review howto tips example reference spec draft paper talk video podcast weekly').split()
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+
+def zipf_weights(count, exponent=1.1):
+    """Rank-frequency weights: a few groups, tags and sites take most links."""
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def make_links(count, seed=1):
+    rng = random.Random(seed)
+    group_weights = zipf_weights(len(GROUPS))
+    tag_weights = zipf_weights(len(TAGS))
+    domain_weights = zipf_weights(2000)
+    domains = range(2000)
+    for i in range(count):
+        tags = set(rng.choices(TAGS, tag_weights, k=rng.choice((0, 1, 1, 2, 2, 3, 4))))
+        yield (
+            ' '.join(rng.choices(WORDS, k=rng.randint(3, 8))) + f' {i}',
+            ', '.join(sorted(tags)),
+            f'https://site{rng.choices(domains, domain_weights)[0]}.example.com/page/{i}',
+            rng.choices(GROUPS, group_weights)[0],
+        )
+
+
+def populate(db_path, count, seed=1):
+    manager = LinkManager(db_path)
+    links = make_links(count, seed)
+    while True:
+        batch = [link for _, link in zip(range(50_000), links)]
+        if not batch:
+            break
+        manager.insert_links(batch)
+    manager.close()
+
+
+def parse_size(size):
+    return SIZES[size.lower()] if size.lower() in SIZES else int(size)
+
+
+def dataset(args):
+    """Path of the synthetic database for ``--size``, built once and reused."""
+    count = parse_size(args.size)
+    os.makedirs(args.data_dir, exist_ok=True)
+    path = os.path.join(args.data_dir, f'links-{count}-{args.seed}.db')
+    if not os.path.exists(path):
+        print(f'building {path} ({count} links) ...', flush=True)
+        start = time.perf_counter()
+        populate(path + '.tmp', count, args.seed)
+        os.replace(path + '.tmp', path)
+        print(f'built in {time.perf_counter() - start:.1f} s', flush=True)
+    else:
+        # Brings a database cached by an older version up to date once, rather than in every timed run.
+        LinkManager(path).close()
+    return path
+
+
+def copy_database(source, target):
+    """Consistent copy of a (possibly WAL-mode) database for benchmarks that write."""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    with dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def legacy_index_request(db_path):
+    """The pre-pool request path: a LinkManager per request and a connection per call."""
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS links (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            tags TEXT,
+            url TEXT NOT NULL,
+            file_group TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(db_path)
+    links = conn.execute('SELECT * FROM links').fetchall()
+    conn.close()
+    conn = sqlite3.connect(db_path)
+    groups = conn.execute('SELECT DISTINCT file_group FROM links').fetchall()
+    conn.close()
+    return links, groups
+
+
+def legacy_render_index(links):
+    """The pre-template index body: inline CSS and one ``+=`` per row."""
+    html_content = '<!DOCTYPE html><html><head><style>' + STYLESHEET + '</style></head><body><table><tbody>'
+    for link in links:
+        html_content += f'''
+                        <tr>
+                            <td>{html.escape(link['description'])}</td>
+                            <td>{html.escape(link['tags'] or '')}</td>
+                            <td class="url-cell"><a href="{html.escape(link['url'])}" target="_blank">{html.escape(link['url'])}</a></td>
+                            <td>{html.escape(link['file_group'])}</td>
+                            <td>
+                                <a href="/edit/{link['id']}" class="action-buttons edit-btn">Edit</a>
+                                <form method="POST" action="/delete/{link['id']}" style="display: inline;">
+                                    <button type="submit" class="action-buttons delete-btn" onclick="return confirm('Are you sure?')">Delete</button>
+                                </form>
+                            </td>
+                        </tr>
+            '''
+    html_content += '</tbody></table></body></html>'
+    return html_content
+
+
+def timed(fn, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, max(0, int(len(ordered) * fraction + 0.5) - 1))]
+
+
+def summarize(samples, elapsed=None):
+    """Latency percentiles in ms and throughput for a list of durations in seconds."""
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'ops_per_s': len(ordered) / (elapsed if elapsed is not None else sum(ordered)),
+        'mean_ms': statistics.mean(ordered) * 1e3,
+        'p50_ms': percentile(ordered, 0.50) * 1e3,
+        'p95_ms': percentile(ordered, 0.95) * 1e3,
+        'p99_ms': percentile(ordered, 0.99) * 1e3,
+    }
+
+
+def print_summary(name, summary, width=28):
+    print(f'{name:<{width}} {summary["ops_per_s"]:10.1f} ops/s   p50 {summary["p50_ms"]:9.3f} ms   '
+          f'p95 {summary["p95_ms"]:9.3f} ms   p99 {summary["p99_ms"]:9.3f} ms')
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f'{name:<10} mean {statistics.mean(samples) * 1e6:9.1f} us   '
+          f'p50 {statistics.median(samples) * 1e6:9.1f} us   p95 {p95 * 1e6:9.1f} us')
+
+
+def measure(fn, requests, max_seconds=5.0, min_requests=5):
+    """Call ``fn`` up to ``requests`` times, stopping early after ``max_seconds``."""
+    samples = []
+    deadline = time.perf_counter() + max_seconds
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        end = time.perf_counter()
+        samples.append(end - start)
+        if end > deadline and len(samples) >= min_requests:
+            break
+    return samples
+
+
+def bench_pool(args):
+    """Per-request cost of the index route before and after connection pooling."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        populate(db_path, args.rows)
+        print(f'{args.rows} links, {args.requests} requests per variant')
+
+        report('legacy', timed(lambda: legacy_index_request(db_path), args.requests))
+
+        manager = LinkManager(db_path)
+
+        def pooled():
+            manager.get_all_links()
+            manager.get_groups()
+
+        report('pooled', timed(pooled, args.requests))
+        manager.close()
+
+
+class NullWriter:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def bench_export(args):
+    """Time and peak Python memory of each streaming export format."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        populate(db_path, args.rows)
+        manager = LinkManager(db_path)
+        print(f'{args.rows} links')
+        for fmt in sorted(EXPORT_FORMATS):
+            out = NullWriter()
+            tracemalloc.start()
+            start = time.perf_counter()
+            for piece in iter_export(fmt, manager.iter_links()):
+                out.write(piece.encode('utf-8'))
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{fmt:<10} {elapsed * 1e3:9.1f} ms   {out.size / 1e6:8.1f} MB written   '
+                  f'peak {peak / 1e6:6.2f} MB')
+        manager.close()
+
+
+def bench_import(args):
+    """Round-trip a CSV export through the streaming import pipeline."""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = LinkManager(os.path.join(tmp, 'source.db'))
+        conn = source.pool.connection()
+        with conn:
+            conn.executemany(
+                'INSERT INTO links (description, tags, url, file_group) VALUES (?, ?, ?, ?)',
+                make_links(args.rows))
+        csv_path = os.path.join(tmp, 'links.csv')
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            for piece in iter_export('csv', source.iter_links()):
+                f.write(piece)
+        source.close()
+        size = os.path.getsize(csv_path)
+        print(f'{args.rows} links, {size / 1e6:.1f} MB CSV')
+
+        # The first pass imports into an empty database; the later ones find
+        # every row already stored and go through the duplicate policies.
+        target = LinkManager(os.path.join(tmp, 'target.db'))
+        for label, on_duplicate in (('new rows', 'reject'), ('all reject', 'reject'),
+                                    ('all merge', 'merge'), ('all update', 'update')):
+            tracemalloc.start()
+            start = time.perf_counter()
+            with open(csv_path, 'rb') as f:
+                result = target.import_links(iter_import_records('csv', f), on_duplicate=on_duplicate)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows = sum(result[key] for key in ('imported', 'skipped', 'merged', 'updated'))
+            print(f'{label:<11} {elapsed:7.2f} s   '
+                  f'{rows / elapsed:9.0f} rows/s   peak {peak / 1e6:6.2f} MB')
+        target.close()
+
+
+def bench_render(args):
+    """Render time and size of the index page before and after precompiled templates."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        populate(db_path, args.rows)
+        manager = LinkManager(db_path)
+        links = list(manager.iter_links())
+        groups = manager.get_groups()
+        manager.close()
+        handler = LinkHandler.__new__(LinkHandler)
+        print(f'{args.rows} links per page')
+        for name, render in (('legacy', lambda: legacy_render_index(links)),
+                             ('template', lambda: handler.render_index(links, groups))):
+            samples = timed(render, 20)
+            size = len(render().encode('utf-8'))
+            print(f'{name:<10} {statistics.median(samples) * 1e3:9.1f} ms   '
+                  f'{size / 1e6:8.2f} MB   {size / max(len(links), 1):6.0f} bytes/row')
+
+
+def bench_compress(args):
+    """Size and cost of gzip at several levels for the index page and exports."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        populate(db_path, args.rows)
+        manager = LinkManager(db_path)
+        handler = LinkHandler.__new__(LinkHandler)
+        handler.page_size = LinkHandler.page_size
+        bodies = {
+            'index': handler.render_index(manager.get_links_page()['links'], manager.get_groups()),
+            'index all': handler.render_index(list(manager.iter_links()), manager.get_groups()),
+        }
+        for fmt in sorted(EXPORT_FORMATS):
+            bodies[f'export {fmt}'] = ''.join(iter_export(fmt, manager.iter_links()))
+        manager.close()
+        print(f'{args.rows} links')
+        for name, body in bodies.items():
+            body = body.encode('utf-8')
+            results = []
+            for level in (1, 6, 9):
+                samples = timed(lambda: compress_body(body, 'gzip', level), 5)
+                size = len(compress_body(body, 'gzip', level))
+                results.append(f'L{level} {len(body) / size:5.1f}x {statistics.median(samples) * 1e3:7.1f} ms')
+            print(f'{name:<14} {len(body) / 1e3:9.1f} kB   ' + '   '.join(results))
+
+
+def bench_manager(args):
+    """Microbenchmark every LinkManager read and write path on a synthetic database."""
+    source = dataset(args)
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        copy_database(source, db_path)
+        manager = LinkManager(db_path, replica_bytes=args.replica_mb * 1024 * 1024)
+        count = manager.get_stats()['total_links']
+        first = manager.get_links_page(limit=50)
+        deep = manager.get_links_page(sort='description', limit=50)
+        for _ in range(20):
+            deep = manager.get_links_page(sort='description', after=deep['next'], limit=50)
+        group = GROUPS[5]
+        ids = lambda n: [rng.randint(1, count) for _ in range(n)]
+        new_links = lambda n: [{'description': f'bench {rng.random()}', 'tags': 'bench, api',
+                                'url': f'https://bench.example.com/{rng.random()}', 'file_group': 'bench'}
+                               for _ in range(n)]
+        cases = [
+            ('data_generation', lambda: manager.data_generation(), 1),
+            ('get_link', lambda: manager.get_link(rng.randint(1, count)), 1),
+            ('get_links_by_ids 100', lambda: manager.get_links_by_ids(ids(100)), 100),
+            ('get_links_page first', lambda: manager.get_links_page(limit=50), 50),
+            ('get_links_page next', lambda: manager.get_links_page(after=first['next'], limit=50), 50),
+            ('get_links_page deep sort', lambda: manager.get_links_page(
+                sort='description', after=deep['next'], limit=50), 50),
+            ('get_links_page group desc', lambda: manager.get_links_page(
+                group, sort='url', descending=True, limit=50), 50),
+            ('get_links_page tag', lambda: manager.get_links_page(tags=rng.choice(TAGS), limit=50), 50),
+            ('get_links_page tag filter', lambda: manager.get_links_page(
+                tags='{},{}|{},-{}'.format(*rng.sample(TAGS[:20], 4)), sort='description', limit=50), 50),
+            ('get_groups', lambda: manager.get_groups(), 1),
+            ('get_tag_counts', lambda: manager.get_tag_counts(), 1),
+            ('find_duplicates', lambda: manager.find_duplicates(), None),
+            ('get_stats', lambda: manager.get_stats(), 1),
+            ('search_links_page word', lambda: manager.search_links_page(rng.choice(WORDS), limit=50), 50),
+            ('search_links_page prefix', lambda: manager.search_links_page(
+                rng.choice(WORDS)[:3] + '*', limit=50), 50),
+            ('search_links_page phrase', lambda: manager.search_links_page(
+                '"' + ' '.join(rng.sample(WORDS, 2)) + '"', limit=50), 50),
+            ('iter_links group', lambda: sum(1 for _ in manager.iter_links(group)), None),
+            ('add_link', lambda: manager.add_link(
+                'bench', 'bench', f'https://bench.example.com/{rng.random()}', 'bench'), 1),
+            ('add_link duplicate merge', lambda: manager.add_link(
+                'bench', 'bench', first['links'][0]['url'], 'bench', on_duplicate='merge'), 1),
+            ('update_link', lambda: manager.update_link(
+                rng.randint(1, count), 'bench update', 'bench', f'https://bench.example.com/u/{rng.random()}',
+                'bench'), 1),
+            ('apply_batch create 1000', lambda: manager.apply_batch(
+                [{'op': 'create', 'link': link} for link in new_links(1000)]), 1000),
+            ('apply_batch update 1000', lambda: manager.apply_batch(
+                [{'op': 'update', 'id': link_id, 'link': {'tags': 'bench'}} for link_id in set(ids(1000))]), 1000),
+            ('import_links 1000', lambda: manager.import_links(new_links(1000)), 1000),
+        ]
+        print(f'{count} links ({args.size})')
+        results = {}
+        for name, fn, rows in cases:
+            samples = measure(fn, args.requests, args.max_seconds)
+            summary = summarize(samples)
+            if rows:
+                summary['rows_per_s'] = summary['ops_per_s'] * rows
+            results[name] = summary
+            print_summary(name, summary)
+        # Deletes last, so the cases above see the full data set.
+        victims = iter(range(count, 0, -1))
+        summary = summarize(measure(lambda: manager.delete_link(next(victims)), min(args.requests, count),
+                                    args.max_seconds))
+        results['delete_link'] = summary
+        print_summary('delete_link', summary)
+        manager.close()
+    return results
+
+
+def bench_replica(args):
+    """Memory of the in-memory replica and its read latency next to SQLite's."""
+    source = dataset(args)
+    rng = random.Random(args.seed)
+    budget = (args.replica_mb or 4096) * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        copy_database(source, db_path)
+        plain = LinkManager(db_path)
+        start = time.perf_counter()
+        replicated = LinkManager(db_path, replica_bytes=budget)
+        elapsed = time.perf_counter() - start
+        replica = replicated.replica
+        if replica is None:
+            print(f'the table does not fit in {budget // 1024 // 1024} MB; raise --replica-mb')
+            return None
+        # Measured on a second copy: tracing allocations slows the load down several times.
+        tracemalloc.start()
+        LinkReplica(budget).load(plain.pool.connection())
+        traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        count = len(replica.ids)
+        per_million = traced / max(count, 1) * 1_000_000
+        print(f'{count} links ({args.size}), {len(replica.group_ids)} groups, loaded in {elapsed:.2f} s')
+        print(f'memory: {traced / 1e6:.1f} MB traced, {replica.size / 1e6:.1f} MB estimated, '
+              f'{per_million / 1e6:.0f} MB per 1M links')
+        results = {'load': {'seconds': elapsed, 'bytes_per_link': traced / max(count, 1)}}
+        small_group = min(replica.group_ids, key=lambda group: len(replica.group_ids[group]))
+        first = plain.get_links_page(GROUPS[0], limit=50)
+        cases = [
+            ('get_link', lambda manager: manager.get_link(rng.randint(1, count))),
+            ('get_groups', lambda manager: manager.get_groups()),
+            ('get_links_page first', lambda manager: manager.get_links_page(limit=50)),
+            ('get_links_page group next', lambda manager: manager.get_links_page(
+                GROUPS[0], after=first['next'], limit=50)),
+            ('get_links_page group desc', lambda manager: manager.get_links_page(
+                GROUPS[5], descending=True, limit=50)),
+            ('get_links_by_group small', lambda manager: manager.get_links_by_group(small_group)),
+            ('get_links_by_group large', lambda manager: manager.get_links_by_group(GROUPS[0])),
+            ('get_all_links', lambda manager: manager.get_all_links()),
+        ]
+        for name, fn in cases:
+            for label, manager in (('sqlite', plain), ('replica', replicated)):
+                summary = summarize(measure(lambda: fn(manager), args.requests, args.max_seconds))
+                results[f'{name} {label}'] = summary
+                print_summary(f'{name} {label}', summary, 34)
+        plain.close()
+        replicated.close()
+    return results
+
+
+def bench_suggest(args):
+    """Build cost and memory of the typeahead index, and /suggest latency per keystroke."""
+    source = dataset(args)
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        copy_database(source, db_path)
+        plain = LinkManager(db_path)
+        start = time.perf_counter()
+        indexed = LinkManager(db_path, suggest=True)
+        elapsed = time.perf_counter() - start
+        suggestions = indexed.suggestions
+        tracemalloc.start()
+        SuggestIndex().load(plain.pool.connection())
+        traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        count = plain.pool.connection().execute('SELECT COUNT(*) FROM links').fetchone()[0]
+        print(f'{count} links ({args.size}), {len(suggestions.terms)} terms, built in {elapsed:.2f} s, '
+              f'{traced / 1e6:.1f} MB traced')
+        results = {'load': {'seconds': elapsed, 'terms': len(suggestions.terms), 'bytes': traced}}
+        # Every prefix of a few words, as typed one key at a time.
+        typed = [word[:length] for word in ('performance', 'python', 'site12', 'project-3', 'topic-2')
+                 for length in range(1, len(word) + 1)]
+
+        def cold(manager):
+            suggestions._top.clear()
+            manager.suggest(rng.choice(typed))
+
+        def write(manager):
+            _, link_id = manager.add_link(' '.join(rng.choices(WORDS, k=5)), rng.choice(TAGS),
+                                          f'https://bench.example.com/{rng.random()}', rng.choice(GROUPS))
+            manager.delete_link(link_id)
+
+        cases = [
+            ('suggest keystroke', lambda manager: manager.suggest(rng.choice(typed)), (plain, indexed)),
+            ('suggest uncached', cold, (indexed,)),
+            ('suggest tags', lambda manager: manager.suggest(rng.choice(typed), kinds=['tag']), (plain, indexed)),
+            ('add+delete', write, (plain, indexed)),
+        ]
+        for name, fn, managers in cases:
+            for manager in managers:
+                label = f'{name} {"index" if manager is indexed else "sqlite"}'
+                summary = summarize(measure(lambda: fn(manager), args.requests, args.max_seconds))
+                results[label] = summary
+                print_summary(label, summary, 34)
+        plain.close()
+        indexed.close()
+    return results
+
+
+def bench_writes(args):
+    """Throughput of concurrent add/update/delete callers with and without group commit."""
+    source = dataset(args)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, options in (('direct', {}), ('direct full sync', {'synchronous': 'FULL'}),
+                               ('group commit', {'write_batch': args.write_batch or 256})):
+            db_path = os.path.join(tmp, 'bench.db')
+            copy_database(source, db_path)
+            pool = ConnectionPool(db_path, synchronous=options.pop('synchronous', 'NORMAL'))
+            manager = LinkManager(db_path, pool=pool, **options)
+            for threads in (1, 8, 32, 128):
+                samples = []
+                deadline = time.perf_counter() + args.max_seconds
+
+                def writer(seed):
+                    rng = random.Random(seed)
+                    while time.perf_counter() < deadline:
+                        start = time.perf_counter()
+                        _, link_id = manager.add_link('bench', 'bench', f'https://bench.example.com/{rng.random()}',
+                                                      'bench')
+                        manager.update_link(link_id, 'bench update', 'bench',
+                                            f'https://bench.example.com/u/{rng.random()}', 'bench')
+                        manager.delete_link(link_id)
+                        samples.append((time.perf_counter() - start) / 3)
+
+                workers = [threading.Thread(target=writer, args=(args.seed + n,)) for n in range(threads)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                summary = summarize(samples, args.max_seconds / 3)
+                name = f'{label} x{threads}'
+                results[name] = summary
+                print_summary(name, summary)
+            manager.close()
+            os.remove(db_path)
+    return results
+
+
+def stand_in_hosts(count):
+    """Loopback addresses standing in for ``count`` remote hosts (all of 127/8 is local on Linux)."""
+    return [f'127.0.{n // 250}.{n % 250 + 2}' for n in range(count)]
+
+
+def stand_in_server(hosts, port, latency):
+    """Answer every request after ``latency`` seconds: /moved/ redirects, /gone/ is 404, the rest 200."""
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                path = request.split(b' ', 2)[1]
+                await asyncio.sleep(latency)
+                if path.startswith(b'/moved/'):
+                    head = b'301 Moved Permanently\r\nLocation: /ok/' + path[7:]
+                elif path.startswith(b'/gone/'):
+                    head = b'404 Not Found'
+                else:
+                    head = b'200 OK'
+                writer.write(b'HTTP/1.1 ' + head + b'\r\nContent-Length: 0\r\n\r\n')
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handle, hosts, port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def bench_health(args):
+    """Links checked per second by LinkChecker against a local stand-in for many slow hosts."""
+    source = dataset(args)
+    hosts = stand_in_hosts(200)
+    port = free_port()
+    latency = 0.02
+    server = multiprocessing.Process(target=stand_in_server, args=(hosts, port, latency), daemon=True)
+    server.start()
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection((hosts[-1], port), timeout=1).close()
+            break
+        except OSError:
+            if time.time() > deadline:
+                server.kill()
+                raise RuntimeError('stand-in server did not start')
+            time.sleep(0.05)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        copy_database(source, db_path)
+        db = sqlite3.connect(db_path)
+        # Mostly working links, some redirected and some gone, spread over the stand-in hosts.
+        db.create_function('stand_in_host', 1, lambda n: hosts[n % len(hosts)])
+        with db:
+            db.execute(f"""UPDATE links SET url = 'http://' || stand_in_host(id) || ':{port}/'
+                           || CASE WHEN id % 20 = 0 THEN 'gone' WHEN id % 10 = 0 THEN 'moved' ELSE 'ok' END
+                           || '/' || id""")
+        db.close()
+        manager = LinkManager(db_path, suggest=False)
+        count = manager.pool.connection().execute('SELECT COUNT(*) FROM links').fetchone()[0]
+        print(f'{count} links on {len(hosts)} hosts answering in {latency * 1000:.0f} ms')
+        for concurrency, per_host in ((50, 1), (500, 4)):
+            conn = manager.pool.connection()
+            with conn:
+                conn.execute("UPDATE link_health SET state = 'unchecked', checked = 0")
+            checker = LinkChecker(manager, concurrency=concurrency, per_host=per_host, host_delay=0,
+                                  max_per_host=count)
+            start = time.perf_counter()
+            counts = checker.run()
+            elapsed = time.perf_counter() - start
+            checked = sum(counts.values())
+            name = f'check x{concurrency}'
+            results[name] = {'count': checked, 'seconds': elapsed, 'ops_per_s': checked / elapsed}
+            print(f'{name:<28} {checked / elapsed:9.0f} links/s  ({checked} in {elapsed:.1f} s: '
+                  + ', '.join(f'{n} {state}' for state, n in sorted(counts.items())) + ')')
+        manager.close()
+    server.kill()
+    return results
+
+
+def bench_clicks(args):
+    """/go/ clicks per second from concurrent callers, counted in memory or written one by one."""
+    source = dataset(args)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        copy_database(source, db_path)
+        manager = LinkManager(db_path, click_interval=1.0)
+        count = manager.pool.connection().execute('SELECT COUNT(*) FROM links').fetchone()[0]
+        # A few links get most of the clicks.
+        weights = zipf_weights(min(count, 10_000))
+        for label in ('counted', 'write per click'):
+            for threads in (1, 8, 32):
+                samples = []
+                deadline = time.perf_counter() + args.max_seconds
+
+                def clicker(seed):
+                    rng = random.Random(seed)
+                    ids = rng.choices(range(1, len(weights) + 1), weights, k=10_000)
+                    while time.perf_counter() < deadline:
+                        link_id = ids[len(samples) % len(ids)]
+                        start = time.perf_counter()
+                        manager.redirect_target(link_id)
+                        if label == 'counted':
+                            manager.record_click(link_id)
+                        else:
+                            manager.record_clicks({link_id: (1, int(time.time()))})
+                        samples.append(time.perf_counter() - start)
+
+                workers = [threading.Thread(target=clicker, args=(args.seed + n,)) for n in range(threads)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                summary = summarize(samples, args.max_seconds)
+                name = f'{label} x{threads}'
+                results[name] = summary
+                print_summary(name, summary)
+        # One interval's worth of clicks on many different links.
+        manager.clicks.flush()
+        for link_id in range(1, len(weights) + 1):
+            manager.record_click(link_id)
+        start = time.perf_counter()
+        flushed = manager.clicks.flush()
+        elapsed = time.perf_counter() - start
+        results['flush'] = {'links': flushed, 'seconds': elapsed}
+        print(f'flush of {flushed} links: {elapsed * 1000:.1f} ms')
+        manager.close()
+    return results
+
+
+def bench_changes(args):
+    """/api/changes polls after a few changes against re-reading the table, long-poll wake-up and write overhead."""
+    source = dataset(args)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        copy_database(source, db_path)
+        manager = LinkManager(db_path)
+        rng = random.Random(args.seed)
+        count = manager.pool.connection().execute('SELECT MAX(id) FROM links').fetchone()[0]
+
+        def full_sync():
+            page = manager.get_changes(limit=5000)
+            while page['more']:
+                page = manager.get_changes(page['cursor'], 5000)
+            return page['cursor']
+
+        cursor = full_sync()
+        for name, fn in (('full sync', full_sync), ('read whole table', manager.get_all_links)):
+            summary = summarize(measure(fn, args.requests, args.max_seconds, min_requests=2))
+            results[name] = summary
+            print_summary(name, summary)
+        for changed in (0, 10, 100, 1000):
+            for _ in range(changed):
+                link_id = rng.randint(1, count)
+                manager.update_link(link_id, 'bench', 'bench', f'https://bench.example.com/{link_id}/{rng.random()}',
+                                    'bench')
+            start = time.perf_counter()
+            page = manager.get_changes(cursor, 5000)
+            elapsed = time.perf_counter() - start
+            cursor = page['cursor']
+            results[f'poll after {changed}'] = {'changes': len(page['changes']), 'seconds': elapsed}
+            print(f'{"poll after " + str(changed):<28} {elapsed * 1000:9.3f} ms  ({len(page["changes"])} changes)')
+        # Time from a commit to a long-polling caller waking up.
+        samples = []
+        for _ in range(min(args.requests, 200)):
+            seq = manager.latest_change()
+            woke = []
+            waiter = threading.Thread(target=lambda: woke.append((manager.wait_for_changes(seq, 5),
+                                                                  time.perf_counter())))
+            waiter.start()
+            time.sleep(0.001)
+            start = time.perf_counter()
+            manager.add_link('bench', 'bench', f'https://bench.example.com/{rng.random()}', 'bench')
+            waiter.join()
+            samples.append(woke[0][1] - start)
+        summary = summarize(samples)
+        results['long-poll wake-up'] = summary
+        print_summary('long-poll wake-up', summary)
+        # What the change log adds to each write.
+        conn = manager.pool.connection()
+        for label in ('write with log', 'write without log'):
+            if label == 'write without log':
+                with conn:
+                    for trigger in ('insert', 'update', 'delete'):
+                        conn.execute(f'DROP TRIGGER link_changes_{trigger}')
+
+            def write():
+                _, link_id = manager.add_link('bench', 'bench', f'https://bench.example.com/{rng.random()}', 'bench')
+                manager.update_link(link_id, 'bench update', 'bench', f'https://bench.example.com/u/{rng.random()}',
+                                    'bench')
+                manager.delete_link(link_id)
+
+            summary = summarize(measure(write, args.requests, args.max_seconds))
+            results[label] = summary
+            print_summary(label, summary)
+        manager.close()
+    return results
+
+
+def bench_snapshot(args):
+    """Snapshot duration and size, and live request latency while snapshots run back to back."""
+    source = dataset(args)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        copy_database(source, db_path)
+        count = parse_size(args.size)
+        server, port = start_server(db_path, args)
+        try:
+            print(f'{count} links, {os.path.getsize(db_path) / 1e6:.0f} MB, {args.concurrency} clients for '
+                  f'{args.duration} s per row', flush=True)
+            # (label, Snapshotter options); None is the baseline with no snapshot running. The warm-up
+            # row fills the server's and the OS's caches first and is not reported.
+            for label, options in (('warm-up', None), ('no snapshot', None), ('stepped', {}),
+                                   ('stepped gzip', {'compress': True}), ('one step', {'pages': -1, 'pause': 0})):
+                durations, size = [], 0
+                with multiprocessing.Pool(args.concurrency) as pool:
+                    deadline = time.time() + 1 + args.duration
+                    jobs = [(port, count, args.seed + n, deadline, args.read_only) for n in range(args.concurrency)]
+                    pending = pool.starmap_async(load_worker, jobs)
+                    if options is not None:
+                        snapshotter = Snapshotter(db_path, os.path.join(tmp, 'snapshots'), keep=1, **options)
+                        time.sleep(1)
+                        while True:
+                            start = time.perf_counter()
+                            size = snapshotter.snapshot()['bytes']
+                            durations.append(time.perf_counter() - start)
+                            if time.time() >= deadline:
+                                break
+                    samples, errors = [], 0
+                    for worker_samples, worker_errors in pending.get():
+                        samples += [value for values in worker_samples.values() for value in values]
+                        errors += sum(worker_errors.values())
+                if label == 'warm-up':
+                    continue
+                results[label] = summarize(samples, args.duration)
+                results[label]['errors'] = errors
+                print_summary(label, results[label])
+                if durations:
+                    name = f'{label} snapshot'
+                    results[name] = summarize(durations)
+                    results[name]['mb'] = size / 1e6
+                    print(f'{name:<28} {len(durations)} taken, {statistics.mean(durations):.2f} s each, '
+                          f'{size / 1e6:.0f} MB')
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+class LoadClient:
+    """One keep-alive connection issuing requests for the load generator."""
+    def __init__(self, host, port, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.conn = None
+    
+    def request(self, method, path, body=None, headers=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        return response.status
+    
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def load_scenario(count, rng, read_only=False):
+    """(weight, route name, request factory) for a realistic request mix."""
+    form = {'Content-Type': 'application/x-www-form-urlencoded'}
+    as_json = {'Content-Type': 'application/json'}
+
+    def new_link():
+        return {'description': f'load {rng.random()}', 'tags': rng.choice(TAGS),
+                'url': f'https://load.example.com/{rng.random()}', 'file_group': rng.choice(GROUPS)}
+
+    reads = [
+        (30, 'GET /', lambda: ('GET', '/', None, None)),
+        (10, 'GET /?group', lambda: ('GET', '/?' + urllib.parse.urlencode(
+            {'group': rng.choice(GROUPS[:10]), 'sort': rng.choice(('id', 'description', 'url'))}), None, None)),
+        (10, 'GET /?tags', lambda: ('GET', '/?' + urllib.parse.urlencode(
+            {'tags': ','.join(rng.sample(TAGS[:30], rng.randint(1, 2)))}), None, None)),
+        (20, 'GET /search', lambda: ('GET', '/search?' + urllib.parse.urlencode(
+            {'q': rng.choice(WORDS)}), None, None)),
+        (5, 'GET /stats', lambda: ('GET', '/stats', None, None)),
+        (2, 'GET /export/csv', lambda: ('GET', '/export/csv?' + urllib.parse.urlencode(
+            {'group': rng.choice(GROUPS[-20:])}), None, None)),
+        (2, 'GET /export/json', lambda: ('GET', '/export/json?' + urllib.parse.urlencode(
+            {'q': 'podcast weekly'}), None, None)),
+        (8, 'GET /api/links', lambda: ('GET', f'/api/links/{rng.randint(1, count)}', None, None)),
+    ]
+    writes = [
+        (4, 'POST /add', lambda: ('POST', '/add', urllib.parse.urlencode(new_link()), form)),
+        (3, 'POST /edit', lambda: ('POST', f'/edit/{rng.randint(1, count)}',
+                                   urllib.parse.urlencode(new_link()), form)),
+        (2, 'POST /delete', lambda: ('POST', f'/delete/{rng.randint(1, count)}', '', form)),
+        (2, 'PATCH /api/links', lambda: ('PATCH', f'/api/links/{rng.randint(1, count)}',
+                                         json.dumps({'tags': rng.choice(TAGS)}), as_json)),
+        (2, 'POST /api/links:batch', lambda: ('POST', '/api/links:batch', json.dumps(
+            {'operations': [{'op': 'create', 'link': new_link()} for _ in range(100)]}), as_json)),
+    ]
+    return reads if read_only else reads + writes
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path, args):
+    """Run app.py in a child process and wait until it accepts connections."""
+    port = free_port()
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    command = [sys.executable, app_path, '--host', '127.0.0.1', '--port', str(port),
+               '--db', db_path, '--mode', args.server_mode]
+    if args.server_mode == 'prefork':
+        command += ['--workers', str(args.workers)]
+    if args.replica_mb:
+        command += ['--replica-mb', str(args.replica_mb)]
+    if args.write_batch is not None:
+        command += ['--write-batch', str(args.write_batch)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'server exited with status {server.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, port
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('server did not start')
+
+
+def load_worker(port, count, seed, deadline, read_only):
+    """One load client; runs in its own process so clients do not share a GIL."""
+    rng = random.Random(seed)
+    scenario = load_scenario(count, rng, read_only)
+    weights = [weight for weight, _, _ in scenario]
+    client = LoadClient('127.0.0.1', port)
+    samples, errors = {}, {}
+    while time.time() < deadline:
+        _, name, make = rng.choices(scenario, weights)[0]
+        method, path, body, headers = make()
+        start = time.perf_counter()
+        try:
+            status = client.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            status = None
+        elapsed = time.perf_counter() - start
+        if status is None or status >= 500:
+            errors[name] = errors.get(name, 0) + 1
+        else:
+            samples.setdefault(name, []).append(elapsed)
+    client.close()
+    return samples, errors
+
+
+def bench_load(args):
+    """Drive a real server process with concurrent keep-alive clients."""
+    source = dataset(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        copy_database(source, db_path)
+        count = parse_size(args.size)
+        server, port = start_server(db_path, args)
+        samples, errors = {}, {}
+        try:
+            print(f'{count} links, {args.concurrency} clients for {args.duration} s against '
+                  f'{args.server_mode} server', flush=True)
+            with multiprocessing.Pool(args.concurrency) as pool:
+                # Leave the pool a moment to start so every client gets the full duration.
+                deadline = time.time() + 1 + args.duration
+                jobs = [(port, count, args.seed + n, deadline, args.read_only) for n in range(args.concurrency)]
+                for worker_samples, worker_errors in pool.starmap(load_worker, jobs):
+                    for name, values in worker_samples.items():
+                        samples.setdefault(name, []).extend(values)
+                    for name, value in worker_errors.items():
+                        errors[name] = errors.get(name, 0) + value
+        finally:
+            server.terminate()
+            server.wait()
+        results = {}
+        for name in sorted(samples):
+            results[name] = summarize(samples[name], args.duration)
+            results[name]['errors'] = errors.pop(name, 0)
+            print_summary(name, results[name], 24)
+        failed = sum(errors.values()) + sum(result['errors'] for result in results.values())
+        everything = [value for values in samples.values() for value in values]
+        if everything:
+            results['total'] = summarize(everything, args.duration)
+            results['total']['errors'] = failed
+            print_summary('total', results['total'], 24)
+        print(f'errors: {failed}')
+    return results
+
+
+# Metrics where a bigger number is better; for the rest (latencies) smaller is better.
+HIGHER_IS_BETTER = ('ops_per_s', 'rows_per_s')
+
+
+def compare(results, baseline, tolerance):
+    """Print each metric next to the baseline; return the names that regressed."""
+    regressions = []
+    for name, metrics in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        changes = []
+        for metric in ('ops_per_s', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if metric not in metrics or not before.get(metric):
+                continue
+            change = metrics[metric] / before[metric] - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ' !' if worse > tolerance else ''
+            if flag:
+                regressions.append(f'{name} {metric}')
+            changes.append(f'{metric} {change * 100:+6.1f}%{flag}')
+        print(f'{name:<28} ' + '   '.join(changes))
+    return regressions
+
+
+BENCHMARKS = {
+    'changes': bench_changes,
+    'clicks': bench_clicks,
+    'compress': bench_compress,
+    'export': bench_export,
+    'health': bench_health,
+    'import': bench_import,
+    'load': bench_load,
+    'manager': bench_manager,
+    'pool': bench_pool,
+    'render': bench_render,
+    'replica': bench_replica,
+    'snapshot': bench_snapshot,
+    'suggest': bench_suggest,
+    'writes': bench_writes,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--size', default='10k',
+                        help='synthetic database for manager/load: 10k, 100k, 1m or a number of links')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'links-benchmark'),
+                        help='where synthetic databases are cached between runs')
+    parser.add_argument('--max-seconds', type=float, default=3.0,
+                        help='time limit per manager microbenchmark')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent load clients')
+    parser.add_argument('--server-mode', default='threaded', choices=['single', 'threaded', 'prefork', 'asyncio'])
+    parser.add_argument('--workers', type=int, default=2, help='worker processes for a prefork server')
+    parser.add_argument('--replica-mb', type=int, default=0,
+                        help='in-memory replica budget for manager/load (0: none) and replica (0: 4096)')
+    parser.add_argument('--write-batch', type=int,
+                        help='group commit batch size for the load server (0: off) and writes (default 256)')
+    parser.add_argument('--read-only', action='store_true', help='leave the write routes out of the load mix')
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='relative change counted as a regression (default 0.10)')
+    args = parser.parse_args()
+    results = BENCHMARKS[args.benchmark](args)
+    if results is None:
+        return
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'benchmark': args.benchmark,
+                'size': args.size,
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'args': {name: value for name, value in vars(args).items()
+                         if name not in ('output', 'baseline')},
+                'results': results,
+            }, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f'\ncompared with {args.baseline} ({baseline.get("time")}):')
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) beyond {args.tolerance:.0%}: ' + ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()